@@ -0,0 +1,142 @@
+"""
+AI服务熔断器
+
+每个服务一个熔断器，统计最近 window 次调用中失败（异常或超过 slow_call_seconds
+的慢调用）所占比例：
+- closed:    正常调用；失败率达到 failure_rate 且样本数不少于 min_calls 时打开
+- open:      直接拒绝调用，open_seconds 后进入半开
+- half_open: 只放行 half_open_calls 个探测调用，全部成功则关闭，任一失败重新打开
+
+服务故障期间，路由到该服务的请求只需一次状态判断，不再等待30秒超时。
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Dict
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """单个服务的熔断器"""
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 slow_call_seconds: float = 20, open_seconds: float = 30, half_open_calls: int = 1):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.opened = 0
+
+    def available(self) -> bool:
+        """是否可以把请求路由到该服务（不占用半开探测名额）"""
+        with self._lock:
+            self._maybe_half_open()
+            if self.state == OPEN:
+                return False
+            if self.state == HALF_OPEN:
+                return self._probes < self.half_open_calls
+            return True
+
+    def allow(self) -> bool:
+        """调用前检查；半开状态下占用一个探测名额"""
+        with self._lock:
+            self._maybe_half_open()
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self, latency: float):
+        """记录一次成功调用；慢调用按失败计"""
+        if latency >= self.slow_call_seconds:
+            self.record_failure()
+            return
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._close()
+                return
+            self._add_outcome(False)
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._open()
+                return
+            if self.state == OPEN:
+                return
+            self._add_outcome(True)
+            calls = len(self._outcomes)
+            if calls >= self.min_calls and self._failures / calls >= self.failure_rate:
+                self._open()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._maybe_half_open()
+            calls = len(self._outcomes)
+            return {
+                'state': self.state,
+                'calls': calls,
+                'failures': self._failures,
+                'failure_rate': self._failures / calls if calls else 0.0,
+                'rejected': self.rejected,
+                'opened': self.opened
+            }
+
+    def _add_outcome(self, failed: bool):
+        """记录调用结果并维护窗口内的失败数，调用方需持有锁"""
+        if len(self._outcomes) == self._outcomes.maxlen and self._outcomes[0]:
+            self._failures -= 1
+        self._outcomes.append(failed)
+        if failed:
+            self._failures += 1
+
+    def _maybe_half_open(self):
+        # 打开超过open_seconds后进入半开；半开的探测调用迟迟没有结果时（例如流被中途放弃）
+        # 同样在open_seconds后重新放行探测，避免一直停留在半开状态
+        if self.state != CLOSED and time.monotonic() - self._opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self._opened_at = time.monotonic()
+            self._probes = 0
+            self._probe_successes = 0
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+
+    def _close(self):
+        self.state = CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+
+def create_circuit_breaker(name: str) -> CircuitBreaker:
+    """按环境变量配置创建熔断器"""
+    return CircuitBreaker(
+        name,
+        window=int(os.getenv('AI_BREAKER_WINDOW', 20)),
+        min_calls=int(os.getenv('AI_BREAKER_MIN_CALLS', 5)),
+        failure_rate=float(os.getenv('AI_BREAKER_FAILURE_RATE', 0.5)),
+        slow_call_seconds=float(os.getenv('AI_BREAKER_SLOW_CALL', 20)),
+        open_seconds=float(os.getenv('AI_BREAKER_OPEN_SECONDS', 30)),
+        half_open_calls=int(os.getenv('AI_BREAKER_HALF_OPEN_CALLS', 1))
+    )
@@ -0,0 +1,68 @@
+"""
+AI服务并发上限
+
+每个服务同时进行中的调用数不超过 limit（AI_PROVIDER_CONCURRENCY，可按服务用
+AI_PROVIDER_CONCURRENCY_<服务名大写> 覆盖）：
+- 选择模型时跳过已满的服务（全部已满时不跳过，由调用等待空位）
+- 调用前最多等待 acquire_timeout 秒，仍没有空位时按调用失败处理（不计入熔断器）
+
+请求并发由 app.py 的调度器控制，这里只防止某个服务被打满，例如一个服务变慢时
+占住所有工作线程。
+"""
+
+import os
+import time
+import threading
+from typing import Any, Dict
+
+class ProviderLimiter:
+    """单个服务的并发计数"""
+
+    def __init__(self, name: str, limit: int, acquire_timeout: float = 2.0):
+        self.name = name
+        self.limit = limit
+        self.acquire_timeout = acquire_timeout
+        self.in_flight = 0
+        self.peak = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def available(self) -> bool:
+        return self.in_flight < self.limit
+
+    def acquire(self, timeout: float = None) -> bool:
+        """占用一个名额，超时返回False"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= self.limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += 1
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'peak': self.peak,
+            'rejected': self.rejected
+        }
+
+def create_provider_limiter(name: str) -> ProviderLimiter:
+    """按环境变量配置创建服务并发上限"""
+    default = int(os.getenv('AI_PROVIDER_CONCURRENCY', 8))
+    return ProviderLimiter(
+        name,
+        limit=int(os.getenv(f'AI_PROVIDER_CONCURRENCY_{name.upper()}', default)),
+        acquire_timeout=float(os.getenv('AI_PROVIDER_ACQUIRE_TIMEOUT', 2))
+    )
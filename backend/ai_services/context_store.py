@@ -0,0 +1,124 @@
+"""
+会话级对话上下文存储
+
+各AI服务不再在共享实例上保存一份全局的conversation_history，而是按
+(服务, 用户, session_id) 保存各自会话的上下文：
+- 每个会话最多保留 max_messages 条消息
+- 会话总数超过 max_sessions 时按LRU淘汰最久未使用的会话
+- 缓存未命中时通过loader从chat_messages表懒加载历史，loader只返回属于该用户的会话
+
+session_id由客户端传入，上下文必须同时按用户隔离，否则猜到他人的session_id
+就能读到或写入别人的对话上下文。
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# loader(owner, session_id, limit) -> [{'role': 'user'|'assistant', 'content': str}, ...]
+# 会话不属于owner时应返回空列表
+HistoryLoader = Callable[[Any, str, int], List[Dict[str, str]]]
+
+class SessionContextStore:
+    """按会话隔离、有界且LRU淘汰的对话上下文存储"""
+
+    def __init__(self, max_sessions: int = 10000, max_messages: int = 20,
+                 loader: Optional[HistoryLoader] = None):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.loader = loader
+        self._sessions: "OrderedDict[Tuple[str, Any, str], deque]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_loader(self, loader: Optional[HistoryLoader]):
+        """设置缓存未命中时的历史加载函数"""
+        self.loader = loader
+
+    def get_history(self, namespace: str, owner: Any, session_id: Optional[str],
+                    limit: Optional[int] = None) -> List[Dict[str, str]]:
+        """获取owner的会话上下文（副本），未命中时懒加载"""
+        if not session_id:
+            return []
+
+        key = (namespace, owner, session_id)
+        with self._lock:
+            history = self._sessions.get(key)
+            if history is not None:
+                self._sessions.move_to_end(key)
+                return self._tail(history, limit)
+
+        # 在锁外加载，避免数据库I/O阻塞其他会话
+        loaded = self._load(owner, session_id)
+        with self._lock:
+            history = self._sessions.get(key)
+            if history is None:
+                history = deque(loaded, maxlen=self.max_messages)
+                self._sessions[key] = history
+                self._evict()
+            else:
+                self._sessions.move_to_end(key)
+            return self._tail(history, limit)
+
+    def append_turn(self, namespace: str, owner: Any, session_id: Optional[str],
+                    user_message: str, ai_response: str):
+        """向owner的会话追加一轮对话"""
+        if not session_id:
+            return
+
+        key = (namespace, owner, session_id)
+        with self._lock:
+            history = self._sessions.get(key)
+            if history is None:
+                history = deque(maxlen=self.max_messages)
+                self._sessions[key] = history
+            else:
+                self._sessions.move_to_end(key)
+            history.append({"role": "user", "content": user_message})
+            history.append({"role": "assistant", "content": ai_response})
+            self._evict()
+
+    def clear(self, namespace: Optional[str] = None, session_id: Optional[str] = None):
+        """清空上下文；不指定参数时清空全部"""
+        with self._lock:
+            if namespace is None and session_id is None:
+                self._sessions.clear()
+                return
+            for key in [k for k in self._sessions
+                        if (namespace is None or k[0] == namespace)
+                        and (session_id is None or k[2] == session_id)]:
+                del self._sessions[key]
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _tail(self, history: deque, limit: Optional[int]) -> List[Dict[str, str]]:
+        """返回最近的limit条消息"""
+        items = list(history)
+        if limit is not None and len(items) > limit:
+            items = items[-limit:]
+        return items
+
+    def _evict(self):
+        """淘汰最久未使用的会话，调用方需持有锁"""
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _load(self, owner: Any, session_id: str) -> List[Dict[str, str]]:
+        """通过loader加载owner的会话历史"""
+        if self.loader is None:
+            return []
+        try:
+            return list(self.loader(owner, session_id, self.max_messages) or [])[-self.max_messages:]
+        except Exception as e:
+            logger.error(f"加载会话上下文失败 {session_id}: {e}")
+            return []
+
+# 全局实例
+context_store = SessionContextStore(
+    max_sessions=int(os.getenv('AI_CONTEXT_MAX_SESSIONS', 10000)),
+    max_messages=int(os.getenv('AI_CONTEXT_MAX_MESSAGES', 20))
+)
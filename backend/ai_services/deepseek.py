@@ -1,105 +1,128 @@
-from typing import Optional, Any, Dict
-import os
-import logging
-import time
-import requests
-
-logger = logging.getLogger(__name__)
-
-class DeepSeekAI:
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-
-    def _test_connection(self) -> bool:
-        """测试与DeepSeek API的连接"""
-        try:
-            # 测试基础连接
-            response = requests.get(
-                "https://api.deepseek.com/v1/models",
-                headers={"Authorization": f"Bearer {self.api_key}"},
-                timeout=10
-            )
-            logger.info(f"DeepSeek connection test status: {response.status_code}")
-            return response.status_code == 200
-        except requests.exceptions.Timeout:
-            logger.error("DeepSeek connection test timeout")
-            return False
-        except requests.exceptions.ConnectionError:
-            logger.error("DeepSeek connection test connection error")
-            return False
-        except Exception as e:
-            logger.error(f"DeepSeek connection test failed: {e}")
-            return False
-
-    def generate_response(self, prompt: str, context: Optional[str] = None, user_id: str = 'user1') -> str:
-        """生成DeepSeek AI回复（官方OpenAI兼容接口）"""
-        max_retries = 3
-        retry_delay = 1
-        
-        for attempt in range(max_retries):
-            try:
-                # 构建消息历史
-                messages = []
-                # 官方推荐的system prompt
-                messages.append({
-                    "role": "system",
-                    "content": "You are a helpful assistant"
-                })
-                # 添加对话历史
-                if self.conversation_history:
-                    messages.extend(self.conversation_history)
-                # 添加当前用户消息
-                messages.append({
-                    "role": "user",
-                    "content": prompt
-                })
-                
-                # 移除 self.client 相关API调用，改为 raise NotImplementedError 或 pass
-                raise NotImplementedError("DeepSeekAI 目前未实现 API 调用逻辑，请补充实现。")
-                
-            except Exception as e:
-                error_msg = str(e)
-                logger.error(f"DeepSeek API error (attempt {attempt + 1}/{max_retries}): {error_msg}")
-                
-                # 检查是否是连接错误
-                if "Connection" in error_msg or "timeout" in error_msg.lower():
-                    if attempt < max_retries - 1:
-                        logger.info(f"Retrying in {retry_delay} seconds...")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2  # 指数退避
-                        continue
-                    else:
-                        # 最后一次尝试失败，测试连接
-                        if not self._test_connection():
-                            return "抱歉，DeepSeek AI暂时无法回复，请稍后重试。错误信息：网络连接异常，请检查网络设置。"
-                        else:
-                            return f"抱歉，DeepSeek AI暂时无法回复，请稍后重试。错误信息：Connection error (已重试{max_retries}次)"
-                
-                # 其他错误直接返回
-                return f"抱歉，DeepSeek AI暂时无法回复，请稍后重试。错误信息：{error_msg}"
-        
-        return "抱歉，DeepSeek AI暂时无法回复，请稍后重试。错误信息：Connection error"
-
-    def clear_history(self):
-        """清空对话历史"""
-        self.conversation_history = []
-
-def generate_response(data):
-    """DeepSeek AI服务响应生成函数"""
-    try:
-        api_key = os.getenv('DEEPSEEK_API_KEY')
-        if not api_key:
-            raise Exception("DEEPSEEK_API_KEY not configured")
-        
-        # 验证API密钥格式
-        if not api_key.startswith('sk-'):
-            raise Exception("Invalid API key format")
-        
-        service = DeepSeekAI(api_key)
-        return service.generate_response(
-            prompt=data.get('message', ''),
-            user_id=data.get('user_id', 'user1')
-        )
-    except Exception as e:
-        logger.error(f"DeepSeek service error: {e}")
+from typing import Optional, Any, Dict, Iterator
+import os
+import logging
+
+from .streaming import iter_sse_json, openai_delta_content
+from .transport import get_transport
+from .context_store import context_store
+from .base import ProviderError
+
+logger = logging.getLogger(__name__)
+
+class DeepSeekAI:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+        self.model = "deepseek-chat"
+        # 对话历史按会话保存在context_store中
+        self.history_namespace = "deepseek"
+        self.history_limit = 10
+
+    def _build_request(self, prompt: str, session_id: Optional[str] = None):
+        """构建请求头和请求体"""
+        # 构建消息历史
+        messages = []
+        # 官方推荐的system prompt
+        messages.append({
+            "role": "system",
+            "content": "You are a helpful assistant"
+        })
+        # 添加当前会话的对话历史
+        messages.extend(context_store.get_history(self.history_namespace, session_id, self.history_limit))
+        # 添加当前用户消息
+        messages.append({
+            "role": "user",
+            "content": prompt
+        })
+        
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = {
+            "model": self.model,
+            "messages": messages
+        }
+        return headers, payload
+
+    def _remember(self, session_id: Optional[str], prompt: str, ai_response: str):
+        """更新当前会话的对话历史"""
+        context_store.append_turn(self.history_namespace, session_id, prompt, ai_response)
+
+    def generate_response(self, prompt: str, context: Optional[str] = None, user_id: str = 'user1', session_id: Optional[str] = None) -> str:
+        """生成DeepSeek AI回复（官方OpenAI兼容接口）
+
+        失败时直接抛出ProviderError，不在工作线程里sleep重试；
+        服务持续不可用时由UnifiedAIService的熔断器跳过该模型。
+        """
+        try:
+            headers, payload = self._build_request(prompt, session_id)
+            response = get_transport().post(
+                f"{self.base_url}/chat/completions",
+                headers=headers,
+                json=payload,
+                timeout=30
+            )
+            if response.status_code != 200:
+                raise Exception(f"API request failed with status {response.status_code}: {response.text}")
+            
+            ai_response = response.json()["choices"][0]["message"]["content"]
+            self._remember(session_id, prompt, ai_response)
+            return ai_response
+        except Exception as e:
+            logger.error(f"DeepSeek API error: {e}")
+            raise ProviderError(f"DeepSeek API error: {e}") from e
+
+    def generate_response_stream(self, prompt: str, context: Optional[str] = None, user_id: str = 'user1', session_id: Optional[str] = None) -> Iterator[str]:
+        """流式生成DeepSeek AI回复（OpenAI兼容的SSE接口）"""
+        headers, payload = self._build_request(prompt, session_id)
+        payload["stream"] = True
+        
+        parts = []
+        try:
+            with get_transport().post(
+                f"{self.base_url}/chat/completions",
+                headers=headers,
+                json=payload,
+                timeout=30,
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    raise Exception(f"API request failed with status {response.status_code}: {response.text}")
+                
+                for event in iter_sse_json(response.iter_lines()):
+                    delta = openai_delta_content(event)
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+            
+            # 更新对话历史
+            self._remember(session_id, prompt, ''.join(parts))
+                
+        except Exception as e:
+            logger.error(f"DeepSeek API stream error: {e}")
+            raise ProviderError(f"DeepSeek API stream error: {e}") from e
+
+    def clear_history(self, session_id: Optional[str] = None):
+        """清空对话历史，不指定session_id时清空所有会话"""
+        context_store.clear(self.history_namespace, session_id)
+
+def generate_response(data):
+    """DeepSeek AI服务响应生成函数"""
+    try:
+        api_key = os.getenv('DEEPSEEK_API_KEY')
+        if not api_key:
+            raise Exception("DEEPSEEK_API_KEY not configured")
+        
+        # 验证API密钥格式
+        if not api_key.startswith('sk-'):
+            raise Exception("Invalid API key format")
+        
+        service = DeepSeekAI(api_key)
+        return service.generate_response(
+            prompt=data.get('message', ''),
+            user_id=data.get('user_id', 'user1')
+        )
+    except Exception as e:
+        logger.error(f"DeepSeek service error: {e}")
         return f"DeepSeek服务错误: {str(e)}" 
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+对冲请求（hedged requests）
+
+主请求在 delay 秒内还没有产出第一个增量时，再向同一服务或等价服务发出一个备用请求：
+- 先产出首个增量（或先完成）的请求胜出，之后只转发它的输出
+- 另一个请求被取消：它的线程在下一个增量处停止并关闭生成器，随之关闭HTTP连接，
+  被取消的请求不会写入对话历史
+- 主请求在触发对冲前就失败时直接抛出，由调用方处理（重试不是对冲的职责）
+
+每个请求通过 HedgeOutcome 记录是否触发了对冲、备用请求是否胜出；
+HedgeStats 汇总所有请求的计数。
+"""
+
+import queue
+import time
+import contextvars
+import threading
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+_DONE = object()
+
+class _Failure:
+    __slots__ = ('error',)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+class _Attempt:
+    """在线程中消费一个增量流，把增量放入共享队列"""
+
+    def __init__(self, name: str, open_stream: Callable[[], Iterator[str]], events: "queue.Queue"):
+        self.name = name
+        self.open_stream = open_stream
+        self.events = events
+        self.cancelled = threading.Event()
+        self.finished = False
+
+    def run(self):
+        if self.cancelled.is_set():
+            return
+        stream = None
+        try:
+            stream = self.open_stream()
+            for delta in stream:
+                if self.cancelled.is_set():
+                    return
+                self.events.put((self, delta))
+        except Exception as e:
+            self.events.put((self, _Failure(e)))
+            return
+        finally:
+            # 在本线程内关闭生成器，退出服务中的with块以释放连接
+            if stream is not None and hasattr(stream, 'close'):
+                stream.close()
+        self.events.put((self, _DONE))
+
+    def cancel(self):
+        self.cancelled.set()
+
+class HedgeOutcome:
+    """单个请求的对冲结果"""
+    __slots__ = ('primary', 'winner', 'fired', 'won')
+
+    def __init__(self, primary: str):
+        self.primary = primary
+        self.winner = primary
+        self.fired = False
+        # 备用请求胜出
+        self.won = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'primary': self.primary, 'winner': self.winner, 'fired': self.fired, 'won': self.won}
+
+class HedgeStats:
+    """对冲计数汇总"""
+
+    def __init__(self):
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        self._lock = threading.Lock()
+
+    def add(self, outcome: HedgeOutcome):
+        with self._lock:
+            self.requests += 1
+            self.fired += outcome.fired
+            self.won += outcome.won
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'fired': self.fired,
+            'won': self.won,
+            'fire_rate': self.fired / self.requests if self.requests else 0.0,
+            'win_rate': self.won / self.fired if self.fired else 0.0
+        }
+
+def hedged_stream(primary: Tuple[str, Callable[[], Iterator[str]]], delay: float,
+                  choose_backup: Callable[[], Optional[Tuple[str, Callable[[], Iterator[str]]]]],
+                  executor: Executor, outcome: HedgeOutcome) -> Iterator[str]:
+    """产出胜出请求的增量
+
+    primary/choose_backup返回的都是 (模型名, 打开流的函数)；choose_backup在需要对冲时
+    才调用，返回None表示没有可用的备用服务。
+    """
+    events: "queue.Queue" = queue.Queue()
+    attempts = []
+
+    def launch(name, open_stream):
+        attempt = _Attempt(name, open_stream, events)
+        attempts.append(attempt)
+        # 带上调用方的contextvars（追踪上下文等）
+        executor.submit(contextvars.copy_context().run, attempt.run)
+        return attempt
+
+    launch(*primary)
+    deadline = time.monotonic() + delay
+    winner = None
+    try:
+        # 等待首个增量，超过delay后发出备用请求
+        while winner is None:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                attempt, item = events.get(timeout=timeout)
+            except queue.Empty:
+                deadline = None
+                backup = choose_backup()
+                if backup is not None:
+                    outcome.fired = True
+                    launch(*backup)
+                continue
+            if isinstance(item, _Failure):
+                attempt.finished = True
+                if all(a.finished for a in attempts):
+                    raise item.error
+                continue
+            winner = attempt
+
+        outcome.winner = winner.name
+        outcome.won = winner is not attempts[0]
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancel()
+        if item is _DONE:
+            return
+        yield item
+
+        while True:
+            attempt, item = events.get()
+            if attempt is not winner:
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        # 调用方中途停止消费时取消所有请求
+        for attempt in attempts:
+            attempt.cancel()
@@ -0,0 +1,185 @@
+"""
+统一服务的会话历史存储
+
+替代 UnifiedAIService 上不设上限的 conversation_history / user_preferences 字典：
+- 每轮对话只保存需要的字段（消息、回复、情感/主题/复杂度、时间），不再保存整个context
+  （原来的context里又引用了之前的历史列表）
+- 记录使用 __slots__，每个会话最多保留 max_turns 轮
+- 会话数超过 max_sessions 或总轮数超过 max_total_turns 时按LRU淘汰整个会话
+- 超过 idle_seconds 未访问的会话在写入时顺带清理
+- stats() 提供会话数、轮数和估算的内存占用
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+class Turn:
+    """一轮对话"""
+    __slots__ = ('user_message', 'ai_response', 'sentiment', 'topic', 'complexity', 'timestamp')
+
+    def __init__(self, user_message: str, ai_response: str, sentiment: Optional[str],
+                 topic: Optional[str], complexity: Optional[str], timestamp: float):
+        self.user_message = user_message
+        self.ai_response = ai_response
+        self.sentiment = sentiment
+        self.topic = topic
+        self.complexity = complexity
+        self.timestamp = timestamp
+
+    def footprint(self) -> int:
+        """估算占用的字节数；分类标签是共享的常量字符串，不计入"""
+        return sys.getsizeof(self) + sys.getsizeof(self.user_message) + sys.getsizeof(self.ai_response)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'user_message': self.user_message,
+            'ai_response': self.ai_response,
+            'sentiment': self.sentiment,
+            'topic': self.topic,
+            'complexity': self.complexity,
+            'timestamp': self.timestamp
+        }
+
+class SessionHistory:
+    """单个会话的历史和偏好"""
+    __slots__ = ('turns', 'preferences', 'last_seen', 'overhead')
+
+    def __init__(self, session_id: str, max_turns: int, now: float):
+        self.turns = deque(maxlen=max_turns)
+        self.preferences = None
+        self.last_seen = now
+        # 会话记录、deque和key本身的估算占用（不含各轮对话）
+        self.overhead = sys.getsizeof(self) + sys.getsizeof(self.turns) + sys.getsizeof(session_id)
+
+class ConversationHistoryStore:
+    """有界、LRU + 空闲淘汰的会话历史存储"""
+
+    def __init__(self, max_sessions: int = 10000, max_turns: int = 25,
+                 max_total_turns: int = 100000, idle_seconds: float = 3600):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.max_total_turns = max_total_turns
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, SessionHistory]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._turns = 0
+        self._bytes = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def append(self, session_id: str, user_message: str, ai_response: str, context: Dict[str, Any]):
+        """追加一轮对话，只保留context中的分类标签"""
+        now = time.time()
+        turn = Turn(user_message, ai_response, context.get('sentiment'), context.get('topic'),
+                    context.get('complexity'), now)
+        size = turn.footprint()
+        with self._lock:
+            session = self._touch(session_id, now, create=True)
+            if len(session.turns) == session.turns.maxlen:
+                self._turns -= 1
+                self._bytes -= session.turns[0].footprint()
+            session.turns.append(turn)
+            self._turns += 1
+            self._bytes += size
+            self._expire(now)
+            self._evict()
+
+    def get(self, session_id: str) -> List[Dict[str, Any]]:
+        """会话历史（副本），最早的在前"""
+        with self._lock:
+            session = self._touch(session_id, time.time())
+            if session is None:
+                return []
+            return [turn.to_dict() for turn in session.turns]
+
+    def get_preferences(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return dict(session.preferences) if session is not None and session.preferences else None
+
+    def set_preferences(self, session_id: str, preferences: Dict[str, Any]):
+        with self._lock:
+            session = self._touch(session_id, time.time(), create=True)
+            session.preferences = dict(preferences)
+            self._evict()
+
+    def clear(self, session_id: Optional[str] = None):
+        """清空指定会话，不指定时清空全部"""
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+                self._turns = 0
+                self._bytes = 0
+            elif session_id in self._sessions:
+                self._drop(session_id)
+
+    def sweep(self) -> int:
+        """清理空闲会话，返回清理数量"""
+        with self._lock:
+            return self._expire(time.time())
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'turns': self._turns,
+                'approx_bytes': self._bytes,
+                'evicted': self.evicted,
+                'expired': self.expired
+            }
+
+    def _touch(self, session_id: str, now: float, create: bool = False) -> Optional[SessionHistory]:
+        """取出会话并移到LRU末尾，调用方需持有锁"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = self._sessions[session_id] = SessionHistory(session_id, self.max_turns, now)
+            self._bytes += session.overhead
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_seen = now
+        return session
+
+    def _drop(self, session_id: str):
+        session = self._sessions.pop(session_id)
+        self._turns -= len(session.turns)
+        self._bytes -= session.overhead + sum(turn.footprint() for turn in session.turns)
+
+    def _expire(self, now: float) -> int:
+        """LRU顺序即最近访问顺序，从头部清理空闲会话，调用方需持有锁"""
+        expired = 0
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen < self.idle_seconds:
+                break
+            self._drop(session_id)
+            expired += 1
+        self.expired += expired
+        return expired
+
+    def _evict(self):
+        """超过会话数或总轮数上限时淘汰最久未使用的会话，调用方需持有锁"""
+        while self._sessions and (len(self._sessions) > self.max_sessions
+                                  or self._turns > self.max_total_turns):
+            self._drop(next(iter(self._sessions)))
+            self.evicted += 1
+
+def create_history_store() -> ConversationHistoryStore:
+    """按环境变量配置创建会话历史存储"""
+    return ConversationHistoryStore(
+        max_sessions=int(os.getenv('AI_HISTORY_MAX_SESSIONS', 10000)),
+        max_turns=int(os.getenv('AI_HISTORY_MAX_TURNS', 25)),
+        max_total_turns=int(os.getenv('AI_HISTORY_MAX_TOTAL_TURNS', 100000)),
+        idle_seconds=float(os.getenv('AI_HISTORY_IDLE_SECONDS', 3600))
+    )
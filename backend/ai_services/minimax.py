@@ -1,9 +1,13 @@
 import os
 import logging
-import requests
 import time
 import socket
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator
+
+from .streaming import iter_sse_json, openai_delta_content
+from .transport import get_transport
+from .context_store import context_store
+from .base import ProviderError
 
 logger = logging.getLogger(__name__)
 
@@ -25,15 +29,22 @@ class MinimaxAI:
     def __init__(self, api_key, group_id=None):
         self.api_key = api_key
         self.group_id = group_id
-        self.base_url = "https://api.minimax.chat/v1/text/chatcompletion_v2"
-        self.conversation_history = []
+        self.base_url = os.getenv("MINIMAX_API_URL", "https://api.minimax.chat/v1/text/chatcompletion_v2")
+        # 对话历史按会话保存在context_store中
+        self.history_namespace = "minimax"
+        self.history_limit = 10
 
-    def generate_response(self, prompt, user_id="用户", system_prompt="MiniMax AI"):
+    def _build_request(self, prompt, system_prompt, session_id=None):
+        """构建请求头和消息列表"""
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
         
+        # 如果有group_id，添加到headers中
+        if self.group_id:
+            headers["Group-Id"] = self.group_id
+        
         # 构建消息历史
         messages = []
         
@@ -43,9 +54,8 @@ class MinimaxAI:
             "content": system_prompt
         })
         
-        # 添加对话历史
-        if self.conversation_history:
-            messages.extend(self.conversation_history)
+        # 添加当前会话的对话历史
+        messages.extend(context_store.get_history(self.history_namespace, session_id, self.history_limit))
         
         # 添加当前用户消息
         messages.append({
@@ -59,36 +69,63 @@ class MinimaxAI:
             "temperature": 0.7,
             "max_tokens": 2048
         }
-        
-        # 如果有group_id，添加到headers中
-        if self.group_id:
-            headers["Group-Id"] = self.group_id
+        return headers, payload
+
+    def _remember(self, session_id, prompt, ai_response):
+        """更新当前会话的对话历史"""
+        context_store.append_turn(self.history_namespace, session_id, prompt, ai_response)
+
+    def generate_response(self, prompt, user_id="用户", system_prompt="MiniMax AI", session_id=None):
+        headers, payload = self._build_request(prompt, system_prompt, session_id)
         
         try:
-            response = requests.post(self.base_url, headers=headers, json=payload, timeout=30)
+            response = get_transport().post(self.base_url, headers=headers, json=payload, timeout=30)
             if response.status_code == 200:
                 data = response.json()
                 ai_response = data["choices"][0]["message"]["content"]
                 
                 # 更新对话历史
-                self.conversation_history.append({"role": "user", "content": prompt})
-                self.conversation_history.append({"role": "assistant", "content": ai_response})
-                
-                # 保持对话历史在合理长度内
-                if len(self.conversation_history) > 10:
-                    self.conversation_history = self.conversation_history[-10:]
+                self._remember(session_id, prompt, ai_response)
                 
                 return ai_response
             else:
-                logger.error(f"MiniMax API error: {response.status_code} - {response.text}")
-                return f"抱歉，MiniMax AI暂时无法回复，请稍后重试。错误信息：{response.text}"
+                raise ProviderError(f"MiniMax API error: {response.status_code} - {response.text}")
+        except ProviderError as e:
+            logger.error(str(e))
+            raise
         except Exception as e:
             logger.error(f"MiniMax API exception: {e}")
-            return f"抱歉，MiniMax AI暂时无法回复，请稍后重试。错误信息：{e}"
+            raise ProviderError(f"MiniMax API exception: {e}") from e
+
+    def generate_response_stream(self, prompt, user_id="用户", system_prompt="MiniMax AI", session_id=None) -> Iterator[str]:
+        """流式生成回复，逐块产出增量文本"""
+        headers, payload = self._build_request(prompt, system_prompt, session_id)
+        payload["stream"] = True
+        parts = []
+        
+        try:
+            with get_transport().post(self.base_url, headers=headers, json=payload, timeout=30, stream=True) as response:
+                if response.status_code != 200:
+                    raise ProviderError(f"MiniMax API error: {response.status_code} - {response.text}")
+                
+                for event in iter_sse_json(response.iter_lines()):
+                    delta = openai_delta_content(event)
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+                
+                self._remember(session_id, prompt, ''.join(parts))
+        except ProviderError as e:
+            logger.error(str(e))
+            raise
+        except Exception as e:
+            # 已经输出部分内容时也抛出，由调用方决定如何结束流
+            logger.error(f"MiniMax API stream exception: {e}")
+            raise ProviderError(f"MiniMax API stream exception: {e}") from e
 
-    def clear_history(self):
-        """清空对话历史"""
-        self.conversation_history = []
+    def clear_history(self, session_id=None):
+        """清空对话历史，不指定session_id时清空所有会话"""
+        context_store.clear(self.history_namespace, session_id)
 
 def generate_response(data):
     """MiniMax AI服务响应生成函数"""
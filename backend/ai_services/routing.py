@@ -0,0 +1,309 @@
+"""
+模型路由引擎
+
+替代 _select_ai_models 中写死的if链：
+- 路由策略在JSON文件中声明（默认 ai_services/routing_policy.json，可通过
+  AI_ROUTING_POLICY 指定），文件修改后自动重新加载
+- 按服务统计最近调用的p50/p95延迟、错误率和token消耗
+- 选择模型时排除违反SLO（p95延迟、错误率）的服务，并按单次请求预算限制模型数量
+- 对冲：主模型超过其首字节延迟的历史分位数仍未产出内容时，向备用模型发出第二个请求
+  （见 hedging.py）
+
+策略格式见 routing_policy.json；benchmarks/replay_routing.py 可以用录制的
+流量对策略打分。
+"""
+
+import os
+import json
+import math
+import time
+import random
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'routing_policy.json')
+
+# 策略文件缺失或无法解析时使用的最小策略
+FALLBACK_POLICY = {
+    'name': 'fallback',
+    'max_models': 1,
+    'default': ['minimax', 'deepseek', 'stepchat']
+}
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数（服务商未返回用量时使用），中文约每1.5个字符一个token"""
+    return max(1, math.ceil(len(text or '') / 1.5))
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """已排序序列的分位数（最近秩法）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class ProviderStats:
+    """单个服务最近window次调用的延迟、首字节延迟、错误和token统计"""
+
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+        self.first_bytes = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.tokens = deque(maxlen=window)
+        self._errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool, tokens: int = 0, first_byte: Optional[float] = None):
+        with self._lock:
+            if first_byte is not None:
+                self.first_bytes.append(first_byte)
+            if len(self.outcomes) == self.outcomes.maxlen and not self.outcomes[0]:
+                self._errors -= 1
+            self.outcomes.append(ok)
+            if not ok:
+                self._errors += 1
+                return
+            self.latencies.append(latency)
+            if tokens:
+                self.tokens.append(tokens)
+
+    @property
+    def samples(self) -> int:
+        return len(self.outcomes)
+
+    def latency_percentile(self, pct: float) -> float:
+        with self._lock:
+            values = sorted(self.latencies)
+        return percentile(values, pct)
+
+    def first_byte_percentile(self, pct: float) -> float:
+        with self._lock:
+            values = sorted(self.first_bytes)
+        return percentile(values, pct)
+
+    def error_rate(self) -> float:
+        return self._errors / len(self.outcomes) if self.outcomes else 0.0
+
+    def avg_tokens(self) -> Optional[float]:
+        with self._lock:
+            return sum(self.tokens) / len(self.tokens) if self.tokens else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            values = sorted(self.latencies)
+            first_bytes = sorted(self.first_bytes)
+        return {
+            'samples': self.samples,
+            'p50_ms': round(percentile(values, 50) * 1000, 1),
+            'p95_ms': round(percentile(values, 95) * 1000, 1),
+            'first_byte_p95_ms': round(percentile(first_bytes, 95) * 1000, 1),
+            'error_rate': self.error_rate(),
+            'avg_tokens': self.avg_tokens()
+        }
+
+class RoutingEngine:
+    """按策略选择模型组合，并维护各服务的实时统计"""
+
+    def __init__(self, policy_path: Optional[str] = None, policy: Optional[Dict[str, Any]] = None,
+                 reload_interval: float = 5.0, rng: Optional[random.Random] = None):
+        self.policy_path = policy_path
+        self.reload_interval = reload_interval
+        self.rng = rng or random.Random()
+        self.stats: Dict[str, ProviderStats] = {}
+        self._stats_lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self.policy = policy if policy is not None else FALLBACK_POLICY
+        if policy is None and policy_path:
+            self._load()
+
+    # ---- 策略加载 ----
+
+    def _load(self):
+        try:
+            self._mtime = os.path.getmtime(self.policy_path)
+        except OSError:
+            logger.warning(f"路由策略文件不存在，使用当前策略: {self.policy_path}")
+            return
+        try:
+            with open(self.policy_path, 'r', encoding='utf-8') as f:
+                policy = json.load(f)
+            if not isinstance(policy, dict):
+                raise ValueError('策略必须是JSON对象')
+        except Exception as e:
+            # 新文件有误时保留当前策略，直到文件再次修改
+            logger.error(f"加载路由策略失败: {e}")
+            return
+        self.policy = policy
+        logger.info(f"已加载路由策略: {policy.get('name', self.policy_path)}")
+
+    def maybe_reload(self):
+        """策略文件修改后重新加载，最多每reload_interval秒检查一次"""
+        if not self.policy_path:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.policy_path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self._load()
+
+    # ---- 统计 ----
+
+    def provider_stats(self, model_name: str) -> ProviderStats:
+        stats = self.stats.get(model_name)
+        if stats is None:
+            with self._stats_lock:
+                stats = self.stats.setdefault(model_name, ProviderStats())
+        return stats
+
+    def record(self, model_name: str, latency: float, ok: bool, tokens: int = 0,
+               first_byte: Optional[float] = None):
+        """记录一次服务调用，first_byte为产出首个增量的耗时"""
+        self.provider_stats(model_name).record(latency, ok, tokens, first_byte)
+
+    # ---- 选择 ----
+
+    def select(self, context: Dict[str, Any], available: Iterable[str]) -> List[str]:
+        """根据上下文和策略从available中选择模型组合"""
+        self.maybe_reload()
+        policy = self.policy
+        available = list(available)
+        if not available:
+            return []
+
+        healthy = [name for name in available if self._meets_slo(name, policy)]
+        # 所有服务都违反SLO时仍然要回复，退回到全部可用服务
+        candidates = healthy or available
+
+        selected = []
+        for rule in policy.get('rules', []):
+            if all(context.get(key) == value for key, value in rule.get('when', {}).items()):
+                for name in rule.get('prefer', []):
+                    if name in candidates and name not in selected:
+                        selected.append(name)
+
+        # 确保至少有一个模型：按默认优先级选择
+        if not selected:
+            for name in policy.get('default', []):
+                if name in candidates:
+                    selected.append(name)
+                    break
+        if not selected:
+            selected.append(self._fastest(candidates))
+
+        # 随机添加第二个模型以增加多样性
+        if len(selected) == 1 and self.rng.random() < policy.get('second_model_probability', 0):
+            remaining = [name for name in candidates if name not in selected]
+            if remaining:
+                selected.append(self.rng.choice(remaining))
+
+        selected = selected[:max(1, policy.get('max_models', len(selected)))]
+        return self._apply_budget(selected, policy)
+
+    def _meets_slo(self, model_name: str, policy: Dict[str, Any]) -> bool:
+        slo = policy.get('slo') or {}
+        stats = self.stats.get(model_name)
+        if stats is None or stats.samples < slo.get('min_samples', 20):
+            # 样本不足时不做判断
+            return True
+        if 'max_error_rate' in slo and stats.error_rate() > slo['max_error_rate']:
+            return False
+        if 'p95_ms' in slo and stats.latency_percentile(95) * 1000 > slo['p95_ms']:
+            return False
+        return True
+
+    def _fastest(self, candidates: List[str]) -> str:
+        """p50延迟最低的服务，没有统计的服务视为最快"""
+        return min(candidates, key=lambda name: self.provider_stats(name).latency_percentile(50))
+
+    def estimated_cost(self, model_name: str, policy: Optional[Dict[str, Any]] = None) -> float:
+        """按历史平均token数估算单次调用成本"""
+        policy = policy or self.policy
+        price = (policy.get('providers', {}).get(model_name) or {}).get('cost_per_1k_tokens', 0)
+        tokens = self.provider_stats(model_name).avg_tokens()
+        if tokens is None:
+            tokens = (policy.get('budget') or {}).get('default_tokens_per_call', 0)
+        return price * tokens / 1000.0
+
+    def _apply_budget(self, selected: List[str], policy: Dict[str, Any]) -> List[str]:
+        """超出单次请求预算时从后往前去掉模型，至少保留一个"""
+        limit = (policy.get('budget') or {}).get('max_cost_per_request')
+        if limit is None:
+            return selected
+        while len(selected) > 1 and sum(self.estimated_cost(name, policy) for name in selected) > limit:
+            selected = selected[:-1]
+        return selected
+
+    # ---- 对冲 ----
+
+    def hedging_enabled(self) -> bool:
+        return bool((self.policy.get('hedge') or {}).get('enabled'))
+
+    def hedge_delay(self, model_name: str) -> Optional[float]:
+        """主模型超过该时间（秒）仍未产出首个增量时发出备用请求；未开启或样本不足时返回None"""
+        hedge = self.policy.get('hedge') or {}
+        if not hedge.get('enabled'):
+            return None
+        stats = self.stats.get(model_name)
+        if stats is None or len(stats.first_bytes) < hedge.get('min_samples', 20):
+            return None
+        delay = stats.first_byte_percentile(hedge.get('percentile', 95))
+        return max(delay, hedge.get('min_delay_ms', 0) / 1000.0)
+
+    def backup_for(self, model_name: str, available: Iterable[str], exclude: Iterable[str] = ()) -> Optional[str]:
+        """为主模型挑选备用模型：满足SLO且p50最低的其他服务"""
+        hedge = self.policy.get('hedge') or {}
+        if hedge.get('same_provider'):
+            return model_name
+        excluded = set(exclude) | {model_name}
+        candidates = [name for name in available
+                      if name not in excluded and self._meets_slo(name, self.policy)]
+        if not candidates:
+            return None
+        return self._fastest(candidates)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'policy': self.policy.get('name'),
+            'providers': {name: stats.snapshot() for name, stats in list(self.stats.items())}
+        }
+
+class TrafficRecorder:
+    """把每轮请求的路由上下文和各模型调用结果追加到JSONL文件，供回放打分"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, context: Dict[str, Any], selected: List[str], calls: Dict[str, Dict[str, Any]]):
+        line = json.dumps({
+            'ts': time.time(),
+            'context': {key: context.get(key) for key in ('sentiment', 'topic', 'complexity', 'message_length')},
+            'selected': selected,
+            'calls': calls
+        }, ensure_ascii=False)
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except Exception as e:
+            logger.error(f"记录路由流量失败: {e}")
+
+def create_traffic_recorder() -> Optional[TrafficRecorder]:
+    """设置AI_ROUTING_RECORD时返回流量录制器"""
+    path = os.getenv('AI_ROUTING_RECORD')
+    return TrafficRecorder(path) if path else None
+
+def create_routing_engine() -> RoutingEngine:
+    """按环境变量创建路由引擎"""
+    return RoutingEngine(
+        policy_path=os.getenv('AI_ROUTING_POLICY', DEFAULT_POLICY_PATH),
+        reload_interval=float(os.getenv('AI_ROUTING_RELOAD_INTERVAL', 5))
+    )
@@ -0,0 +1,180 @@
+"""
+跨会话的语义回复缓存
+
+按「规范化后的提问指纹 + 所选模型组合与风格」缓存整合后的回复：
+- 精确命中：规范化（全角转半角、小写、去标点和空白）后的指纹相同
+- 近似命中：同一模型组合下，字符n-gram的Jaccard相似度不低于阈值
+  （中文没有天然分词，字符n-gram不依赖分词和外部模型）
+- 条目有TTL，总数超过上限时按LRU淘汰，同时从倒排索引中移除
+
+缓存的回复不包含会话上下文，因此默认关闭（AI_SEMANTIC_CACHE=true开启），
+适用于FAQ类的重复提问。
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Dict, FrozenSet, Hashable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 标点（Unicode类别P*）、符号（S*）和空白都不影响提问的含义
+_IGNORED = re.compile(r'[\s\W_]+', re.UNICODE)
+
+def normalize_prompt(text: str) -> str:
+    """规范化提问文本"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return _IGNORED.sub('', text)
+
+def fingerprint(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+def char_ngrams(normalized: str, n: int = 2) -> FrozenSet[str]:
+    """字符n-gram集合，文本短于n时使用整个文本"""
+    if len(normalized) <= n:
+        return frozenset([normalized]) if normalized else frozenset()
+    return frozenset(normalized[i:i + n] for i in range(len(normalized) - n + 1))
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    inter = len(a & b)
+    return inter / (len(a) + len(b) - inter)
+
+class _Entry:
+    __slots__ = ('partition', 'fingerprint', 'grams', 'value', 'expire_time')
+
+    def __init__(self, partition, fingerprint, grams, value, expire_time):
+        self.partition = partition
+        self.fingerprint = fingerprint
+        self.grams = grams
+        self.value = value
+        self.expire_time = expire_time
+
+class SemanticCache:
+    """精确指纹 + n-gram近似匹配的有界回复缓存"""
+
+    def __init__(self, max_entries: int = 5000, ttl: int = 3600, threshold: float = 0.85,
+                 ngram: int = 2, max_prompt_chars: int = 500, max_candidates: int = 50):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.ngram = ngram
+        # 过长的提问通常依赖上下文，不参与缓存
+        self.max_prompt_chars = max_prompt_chars
+        self.max_candidates = max_candidates
+        # (partition, fingerprint) -> _Entry，按LRU顺序
+        self._entries: "OrderedDict[Tuple[Hashable, str], _Entry]" = OrderedDict()
+        # (partition, gram) -> 包含该gram的条目key集合
+        self._index: Dict[Tuple[Hashable, str], Set[Tuple[Hashable, str]]] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, prompt: str, partition: Hashable) -> Optional[Tuple[Any, float]]:
+        """查找缓存，返回 (缓存值, 相似度)；未命中返回None"""
+        normalized = normalize_prompt(prompt)
+        if not normalized or len(normalized) > self.max_prompt_chars:
+            return None
+        key = (partition, fingerprint(normalized))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expire_time > now:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry.value, 1.0
+            if entry is not None:
+                self._remove(key)
+
+            if self.threshold < 1.0:
+                match = self._find_similar(partition, char_ngrams(normalized, self.ngram), now)
+                if match is not None:
+                    self.similar_hits += 1
+                    return match
+            self.misses += 1
+            return None
+
+    def put(self, prompt: str, partition: Hashable, value: Any, ttl: Optional[int] = None):
+        normalized = normalize_prompt(prompt)
+        if not normalized or len(normalized) > self.max_prompt_chars:
+            return
+        key = (partition, fingerprint(normalized))
+        entry = _Entry(partition, key[1], char_ngrams(normalized, self.ngram), value,
+                       time.time() + (self.ttl if ttl is None else ttl))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            for gram in entry.grams:
+                self._index.setdefault((partition, gram), set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'exact_hits': self.exact_hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+            'hit_rate': (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'threshold': self.threshold
+        }
+
+    def _find_similar(self, partition, grams: FrozenSet[str], now: float) -> Optional[Tuple[Any, float]]:
+        """通过倒排索引找出共享gram最多的候选，再计算相似度，调用方需持有锁"""
+        shared = Counter()
+        for gram in grams:
+            for key in self._index.get((partition, gram), ()):
+                shared[key] += 1
+        best_key, best_score = None, 0.0
+        for key, _ in shared.most_common(self.max_candidates):
+            entry = self._entries[key]
+            if entry.expire_time <= now:
+                continue
+            score = jaccard(grams, entry.grams)
+            if score > best_score:
+                best_key, best_score = key, score
+        if best_key is None or best_score < self.threshold:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key].value, best_score
+
+    def _remove(self, key):
+        """删除条目及其倒排索引，调用方需持有锁"""
+        entry = self._entries.pop(key)
+        for gram in entry.grams:
+            index_key = (entry.partition, gram)
+            keys = self._index.get(index_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[index_key]
+
+def create_semantic_cache() -> Optional[SemanticCache]:
+    """根据环境变量创建语义缓存，未开启时返回None"""
+    if os.getenv('AI_SEMANTIC_CACHE', 'false').lower() != 'true':
+        return None
+    return SemanticCache(
+        max_entries=int(os.getenv('AI_SEMANTIC_CACHE_MAX_ENTRIES', 5000)),
+        ttl=int(os.getenv('AI_SEMANTIC_CACHE_TTL', 3600)),
+        threshold=float(os.getenv('AI_SEMANTIC_CACHE_THRESHOLD', 0.85))
+    )
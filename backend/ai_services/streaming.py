@@ -0,0 +1,68 @@
+"""
+流式回复工具 - 解析Server-Sent Events格式的增量响应
+"""
+
+import json
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterator, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+SSE_DONE = '[DONE]'
+
+def _sse_data(line: Any) -> Optional[str]:
+    """提取单行SSE中的data字段，非数据行返回None"""
+    if not line:
+        return None
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='ignore')
+    line = line.strip()
+    if not line.startswith('data:'):
+        # 忽略event:/id:/注释等非数据行
+        return None
+    return line[5:].strip() or None
+
+def _loads(data: str) -> Optional[Dict[str, Any]]:
+    """解析流式JSON数据"""
+    try:
+        return json.loads(data)
+    except ValueError:
+        logger.warning(f"无法解析的流式数据: {data[:100]}")
+        return None
+
+def iter_sse_data(lines: Iterable[Any]) -> Iterator[str]:
+    """逐条产出SSE事件中的data字段，遇到[DONE]结束"""
+    for line in lines:
+        data = _sse_data(line)
+        if data is None:
+            continue
+        if data == SSE_DONE:
+            return
+        yield data
+
+def iter_sse_json(lines: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+    """逐条产出SSE事件中解析后的JSON对象"""
+    for data in iter_sse_data(lines):
+        event = _loads(data)
+        if event is not None:
+            yield event
+
+async def aiter_sse_json(lines: AsyncIterable[Any]) -> AsyncIterator[Dict[str, Any]]:
+    """异步版本的iter_sse_json"""
+    async for line in lines:
+        data = _sse_data(line)
+        if data is None:
+            continue
+        if data == SSE_DONE:
+            return
+        event = _loads(data)
+        if event is not None:
+            yield event
+
+def openai_delta_content(event: Dict[str, Any]) -> str:
+    """提取OpenAI兼容流式事件中的增量文本"""
+    choices = event.get('choices') or []
+    if not choices:
+        return ''
+    delta = choices[0].get('delta') or {}
+    return delta.get('content') or ''
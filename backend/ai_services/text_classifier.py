@@ -0,0 +1,172 @@
+"""
+消息上下文分类器
+
+把情感词、主题词和复杂度标点编译成一个正则（按长度降序的字面量多选），
+启动时构建一次，一遍扫描即可得到情感、主题和复杂度：
+- 正则扫描是非重叠的：某个关键词匹配后，从它的末尾继续扫描。起点落在该匹配内部、
+  被「吞掉」的关键词（例如「不好」中的「好」、「开心情」中的「心情」）通过构建时预计算的
+  重叠表补回：被包含的关键词直接计入，跨越匹配末尾的少数候选再做一次子串判断。
+  因此结果与逐个关键词做 `word in message` 完全一致。
+- 超过 scan_limit 个字符的长消息改为对每个关键词做子串查找：CPython的 `in` 使用C实现的
+  快速搜索，在长文本上比正则逐字符尝试多选分支更快（见 benchmarks/bench_text_classifier.py）。
+- classify_batch 对一批消息（例如回放录制的流量、批量打标签）逐条分类。
+
+分类语义与原 UnifiedAIService 的实现一致：
+- 情感：出现的积极词和消极词（按不同词计数）多者胜出，相等为neutral
+- 主题：按主题定义顺序，第一个出现了任一关键词的主题，没有则为general
+- 复杂度：长度超过100或包含「？」「!」「。」「，」为complex，超过50为medium，否则simple
+"""
+
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+POSITIVE_WORDS = ['好', '棒', '喜欢', '爱', '开心', '高兴', '满意', '优秀', '精彩', '谢谢', '感谢']
+NEGATIVE_WORDS = ['不好', '讨厌', '难过', '失望', '糟糕', '问题', '困难', '痛苦', '烦', '累']
+
+TOPIC_KEYWORDS = {
+    'technology': ['技术', '编程', '代码', '软件', '硬件', '电脑', '手机', '互联网', 'AI', '人工智能'],
+    'business': ['商业', '工作', '公司', '项目', '管理', '市场', '销售', '投资', '创业'],
+    'education': ['学习', '教育', '学校', '课程', '知识', '考试', '老师', '学生', '培训'],
+    'entertainment': ['娱乐', '游戏', '电影', '音乐', '艺术', '旅游', '美食', '运动', '笑话'],
+    'personal': ['个人', '生活', '家庭', '朋友', '情感', '健康', '心情', '梦想', '未来']
+}
+
+COMPLEX_MARKS = ['？', '!', '。', '，']
+
+class TextClassifier:
+    """编译后的情感/主题/复杂度分类器"""
+
+    def __init__(self, positive_words: Sequence[str] = POSITIVE_WORDS,
+                 negative_words: Sequence[str] = NEGATIVE_WORDS,
+                 topics: Optional[Dict[str, Sequence[str]]] = None,
+                 complex_marks: Sequence[str] = COMPLEX_MARKS,
+                 complex_length: int = 100, medium_length: int = 50, scan_limit: int = 64):
+        topics = TOPIC_KEYWORDS if topics is None else topics
+        self.positive = frozenset(positive_words)
+        self.negative = frozenset(negative_words)
+        self.complex_marks = frozenset(complex_marks)
+        self.topics = tuple((name, tuple(keywords)) for name, keywords in topics.items())
+        self.complex_length = complex_length
+        self.medium_length = medium_length
+        self.scan_limit = scan_limit
+        self.topic_names = list(topics)
+        # 关键词 -> 所属的第一个主题的序号
+        self._topic_rank: Dict[str, int] = {}
+        for rank, keywords in enumerate(topics.values()):
+            for keyword in keywords:
+                self._topic_rank.setdefault(keyword, rank)
+
+        keywords = set(self.positive) | self.negative | self.complex_marks | set(self._topic_rank)
+        keywords.discard('')
+        # 非主题关键词的序号排在所有主题之后，取最小值即可得到第一个主题
+        self._no_topic = len(self.topic_names)
+        self._rank_of = {keyword: self._topic_rank.get(keyword, self._no_topic) for keyword in keywords}
+        self._keywords = tuple(keywords)
+        # 长的在前：同一起点只会匹配最长的关键词，更短的都是它的前缀，由重叠表补回
+        ordered = sorted(keywords, key=lambda k: (-len(k), k))
+        self._pattern = re.compile('|'.join(re.escape(keyword) for keyword in ordered))
+        self._contained, self._overlapping = self._build_overlaps(ordered)
+        # 只有这些关键词匹配后需要按位置确认跨越其末尾的关键词
+        self._crossing = frozenset(keyword for keyword, across in self._overlapping.items() if across)
+
+    @staticmethod
+    def _build_overlaps(keywords: List[str]) -> Tuple[Dict[str, FrozenSet[str]], Dict[str, Tuple[Tuple[int, str], ...]]]:
+        """预计算每个关键词匹配后被跳过的其他关键词
+
+        contained:   完全位于该关键词内部的关键词，匹配即出现
+        overlapping: 起点在该关键词内部、终点超出它的关键词及其相对偏移，需要再确认
+        """
+        contained, overlapping = {}, {}
+        for keyword in keywords:
+            inside, across = set(), []
+            for other in keywords:
+                if other == keyword:
+                    continue
+                for offset in range(len(keyword)):
+                    tail = keyword[offset:]
+                    if tail.startswith(other):
+                        inside.add(other)
+                    elif offset > 0 and other.startswith(tail):
+                        across.append((offset, other))
+            contained[keyword] = frozenset(inside)
+            overlapping[keyword] = tuple(across)
+        return contained, overlapping
+
+    def _complete(self, message: str, found: Set[str]) -> Set[str]:
+        """补回被非重叠扫描跳过的关键词"""
+        for keyword in list(found):
+            found.update(self._contained[keyword])
+            if keyword in self._crossing:
+                # 只关心是否出现，不需要确认位置
+                for _, other in self._overlapping[keyword]:
+                    if other not in found and other in message:
+                        found.add(other)
+        return found
+
+    def keywords_in(self, message: str) -> Set[str]:
+        """消息中出现的全部关键词"""
+        if len(message) > self.scan_limit:
+            return set(filter(message.__contains__, self._keywords))
+        found = set(self._pattern.findall(message))
+        if not found:
+            return found
+        return self._complete(message, found)
+
+    def _label(self, message: str, found: Set[str]) -> Dict[str, str]:
+        """由扫描得到的关键词集合计算分类"""
+        rank = min(map(self._rank_of.__getitem__, found), default=self._no_topic)
+        return self._result(
+            len(self.positive.intersection(found)),
+            len(self.negative.intersection(found)),
+            self.topic_names[rank] if rank < self._no_topic else 'general',
+            len(message),
+            lambda: not self.complex_marks.isdisjoint(found)
+        )
+
+    def _search(self, message: str) -> Dict[str, str]:
+        """长消息：逐关键词子串查找，主题和标点找到即停止"""
+        contains = message.__contains__
+        topic = 'general'
+        for name, keywords in self.topics:
+            if any(map(contains, keywords)):
+                topic = name
+                break
+        return self._result(
+            sum(map(contains, self.positive)),
+            sum(map(contains, self.negative)),
+            topic,
+            len(message),
+            lambda: any(map(contains, self.complex_marks))
+        )
+
+    def _result(self, positive_count: int, negative_count: int, topic: str,
+                length: int, has_mark) -> Dict[str, str]:
+        if positive_count > negative_count:
+            sentiment = 'positive'
+        elif negative_count > positive_count:
+            sentiment = 'negative'
+        else:
+            sentiment = 'neutral'
+
+        if length > self.complex_length or has_mark():
+            complexity = 'complex'
+        elif length > self.medium_length:
+            complexity = 'medium'
+        else:
+            complexity = 'simple'
+        return {'sentiment': sentiment, 'topic': topic, 'complexity': complexity}
+
+    def classify(self, message: str) -> Dict[str, str]:
+        """返回 {'sentiment', 'topic', 'complexity'}"""
+        message = message or ''
+        if len(message) > self.scan_limit:
+            return self._search(message)
+        return self._label(message, self.keywords_in(message))
+
+    def classify_batch(self, messages: Iterable[str]) -> List[Dict[str, str]]:
+        """批量分类"""
+        classify = self.classify
+        return [classify(message) for message in messages]
+
+# 全局实例
+text_classifier = TextClassifier()
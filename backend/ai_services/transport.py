@@ -0,0 +1,140 @@
+"""
+AI服务HTTP传输层 - 共享的keep-alive连接池
+
+基于 requests.Session + HTTPAdapter，按主机维护连接池。每个主机最多 pool_maxsize 个连接，
+连接都在使用中时最多等待 pool_timeout 秒（AI_HTTP_POOL_TIMEOUT），超时按调用失败处理，
+保证调用在单个模型的截止时间（AI_MODEL_DEADLINE）内结束，而不是无限排队。
+
+set_request_hook 可以注册一个请求钩子（例如分布式追踪）：hook(method, url, headers)
+返回一个上下文管理器，包住整个请求，可以修改本次请求的headers（如注入traceparent）。
+流式请求只计到收到响应头为止。
+"""
+
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_POOL_TIMEOUT = 5
+
+_request_hook = None
+
+def set_request_hook(hook):
+    """注册请求钩子，传入None取消"""
+    global _request_hook
+    _request_hook = hook
+
+@contextmanager
+def _hooked(method: str, url: str, headers: Optional[Dict[str, str]]):
+    """在钩子中执行请求，产出本次请求使用的headers（副本，不修改调用方的字典）"""
+    hook = _request_hook
+    if hook is None:
+        yield headers
+        return
+    headers = dict(headers or {})
+    with hook(method, url, headers):
+        yield headers
+
+def _env_int(name: str, default: int) -> int:
+    """读取整数环境变量"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def _env_float(name: str, default: float) -> float:
+    """读取浮点数环境变量"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def _with_pool_timeout(pool_cls, pool_timeout: float):
+    """连接池子类：未指定pool_timeout时，等待空闲连接最多pool_timeout秒"""
+    class TimedPool(pool_cls):
+        def urlopen(self, method, url, *args, **kwargs):
+            if kwargs.get('pool_timeout') is None:
+                kwargs['pool_timeout'] = pool_timeout
+            return super().urlopen(method, url, *args, **kwargs)
+
+    TimedPool.__name__ = pool_cls.__name__
+    return TimedPool
+
+class PoolTimeoutAdapter(HTTPAdapter):
+    """pool_block=True 的HTTPAdapter；requests不传pool_timeout，默认会无限等待空闲连接，
+    这里改为等待pool_timeout秒后抛出 urllib3.exceptions.EmptyPoolError"""
+
+    def __init__(self, pool_timeout: float = DEFAULT_POOL_TIMEOUT, **kwargs):
+        # HTTPAdapter.__init__ 中会调用 init_poolmanager
+        self.pool_timeout = pool_timeout
+        super().__init__(pool_block=True, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: _with_pool_timeout(pool_cls, self.pool_timeout)
+            for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+class HTTPTransport:
+    """同步HTTP传输层 - 所有AI服务共享一个连接池化的Session"""
+
+    def __init__(self, pool_hosts: int = 10, pool_maxsize: int = 20, timeout: float = DEFAULT_TIMEOUT,
+                 pool_timeout: float = DEFAULT_POOL_TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
+        # 每个主机最多 pool_maxsize 个连接，超出时最多等待 pool_timeout 秒
+        adapter = PoolTimeoutAdapter(
+            pool_timeout=pool_timeout,
+            pool_connections=pool_hosts,
+            pool_maxsize=pool_maxsize
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def post(self, url: str, headers: Optional[Dict[str, str]] = None, json: Any = None,
+             timeout: Optional[float] = None, stream: bool = False) -> requests.Response:
+        """发送POST请求，复用已建立的连接"""
+        with _hooked('POST', url, headers) as headers:
+            return self.session.post(
+                url,
+                headers=headers,
+                json=json,
+                timeout=timeout or self.timeout,
+                stream=stream
+            )
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None,
+            timeout: Optional[float] = None) -> requests.Response:
+        """发送GET请求，复用已建立的连接"""
+        with _hooked('GET', url, headers) as headers:
+            return self.session.get(url, headers=headers, timeout=timeout or self.timeout)
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
+# 全局传输层实例
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport() -> HTTPTransport:
+    """获取共享的同步传输层"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HTTPTransport(
+                    pool_hosts=_env_int('AI_HTTP_POOL_HOSTS', 10),
+                    pool_maxsize=_env_int('AI_HTTP_POOL_MAXSIZE', 20),
+                    timeout=_env_int('AI_HTTP_TIMEOUT', DEFAULT_TIMEOUT),
+                    pool_timeout=_env_float('AI_HTTP_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)
+                )
+    return _transport
@@ -1,450 +1,754 @@
-"""
-统一AI服务 - 整合多个AI模型形成多样性聊天效果
-"""
-
-import os
-import random
-import json
-import logging
-from typing import Dict, List, Any, Optional
-from datetime import datetime
-from pathlib import Path
-
-# 导入具体的AI服务
-from .deepseek import DeepSeekAI
-from .minimax import MinimaxAI
-from .stepchat import StepChatAI
-
-logger = logging.getLogger(__name__)
-
-def load_env_file(file_path):
-    """加载环境变量文件"""
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#') and '=' in line:
-                    key, value = line.split('=', 1)
-                    os.environ[key] = value
-
-class UnifiedAIService:
-    """统一AI服务 - 整合多个AI模型"""
-    
-    def __init__(self):
-        # 主动加载环境变量
-        self._load_environment()
-        
-        self.ai_models = {
-            'deepseek': {
-                'name': 'DeepSeek',
-                'description': '深度思考型AI，擅长逻辑分析和复杂推理',
-                'personality': '严谨、理性、善于分析',
-                'style': 'formal',
-                'temperature': 0.7
-            },
-            'minimax': {
-                'name': 'MiniMax', 
-                'description': '友好对话型AI，擅长日常交流和情感表达',
-                'personality': '友好、幽默、善于倾听',
-                'style': 'casual',
-                'temperature': 0.8
-            },
-            'stepchat': {
-                'name': 'StepChat',
-                'description': '创意灵感型AI，擅长创新思维和艺术表达',
-                'personality': '创意、开放、富有想象力',
-                'style': 'creative',
-                'temperature': 0.9
-            }
-        }
-        
-        # 初始化AI服务实例
-        self.ai_services = {}
-        self._init_ai_services()
-        
-        # 对话历史记录
-        self.conversation_history = {}
-        
-        # 用户偏好分析
-        self.user_preferences = {}
-        
-        # 模拟模式标志
-        self.simulation_mode = False
-        
-    def _load_environment(self):
-        """加载环境变量"""
-        try:
-            # 获取当前文件所在目录
-            current_dir = Path(__file__).parent.parent.parent.absolute()
-            
-            # 尝试加载不同的配置文件
-            config_files = [
-                current_dir / 'backend' / 'config.env',
-                current_dir / '.env',
-                current_dir / 'production.env'
-            ]
-            
-            for config_file in config_files:
-                if os.path.exists(config_file):
-                    load_env_file(config_file)
-                    logger.info(f"已加载环境变量文件: {config_file}")
-                    break
-                    
-        except Exception as e:
-            logger.error(f"加载环境变量失败: {e}")
-        
-    def _init_ai_services(self):
-        """初始化AI服务实例"""
-        try:
-            # 检查是否有有效的API密钥
-            deepseek_key = os.getenv('DEEPSEEK_API_KEY')
-            minimax_key = os.getenv('MINIMAX_API_KEY')
-            minimax_group_id = os.getenv('MINIMAX_GROUP_ID')
-            stepchat_key = os.getenv('STEPCHAT_API_KEY')
-            
-            # 检查是否为测试密钥或空值
-            test_keys = ['sk-1234567890abcdef', 'test_key', '', None]
-            
-            # 初始化DeepSeek
-            if deepseek_key and deepseek_key not in test_keys:
-                try:
-                    self.ai_services['deepseek'] = DeepSeekAI(deepseek_key)
-                    logger.info("DeepSeek AI服务初始化成功")
-                except Exception as e:
-                    logger.error(f"DeepSeek初始化失败: {e}")
-            
-            # 初始化MiniMax
-            if minimax_key and minimax_group_id and minimax_key not in test_keys:
-                try:
-                    self.ai_services['minimax'] = MinimaxAI(minimax_key, minimax_group_id)
-                    logger.info("MiniMax AI服务初始化成功")
-                except Exception as e:
-                    logger.error(f"MiniMax初始化失败: {e}")
-            
-            # 初始化StepChat
-            if stepchat_key and stepchat_key not in test_keys:
-                try:
-                    self.ai_services['stepchat'] = StepChatAI(stepchat_key)
-                    logger.info("StepChat AI服务初始化成功")
-                except Exception as e:
-                    logger.error(f"StepChat初始化失败: {e}")
-            
-            # 检查是否有可用的AI服务
-            if not self.ai_services:
-                logger.warning("没有可用的AI服务，启用模拟模式")
-                self.simulation_mode = True
-            else:
-                logger.info(f"成功初始化 {len(self.ai_services)} 个AI服务")
-                self.simulation_mode = False  # 有真实服务时禁用模拟模式
-                
-        except Exception as e:
-            logger.error(f"AI服务初始化失败: {e}")
-            self.simulation_mode = True
-        
-    def get_ai_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """获取AI回复 - 整合多个AI模型"""
-        try:
-            message = data.get('message', '')
-            session_id = data.get('session_id', 'default')
-            user_id = data.get('user_id', 'user')
-            
-            # 分析消息内容和上下文
-            context = self._analyze_context(message, session_id)
-            
-            # 选择合适的AI模型组合
-            selected_models = self._select_ai_models(context, user_id)
-            
-            # 生成多样性回复
-            responses = self._generate_diverse_responses(message, selected_models, context)
-            
-            # 整合回复
-            final_response = self._integrate_responses(responses, context)
-            
-            # 更新对话历史
-            self._update_conversation_history(session_id, message, final_response, context)
-            
-            return {
-                'response': final_response,
-                'ai_models_used': selected_models,
-                'context': context,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"Unified AI service error: {str(e)}")
-            return {
-                'response': f"抱歉，我遇到了一些问题。让我重新思考一下：{data.get('message', '')}",
-                'ai_models_used': ['fallback'],
-                'context': {'error': str(e)},
-                'timestamp': datetime.utcnow().isoformat()
-            }
-    
-    def _analyze_context(self, message: str, session_id: str) -> Dict[str, Any]:
-        """分析消息上下文"""
-        context = {
-            'message_length': len(message),
-            'sentiment': self._analyze_sentiment(message),
-            'topic': self._detect_topic(message),
-            'complexity': self._assess_complexity(message),
-            'conversation_history': self.conversation_history.get(session_id, []),
-            'time_of_day': datetime.now().hour
-        }
-        
-        # 分析用户偏好
-        if session_id in self.user_preferences:
-            context['user_preferences'] = self.user_preferences[session_id]
-        
-        return context
-    
-    def _analyze_sentiment(self, message: str) -> str:
-        """分析消息情感"""
-        positive_words = ['好', '棒', '喜欢', '爱', '开心', '高兴', '满意', '优秀', '精彩', '谢谢', '感谢']
-        negative_words = ['不好', '讨厌', '难过', '失望', '糟糕', '问题', '困难', '痛苦', '烦', '累']
-        
-        positive_count = sum(1 for word in positive_words if word in message)
-        negative_count = sum(1 for word in negative_words if word in message)
-        
-        if positive_count > negative_count:
-            return 'positive'
-        elif negative_count > positive_count:
-            return 'negative'
-        else:
-            return 'neutral'
-    
-    def _detect_topic(self, message: str) -> str:
-        """检测消息主题"""
-        topics = {
-            'technology': ['技术', '编程', '代码', '软件', '硬件', '电脑', '手机', '互联网', 'AI', '人工智能'],
-            'business': ['商业', '工作', '公司', '项目', '管理', '市场', '销售', '投资', '创业'],
-            'education': ['学习', '教育', '学校', '课程', '知识', '考试', '老师', '学生', '培训'],
-            'entertainment': ['娱乐', '游戏', '电影', '音乐', '艺术', '旅游', '美食', '运动', '笑话'],
-            'personal': ['个人', '生活', '家庭', '朋友', '情感', '健康', '心情', '梦想', '未来']
-        }
-        
-        for topic, keywords in topics.items():
-            if any(keyword in message for keyword in keywords):
-                return topic
-        
-        return 'general'
-    
-    def _assess_complexity(self, message: str) -> str:
-        """评估消息复杂度"""
-        if len(message) > 100 or any(char in message for char in ['？', '!', '。', '，']):
-            return 'complex'
-        elif len(message) > 50:
-            return 'medium'
-        else:
-            return 'simple'
-    
-    def _select_ai_models(self, context: Dict[str, Any], user_id: str) -> List[str]:
-        """选择合适的AI模型组合"""
-        selected_models = []
-        
-        # 在模拟模式下，从所有可用模型中选择
-        available_models = list(self.ai_models.keys()) if self.simulation_mode else list(self.ai_services.keys())
-        
-        # 基于消息复杂度选择
-        if context['complexity'] == 'complex':
-            if 'deepseek' in available_models:
-                selected_models.append('deepseek')  # 复杂问题用DeepSeek
-        
-        # 基于情感选择
-        if context['sentiment'] == 'positive':
-            if 'minimax' in available_models:
-                selected_models.append('minimax')  # 积极情感用MiniMax
-        elif context['sentiment'] == 'negative':
-            if 'stepchat' in available_models:
-                selected_models.append('stepchat')  # 消极情感用StepChat提供创意解决方案
-        
-        # 基于主题选择
-        if context['topic'] == 'technology':
-            if 'deepseek' in available_models:
-                selected_models.append('deepseek')
-        elif context['topic'] == 'entertainment':
-            if 'stepchat' in available_models:
-                selected_models.append('stepchat')
-        
-        # 确保至少有一个模型
-        if not selected_models:
-            # 按优先级选择
-            if 'minimax' in available_models:
-                selected_models.append('minimax')
-            elif 'deepseek' in available_models:
-                selected_models.append('deepseek')
-            elif 'stepchat' in available_models:
-                selected_models.append('stepchat')
-        
-        # 随机添加第二个模型以增加多样性
-        if len(selected_models) == 1 and random.random() < 0.3:
-            remaining_models = [m for m in available_models if m not in selected_models]
-            if remaining_models:
-                selected_models.append(random.choice(remaining_models))
-        
-        return selected_models
-    
-    def _generate_diverse_responses(self, message: str, selected_models: List[str], context: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """生成多样性回复"""
-        responses = []
-        
-        for model_name in selected_models:
-            try:
-                model_info = self.ai_models[model_name]
-                
-                # 根据模型特性调整消息
-                adjusted_message = self._adjust_message_for_model(message, model_info, context)
-                
-                # 生成回复
-                response = self._generate_single_response(adjusted_message, model_name, context)
-                
-                responses.append({
-                    'model': model_name,
-                    'response': response,
-                    'personality': model_info['personality'],
-                    'style': model_info['style']
-                })
-                
-            except Exception as e:
-                logger.error(f"Error generating response for {model_name}: {str(e)}")
-                # 生成备用回复
-                responses.append({
-                    'model': model_name,
-                    'response': f"[{model_info['name']}] 我理解您的问题：{message}",
-                    'personality': model_info['personality'],
-                    'style': model_info['style']
-                })
-        
-        return responses
-    
-    def _adjust_message_for_model(self, message: str, model_info: Dict[str, Any], context: Dict[str, Any]) -> str:
-        """根据模型特性调整消息"""
-        if model_info['style'] == 'formal':
-            # 为正式风格添加更多上下文
-            return f"请以专业、严谨的方式回答：{message}"
-        elif model_info['style'] == 'casual':
-            # 为友好风格添加情感元素
-            return f"请以友好、轻松的方式回答：{message}"
-        elif model_info['style'] == 'creative':
-            # 为创意风格添加创新元素
-            return f"请以创新、富有想象力的方式回答：{message}"
-        
-        return message
-    
-    def _generate_single_response(self, message: str, model_name: str, context: Dict[str, Any]) -> str:
-        """生成单个AI模型的回复"""
-        try:
-            if self.simulation_mode:
-                # 模拟模式
-                return self._generate_simulated_response(message, model_name)
-            
-            # 真实API调用
-            if model_name in self.ai_services:
-                service = self.ai_services[model_name]
-                # 传递用户ID和消息
-                response = service.generate_response(
-                    prompt=message,
-                    user_id=context.get('user_id', 'user1')
-                )
-                return response
-            else:
-                return self._generate_simulated_response(message, model_name)
-                
-        except Exception as e:
-            logger.error(f"Error in {model_name} response generation: {str(e)}")
-            return self._generate_simulated_response(message, model_name)
-    
-    def _generate_simulated_response(self, message: str, model_name: str) -> str:
-        """生成模拟回复"""
-        if model_name == 'deepseek':
-            responses = [
-                f"从技术角度来看，{message} 这个问题需要深入分析。",
-                f"基于我的理解，{message} 涉及多个层面的考虑。",
-                f"让我从逻辑角度分析一下：{message}",
-                f"这个问题很有趣，{message} 让我为您详细解释。",
-                f"从专业角度来说，{message} 需要综合考虑多个因素。",
-                f"根据我的分析，{message} 可以从以下几个维度来理解。",
-                f"从技术层面看，{message} 是一个值得深入研究的话题。"
-            ]
-        elif model_name == 'minimax':
-            responses = [
-                f"哈哈，{message} 这个问题很有意思呢！",
-                f"我理解您的想法，{message} 确实值得讨论。",
-                f"谢谢您分享这个想法，{message} 让我想想...",
-                f"哇，{message} 这个想法很棒！",
-                f"我完全理解您的感受，{message} 我们一起探讨一下吧！",
-                f"这真是个有趣的问题，{message} 让我来帮您分析一下。",
-                f"我很高兴您问这个问题，{message} 让我为您详细解答。"
-            ]
-        elif model_name == 'stepchat':
-            responses = [
-                f"✨ 关于 {message}，我有一个创意想法！",
-                f"🌟 让我们用全新的视角来看待 {message}",
-                f"💡 这让我想到了一个有趣的解决方案：{message}",
-                f"🎨 从艺术的角度，{message} 可以这样理解...",
-                f"🚀 让我们跳出常规思维，{message} 其实可以这样思考...",
-                f"🌈 这是一个充满可能性的问题，{message} 让我为您展开想象！",
-                f"🎭 从创意的角度看，{message} 有很多有趣的可能性。"
-            ]
-        else:
-            responses = [f"AI回复：{message}"]
-        
-        return random.choice(responses)
-    
-    def _integrate_responses(self, responses: List[Dict[str, Any]], context: Dict[str, Any]) -> str:
-        """整合多个AI的回复"""
-        if len(responses) == 1:
-            return responses[0]['response']
-        
-        # 整合多个回复
-        integrated_parts = []
-        
-        for i, response in enumerate(responses):
-            model_name = response['model']
-            model_info = self.ai_models[model_name]
-            
-            # 添加模型标识
-            if len(responses) > 1:
-                integrated_parts.append(f"[{model_info['name']}] {response['response']}")
-            else:
-                integrated_parts.append(response['response'])
-        
-        # 根据回复数量选择整合方式
-        if len(responses) == 2:
-            # 两个回复：对话式整合
-            return f"{integrated_parts[0]}\n\n{integrated_parts[1]}"
-        else:
-            # 多个回复：列表式整合
-            return "\n\n".join(integrated_parts)
-    
-    def _update_conversation_history(self, session_id: str, user_message: str, ai_response: str, context: Dict[str, Any]):
-        """更新对话历史"""
-        if session_id not in self.conversation_history:
-            self.conversation_history[session_id] = []
-        
-        self.conversation_history[session_id].append({
-            'user_message': user_message,
-            'ai_response': ai_response,
-            'context': context,
-            'timestamp': datetime.utcnow().isoformat()
-        })
-        
-        # 保持历史记录在合理范围内
-        if len(self.conversation_history[session_id]) > 50:
-            self.conversation_history[session_id] = self.conversation_history[session_id][-25:]
-    
-    def get_ai_models_info(self) -> Dict[str, Any]:
-        """获取AI模型信息"""
-        return {
-            'models': self.ai_models,
-            'total_models': len(self.ai_models),
-            'description': '统一AI服务整合了多个AI模型，提供多样化的聊天体验',
-            'simulation_mode': self.simulation_mode,
-            'available_services': list(self.ai_services.keys())
-        }
-
-# 全局实例
-unified_ai_service = UnifiedAIService()
-
-def get_unified_ai_response(data: Dict[str, Any]) -> str:
-    """获取统一AI回复"""
-    result = unified_ai_service.get_ai_response(data)
+"""
+统一AI服务 - 整合多个AI模型形成多样性聊天效果
+"""
+
+import os
+import random
+import json
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Any, Optional, Iterator
+from datetime import datetime
+from pathlib import Path
+
+# 导入具体的AI服务
+from .deepseek import DeepSeekAI
+from .minimax import MinimaxAI
+from .stepchat import StepChatAI
+from .single_flight import SingleFlight
+from .semantic_cache import create_semantic_cache
+from .context_store import context_store
+from .circuit_breaker import create_circuit_breaker
+from .concurrency import create_provider_limiter
+from .base import ProviderError
+from .routing import create_routing_engine, create_traffic_recorder, estimate_tokens
+from .hedging import HedgeOutcome, HedgeStats, hedged_stream
+from .text_classifier import text_classifier
+from .history_store import create_history_store
+
+logger = logging.getLogger(__name__)
+
+def load_env_file(file_path):
+    """加载环境变量文件"""
+    if os.path.exists(file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#') and '=' in line:
+                    key, value = line.split('=', 1)
+                    os.environ[key] = value
+
+class UnifiedAIService:
+    """统一AI服务 - 整合多个AI模型"""
+    
+    def __init__(self):
+        # 主动加载环境变量
+        self._load_environment()
+        
+        self.ai_models = {
+            'deepseek': {
+                'name': 'DeepSeek',
+                'description': '深度思考型AI，擅长逻辑分析和复杂推理',
+                'personality': '严谨、理性、善于分析',
+                'style': 'formal',
+                'temperature': 0.7
+            },
+            'minimax': {
+                'name': 'MiniMax', 
+                'description': '友好对话型AI，擅长日常交流和情感表达',
+                'personality': '友好、幽默、善于倾听',
+                'style': 'casual',
+                'temperature': 0.8
+            },
+            'stepchat': {
+                'name': 'StepChat',
+                'description': '创意灵感型AI，擅长创新思维和艺术表达',
+                'personality': '创意、开放、富有想象力',
+                'style': 'creative',
+                'temperature': 0.9
+            }
+        }
+        
+        # 模拟模式标志（必须在初始化服务之前设置，由_init_ai_services更新）
+        self.simulation_mode = False
+        
+        # 初始化AI服务实例
+        self.ai_services = {}
+        self._init_ai_services()
+        
+        # 每个真实服务一个熔断器，故障服务在选择模型时被跳过
+        self.breakers = {name: create_circuit_breaker(name) for name in self.ai_services}
+        # 每个服务的并发上限，避免单个变慢的服务占满所有工作线程
+        self.limiters = {name: create_provider_limiter(name) for name in self.ai_services}
+        
+        # 对话历史记录和用户偏好（有界，LRU + 空闲淘汰）
+        self.history = create_history_store()
+        
+        # 多模型并发调用：单个模型超过截止时间即被丢弃
+        # 默认略短于app.py中30秒的总超时，以便返回部分结果
+        self.model_deadline = float(os.getenv('AI_MODEL_DEADLINE', 25))
+        self.fanout_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('AI_FANOUT_WORKERS', 16)),
+            thread_name_prefix='ai-fanout'
+        )
+        
+        # 模型路由：策略文件声明规则、SLO和预算，按实时延迟/错误率选择模型
+        self.router = create_routing_engine()
+        self.traffic_recorder = create_traffic_recorder()
+        # 对冲请求（策略hedge.enabled开启）：主请求和备用请求在独立线程池中消费，
+        # 避免与fan-out互相等待
+        self.hedge_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('AI_HEDGE_WORKERS', 16)),
+            thread_name_prefix='ai-hedge'
+        )
+        self.hedge_stats = HedgeStats()
+        
+        # 指标回调：stage_observer(阶段, 秒)、provider_observer(模型, 秒, 是否成功)，由app.py设置
+        self.stage_observer = None
+        self.provider_observer = None
+        
+        # 合并同一会话中相同消息的并发请求，只调用一次模型
+        self.single_flight_enabled = os.getenv('AI_SINGLE_FLIGHT', 'true').lower() == 'true'
+        self.single_flight = SingleFlight()
+        
+        # 跨会话语义回复缓存（默认关闭，AI_SEMANTIC_CACHE=true开启）
+        self.semantic_cache = create_semantic_cache()
+        
+    def _load_environment(self):
+        """加载环境变量"""
+        try:
+            # 获取当前文件所在目录
+            current_dir = Path(__file__).parent.parent.parent.absolute()
+            
+            # 尝试加载不同的配置文件
+            config_files = [
+                current_dir / 'backend' / 'config.env',
+                current_dir / '.env',
+                current_dir / 'production.env'
+            ]
+            
+            for config_file in config_files:
+                if os.path.exists(config_file):
+                    load_env_file(config_file)
+                    logger.info(f"已加载环境变量文件: {config_file}")
+                    break
+                    
+        except Exception as e:
+            logger.error(f"加载环境变量失败: {e}")
+        
+    def _init_ai_services(self):
+        """初始化AI服务实例"""
+        try:
+            # 检查是否有有效的API密钥
+            deepseek_key = os.getenv('DEEPSEEK_API_KEY')
+            minimax_key = os.getenv('MINIMAX_API_KEY')
+            minimax_group_id = os.getenv('MINIMAX_GROUP_ID')
+            stepchat_key = os.getenv('STEPCHAT_API_KEY')
+            
+            # 检查是否为测试密钥或空值
+            test_keys = ['sk-1234567890abcdef', 'test_key', '', None]
+            
+            # 初始化DeepSeek
+            if deepseek_key and deepseek_key not in test_keys:
+                try:
+                    self.ai_services['deepseek'] = DeepSeekAI(deepseek_key)
+                    logger.info("DeepSeek AI服务初始化成功")
+                except Exception as e:
+                    logger.error(f"DeepSeek初始化失败: {e}")
+            
+            # 初始化MiniMax
+            if minimax_key and minimax_group_id and minimax_key not in test_keys:
+                try:
+                    self.ai_services['minimax'] = MinimaxAI(minimax_key, minimax_group_id)
+                    logger.info("MiniMax AI服务初始化成功")
+                except Exception as e:
+                    logger.error(f"MiniMax初始化失败: {e}")
+            
+            # 初始化StepChat
+            if stepchat_key and stepchat_key not in test_keys:
+                try:
+                    self.ai_services['stepchat'] = StepChatAI(stepchat_key)
+                    logger.info("StepChat AI服务初始化成功")
+                except Exception as e:
+                    logger.error(f"StepChat初始化失败: {e}")
+            
+            # 检查是否有可用的AI服务
+            if not self.ai_services:
+                logger.warning("没有可用的AI服务，启用模拟模式")
+                self.simulation_mode = True
+            else:
+                logger.info(f"成功初始化 {len(self.ai_services)} 个AI服务")
+                self.simulation_mode = False  # 有真实服务时禁用模拟模式
+                
+        except Exception as e:
+            logger.error(f"AI服务初始化失败: {e}")
+            self.simulation_mode = True
+        
+    def get_ai_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """获取AI回复 - 整合多个AI模型，相同的并发请求共享同一次调用"""
+        if not self.single_flight_enabled:
+            return self._get_ai_response(data)
+        key = (data.get('user_id'), data.get('session_id'), (data.get('message') or '').strip())
+        result, _ = self.single_flight.do(key, lambda: self._get_ai_response(data))
+        # 各调用方拿到独立的副本
+        return dict(result)
+    
+    def set_observers(self, stage=None, provider=None):
+        """设置指标回调"""
+        self.stage_observer = stage
+        self.provider_observer = provider
+    
+    def _observe_stage(self, stage: str, started: float) -> float:
+        """记录从started到现在的阶段耗时，返回当前时间"""
+        now = time.monotonic()
+        if self.stage_observer is not None:
+            self.stage_observer(stage, now - started)
+        return now
+    
+    def _record_provider(self, model_name: str, latency: float, ok: bool, tokens: int = 0,
+                         first_byte: Optional[float] = None):
+        """记录一次真实服务调用的路由统计和指标"""
+        self.router.record(model_name, latency, ok, tokens, first_byte=first_byte)
+        if self.provider_observer is not None:
+            self.provider_observer(model_name, latency, ok)
+    
+    def _get_ai_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """获取AI回复 - 整合多个AI模型"""
+        started = time.monotonic()
+        try:
+            message = data.get('message', '')
+            session_id = data.get('session_id', 'default')
+            user_id = data.get('user_id', 'user')
+            
+            # 分析消息内容和上下文
+            context = self._analyze_context(message, session_id)
+            context['user_id'] = user_id
+            # 服务商上下文按真实会话隔离，未提供session_id时不保留上下文
+            context['session_id'] = data.get('session_id')
+            stage_start = self._observe_stage('context', started)
+            
+            # 选择合适的AI模型组合
+            selected_models = self._select_ai_models(context, user_id)
+            stage_start = self._observe_stage('selection', stage_start)
+            
+            if not selected_models:
+                return self._unavailable_response(session_id, message, context)
+            
+            # 相同模型组合下的相同/相近提问直接使用缓存的回复
+            cached = self._get_semantic_cached(message, selected_models, context)
+            if cached is not None:
+                self._update_conversation_history(session_id, message, cached['response'], context)
+                return {
+                    'response': cached['response'],
+                    'ai_models_used': cached['ai_models_used'],
+                    'context': context,
+                    'timestamp': datetime.utcnow().isoformat()
+                }
+            
+            # 生成多样性回复
+            context['selected_models'] = selected_models
+            responses = self._generate_diverse_responses(message, selected_models, context)
+            stage_start = self._observe_stage('provider', stage_start)
+            if self.traffic_recorder is not None:
+                self.traffic_recorder.record(context, selected_models, {
+                    item['model']: {
+                        'latency_ms': round(item.get('latency', 0) * 1000, 1),
+                        'ok': not item.get('fallback'),
+                        'tokens': estimate_tokens(message) + estimate_tokens(item['response'])
+                    } for item in responses
+                })
+            
+            # 整合回复
+            final_response = self._integrate_responses(responses, context)
+            ai_models_used = [item['model'] for item in responses]
+            hedges = self._count_hedges(item.get('hedge') for item in responses)
+            self._observe_stage('integration', stage_start)
+            
+            # 更新对话历史
+            self._update_conversation_history(session_id, message, final_response, context)
+            
+            degraded = any(item.get('fallback') for item in responses)
+            if self.semantic_cache is not None and not self.simulation_mode and not degraded:
+                self.semantic_cache.put(message, self._semantic_partition(selected_models), {
+                    'response': final_response,
+                    'ai_models_used': ai_models_used
+                })
+            
+            self._observe_stage('total', started)
+            return {
+                'response': final_response,
+                'ai_models_used': ai_models_used,
+                'hedges': hedges,
+                'context': context,
+                'timestamp': datetime.utcnow().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"Unified AI service error: {str(e)}")
+            return {
+                'response': f"抱歉，我遇到了一些问题。让我重新思考一下：{data.get('message', '')}",
+                'ai_models_used': ['fallback'],
+                'context': {'error': str(e)},
+                'timestamp': datetime.utcnow().isoformat()
+            }
+    
+    def _unavailable_response(self, session_id: str, message: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """没有可用服务时立即返回的回复"""
+        response = '抱歉，AI服务暂时不可用，请稍后重试。'
+        self._update_conversation_history(session_id, message, response, context)
+        return {
+            'response': response,
+            'ai_models_used': ['fallback'],
+            'context': context,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    
+    def _semantic_partition(self, selected_models: List[str]):
+        """语义缓存分区：模型组合及其风格"""
+        return tuple((name, self.ai_models[name]['style']) for name in selected_models)
+    
+    def _get_semantic_cached(self, message: str, selected_models: List[str], context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """查找语义缓存，命中时把这一轮对话补入各服务的会话上下文"""
+        if self.semantic_cache is None or not selected_models:
+            return None
+        hit = self.semantic_cache.get(message, self._semantic_partition(selected_models))
+        if hit is None:
+            return None
+        cached, score = hit
+        logger.debug(f"语义缓存命中 (相似度 {score:.2f})")
+        for model_name in selected_models:
+            service = self.ai_services.get(model_name)
+            namespace = getattr(service, 'history_namespace', None)
+            if namespace:
+                context_store.append_turn(namespace, context.get('session_id'), message, cached['response'])
+        return cached
+    
+    def get_ai_response_stream(self, data: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """流式获取AI回复
+
+        依次产出 {'type': 'chunk', 'model', 'content'} 增量事件，
+        最后产出一个 {'type': 'done', 'response', 'ai_models_used'} 事件。
+        所有chunk的content拼接后与done中的response一致。
+        """
+        message = data.get('message', '')
+        session_id = data.get('session_id', 'default')
+        user_id = data.get('user_id', 'user')
+        
+        try:
+            context = self._analyze_context(message, session_id)
+            context['user_id'] = user_id
+            context['session_id'] = data.get('session_id')
+            selected_models = self._select_ai_models(context, user_id)
+        except Exception as e:
+            logger.error(f"Unified AI stream error: {str(e)}")
+            fallback = f"抱歉，我遇到了一些问题。让我重新思考一下：{message}"
+            yield {'type': 'chunk', 'model': 'fallback', 'content': fallback}
+            yield {
+                'type': 'done',
+                'response': fallback,
+                'ai_models_used': ['fallback'],
+                'timestamp': datetime.utcnow().isoformat()
+            }
+            return
+        
+        if not selected_models:
+            fallback = self._unavailable_response(session_id, message, context)
+            yield {'type': 'chunk', 'model': 'fallback', 'content': fallback['response']}
+            yield {
+                'type': 'done',
+                'response': fallback['response'],
+                'ai_models_used': fallback['ai_models_used'],
+                'timestamp': fallback['timestamp']
+            }
+            return
+        
+        parts = []
+        outcomes = []
+        multi_model = len(selected_models) > 1
+        context['selected_models'] = selected_models
+        for index, model_name in enumerate(selected_models):
+            model_info = self.ai_models[model_name]
+            
+            # 与_integrate_responses保持一致的多模型拼接格式
+            prefix = ''
+            if multi_model:
+                prefix = f"[{model_info['name']}] "
+                if index > 0:
+                    prefix = '\n\n' + prefix
+            if prefix:
+                parts.append(prefix)
+                yield {'type': 'chunk', 'model': model_name, 'content': prefix}
+            
+            adjusted_message = self._adjust_message_for_model(message, model_info, context)
+            outcome = HedgeOutcome(model_name)
+            outcomes.append(outcome)
+            for delta in self._generate_single_response_stream(adjusted_message, model_name, context, outcome):
+                parts.append(delta)
+                yield {'type': 'chunk', 'model': model_name, 'content': delta}
+        
+        final_response = ''.join(parts)
+        self._update_conversation_history(session_id, message, final_response, context)
+        
+        yield {
+            'type': 'done',
+            'response': final_response,
+            'ai_models_used': selected_models,
+            'hedges': self._count_hedges(outcomes),
+            'timestamp': datetime.utcnow().isoformat()
+        }
+    
+    def _analyze_context(self, message: str, session_id: str) -> Dict[str, Any]:
+        """分析消息上下文"""
+        # 情感、主题和复杂度由编译好的关键词分类器一遍扫描得出
+        labels = text_classifier.classify(message)
+        context = {
+            'message_length': len(message),
+            'sentiment': labels['sentiment'],
+            'topic': labels['topic'],
+            'complexity': labels['complexity'],
+            'conversation_history': self.history.get(session_id),
+            'time_of_day': datetime.now().hour
+        }
+        
+        # 分析用户偏好
+        preferences = self.history.get_preferences(session_id)
+        if preferences is not None:
+            context['user_preferences'] = preferences
+        
+        return context
+    
+    def _available_models(self) -> List[str]:
+        """可供选择的模型：模拟模式下为全部模型，否则为未熔断的服务，优先并发未满的服务"""
+        if self.simulation_mode:
+            return list(self.ai_models.keys())
+        models = [name for name in self.ai_services if self.breakers[name].available()]
+        return [name for name in models if self.limiters[name].available()] or models
+    
+    def _select_ai_models(self, context: Dict[str, Any], user_id: str) -> List[str]:
+        """按路由策略选择合适的AI模型组合"""
+        available_models = self._available_models()
+        if not available_models:
+            logger.warning("所有AI服务均处于熔断状态")
+            return []
+        return self.router.select(context, available_models)
+    
+    def _generate_diverse_responses(self, message: str, selected_models: List[str], context: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """并发生成多样性回复
+
+        各模型同时调用，整体耗时约等于最慢模型的耗时；超过截止时间仍未返回的
+        模型会被丢弃，只整合已完成的回复。每个任务带上调用方的contextvars（追踪上下文等）。
+        """
+        futures = [
+            (model_name, self.fanout_executor.submit(contextvars.copy_context().run,
+                                                     self._generate_model_response, message, model_name, context))
+            for model_name in selected_models
+        ]
+        done, _ = wait([future for _, future in futures], timeout=self.model_deadline)
+        
+        responses = []
+        for model_name, future in futures:
+            if future in done:
+                responses.append(future.result())
+            else:
+                future.cancel()
+                logger.warning(f"{model_name} 超过 {self.model_deadline}s 截止时间，已从本次回复中移除")
+        
+        if not responses and selected_models:
+            # 所有模型都超时，返回备用回复而不是整轮失败
+            responses.append(self._fallback_model_response(message, selected_models[0]))
+        
+        return responses
+    
+    def _generate_model_response(self, message: str, model_name: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """生成单个模型的回复条目；备用请求胜出时条目中的model为备用模型"""
+        model_info = self.ai_models[model_name]
+        outcome = HedgeOutcome(model_name)
+        start = time.monotonic()
+        try:
+            # 根据模型特性调整消息
+            adjusted_message = self._adjust_message_for_model(message, model_info, context)
+            
+            # 生成回复；开启对冲时改用流式调用，以便统计首字节耗时并判断是否超时
+            if self._hedging_enabled(model_name):
+                delay = self.router.hedge_delay(model_name)
+                if delay is None:
+                    deltas = self._stream_attempt(adjusted_message, model_name, context)
+                else:
+                    deltas = self._hedged_deltas(adjusted_message, model_name, context, delay, outcome)
+                response = ''.join(deltas)
+            else:
+                response = self._generate_single_response(adjusted_message, model_name, context)
+            
+            winner_info = self.ai_models[outcome.winner]
+            return {
+                'model': outcome.winner,
+                'response': response,
+                'personality': winner_info['personality'],
+                'style': winner_info['style'],
+                'latency': time.monotonic() - start,
+                'hedge': outcome
+            }
+            
+        except Exception as e:
+            logger.error(f"Error generating response for {model_name}: {str(e)}")
+            entry = self._fallback_model_response(message, model_name)
+            entry['latency'] = time.monotonic() - start
+            entry['hedge'] = outcome
+            return entry
+    
+    def _fallback_model_response(self, message: str, model_name: str) -> Dict[str, Any]:
+        """生成备用回复条目"""
+        model_info = self.ai_models[model_name]
+        return {
+            'model': model_name,
+            'response': f"[{model_info['name']}] 我理解您的问题：{message}",
+            'personality': model_info['personality'],
+            'style': model_info['style'],
+            'fallback': True
+        }
+    
+    def _adjust_message_for_model(self, message: str, model_info: Dict[str, Any], context: Dict[str, Any]) -> str:
+        """根据模型特性调整消息"""
+        if model_info['style'] == 'formal':
+            # 为正式风格添加更多上下文
+            return f"请以专业、严谨的方式回答：{message}"
+        elif model_info['style'] == 'casual':
+            # 为友好风格添加情感元素
+            return f"请以友好、轻松的方式回答：{message}"
+        elif model_info['style'] == 'creative':
+            # 为创意风格添加创新元素
+            return f"请以创新、富有想象力的方式回答：{message}"
+        
+        return message
+    
+    def _generate_single_response(self, message: str, model_name: str, context: Dict[str, Any]) -> str:
+        """生成单个AI模型的回复；真实服务调用失败时抛出异常并计入熔断器"""
+        if self.simulation_mode or model_name not in self.ai_services:
+            return self._generate_simulated_response(message, model_name)
+        
+        service = self.ai_services[model_name]
+        breaker = self.breakers[model_name]
+        if not breaker.allow():
+            raise ProviderError(f"{model_name} 熔断中，跳过调用")
+        limiter = self.limiters[model_name]
+        if not limiter.acquire():
+            raise ProviderError(f"{model_name} 并发已满，跳过调用")
+        
+        start = time.monotonic()
+        try:
+            # 传递用户ID和消息
+            response = service.generate_response(
+                prompt=message,
+                user_id=context.get('user_id', 'user1'),
+                session_id=context.get('session_id')
+            )
+        except Exception as e:
+            breaker.record_failure()
+            self._record_provider(model_name, time.monotonic() - start, False)
+            logger.error(f"Error in {model_name} response generation: {str(e)}")
+            raise
+        finally:
+            limiter.release()
+        latency = time.monotonic() - start
+        breaker.record_success(latency)
+        self._record_provider(model_name, latency, True, estimate_tokens(message) + estimate_tokens(response))
+        return response
+    
+    def _generate_single_response_stream(self, message: str, model_name: str, context: Dict[str, Any],
+                                         outcome: Optional[HedgeOutcome] = None) -> Iterator[str]:
+        """流式生成单个AI模型的回复，调用失败且尚未输出内容时输出模拟回复"""
+        if self.simulation_mode or model_name not in self.ai_services:
+            yield self._generate_simulated_response(message, model_name)
+            return
+        
+        delay = self.router.hedge_delay(model_name)
+        produced = False
+        try:
+            if delay is None:
+                deltas = self._stream_attempt(message, model_name, context)
+            else:
+                deltas = self._hedged_deltas(message, model_name, context, delay, outcome or HedgeOutcome(model_name))
+            for delta in deltas:
+                produced = True
+                yield delta
+        except Exception:
+            if not produced:
+                yield self._generate_simulated_response(message, model_name)
+    
+    def _stream_attempt(self, message: str, model_name: str, context: Dict[str, Any]) -> Iterator[str]:
+        """调用一次真实服务并逐块产出回复，失败时抛出异常；不支持流式的服务整体输出一次
+
+        记录熔断器和路由统计（含首字节耗时）；生成器被提前关闭（对冲落败被取消）时不记录。
+        """
+        service = self.ai_services[model_name]
+        breaker = self.breakers[model_name]
+        if not breaker.allow():
+            logger.warning(f"{model_name} 熔断中，跳过调用")
+            raise ProviderError(f"{model_name} 熔断中，跳过调用")
+        limiter = self.limiters[model_name]
+        if not limiter.acquire():
+            logger.warning(f"{model_name} 并发已满，跳过调用")
+            raise ProviderError(f"{model_name} 并发已满，跳过调用")
+        
+        kwargs = {
+            'prompt': message,
+            'user_id': context.get('user_id', 'user1'),
+            'session_id': context.get('session_id')
+        }
+        stream_fn = getattr(service, 'generate_response_stream', None)
+        parts = []
+        first_byte = None
+        start = time.monotonic()
+        chunks = None
+        try:
+            chunks = stream_fn(**kwargs) if stream_fn is not None else iter([service.generate_response(**kwargs)])
+            for delta in chunks:
+                if first_byte is None:
+                    first_byte = time.monotonic() - start
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            breaker.record_failure()
+            self._record_provider(model_name, time.monotonic() - start, False)
+            logger.error(f"Error in {model_name} stream generation: {str(e)}")
+            raise
+        finally:
+            # 提前关闭时同时关闭服务的生成器，释放HTTP连接
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            limiter.release()
+        latency = time.monotonic() - start
+        breaker.record_success(latency)
+        self._record_provider(model_name, latency, True, estimate_tokens(message) + estimate_tokens(''.join(parts)),
+                              first_byte=latency if first_byte is None else first_byte)
+    
+    def _hedging_enabled(self, model_name: str) -> bool:
+        return not self.simulation_mode and model_name in self.ai_services and self.router.hedging_enabled()
+    
+    def _hedged_deltas(self, message: str, model_name: str, context: Dict[str, Any],
+                       delay: float, outcome: HedgeOutcome) -> Iterator[str]:
+        """主请求delay秒内没有首个增量时向备用服务发出第二个请求，产出胜出请求的增量"""
+        def choose_backup():
+            backup = self.router.backup_for(model_name, self._available_models(),
+                                            exclude=context.get('selected_models', ()))
+            if backup is None:
+                return None
+            logger.info(f"{model_name} 超过 {delay:.2f}s 没有首字节，对冲请求 {backup}")
+            return backup, lambda: self._stream_attempt(message, backup, context)
+        
+        try:
+            yield from hedged_stream(
+                (model_name, lambda: self._stream_attempt(message, model_name, context)),
+                delay, choose_backup, self.hedge_executor, outcome
+            )
+        finally:
+            self.hedge_stats.add(outcome)
+    
+    @staticmethod
+    def _count_hedges(outcomes) -> Dict[str, int]:
+        """本次请求中触发对冲和备用请求胜出的次数"""
+        fired = won = 0
+        for outcome in outcomes:
+            if outcome is not None:
+                fired += outcome.fired
+                won += outcome.won
+        return {'fired': fired, 'won': won}
+    
+    def _generate_simulated_response(self, message: str, model_name: str) -> str:
+        """生成模拟回复"""
+        if model_name == 'deepseek':
+            responses = [
+                f"从技术角度来看，{message} 这个问题需要深入分析。",
+                f"基于我的理解，{message} 涉及多个层面的考虑。",
+                f"让我从逻辑角度分析一下：{message}",
+                f"这个问题很有趣，{message} 让我为您详细解释。",
+                f"从专业角度来说，{message} 需要综合考虑多个因素。",
+                f"根据我的分析，{message} 可以从以下几个维度来理解。",
+                f"从技术层面看，{message} 是一个值得深入研究的话题。"
+            ]
+        elif model_name == 'minimax':
+            responses = [
+                f"哈哈，{message} 这个问题很有意思呢！",
+                f"我理解您的想法，{message} 确实值得讨论。",
+                f"谢谢您分享这个想法，{message} 让我想想...",
+                f"哇，{message} 这个想法很棒！",
+                f"我完全理解您的感受，{message} 我们一起探讨一下吧！",
+                f"这真是个有趣的问题，{message} 让我来帮您分析一下。",
+                f"我很高兴您问这个问题，{message} 让我为您详细解答。"
+            ]
+        elif model_name == 'stepchat':
+            responses = [
+                f"✨ 关于 {message}，我有一个创意想法！",
+                f"🌟 让我们用全新的视角来看待 {message}",
+                f"💡 这让我想到了一个有趣的解决方案：{message}",
+                f"🎨 从艺术的角度，{message} 可以这样理解...",
+                f"🚀 让我们跳出常规思维，{message} 其实可以这样思考...",
+                f"🌈 这是一个充满可能性的问题，{message} 让我为您展开想象！",
+                f"🎭 从创意的角度看，{message} 有很多有趣的可能性。"
+            ]
+        else:
+            responses = [f"AI回复：{message}"]
+        
+        return random.choice(responses)
+    
+    def _integrate_responses(self, responses: List[Dict[str, Any]], context: Dict[str, Any]) -> str:
+        """整合多个AI的回复"""
+        if len(responses) == 1:
+            return responses[0]['response']
+        
+        # 整合多个回复
+        integrated_parts = []
+        
+        for i, response in enumerate(responses):
+            model_name = response['model']
+            model_info = self.ai_models[model_name]
+            
+            # 添加模型标识
+            if len(responses) > 1:
+                integrated_parts.append(f"[{model_info['name']}] {response['response']}")
+            else:
+                integrated_parts.append(response['response'])
+        
+        # 根据回复数量选择整合方式
+        if len(responses) == 2:
+            # 两个回复：对话式整合
+            return f"{integrated_parts[0]}\n\n{integrated_parts[1]}"
+        else:
+            # 多个回复：列表式整合
+            return "\n\n".join(integrated_parts)
+    
+    def _update_conversation_history(self, session_id: str, user_message: str, ai_response: str, context: Dict[str, Any]):
+        """更新对话历史（只保存消息、回复和分类标签，不保存整个context）"""
+        self.history.append(session_id, user_message, ai_response, context)
+    
+    def get_ai_models_info(self) -> Dict[str, Any]:
+        """获取AI模型信息"""
+        return {
+            'models': self.ai_models,
+            'total_models': len(self.ai_models),
+            'description': '统一AI服务整合了多个AI模型，提供多样化的聊天体验',
+            'simulation_mode': self.simulation_mode,
+            'available_services': list(self.ai_services.keys())
+        }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取运行统计信息"""
+        return {
+            'single_flight': self.single_flight.stats(),
+            'semantic_cache': self.semantic_cache.stats() if self.semantic_cache is not None else None,
+            'circuit_breakers': {name: breaker.stats() for name, breaker in self.breakers.items()},
+            'provider_concurrency': {name: limiter.stats() for name, limiter in self.limiters.items()},
+            'routing': self.router.snapshot(),
+            'hedging': self.hedge_stats.stats(),
+            'history': self.history.stats()
+        }
+
+# 全局实例
+unified_ai_service = UnifiedAIService()
+
+def get_unified_ai_response(data: Dict[str, Any]) -> str:
+    """获取统一AI回复"""
+    result = unified_ai_service.get_ai_response(data)
     return result['response'] 
\ No newline at end of file
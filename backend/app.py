@@ -6,15 +6,17 @@ AI Chat Backend - 高性能优化版
 
 import os
 import json
+import hashlib
 import logging
 from datetime import datetime, timedelta
 from functools import wraps
 import traceback
 import uuid
+import base64
+from sqlalchemy import event, and_, or_, bindparam
 from sqlalchemy.exc import IntegrityError
 import asyncio
 import threading
-from concurrent.futures import ThreadPoolExecutor
 import time
 import eventlet
 import eventlet.wsgi
@@ -41,13 +43,25 @@ load_env_file('../config.env')
 load_env_file('./config.env')
 load_env_file(os.path.join(os.path.dirname(__file__), 'config.env'))
 
-from flask import Flask, request, jsonify, session, g
+from flask import Flask, Response, request, jsonify, session, g
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 
+from utils.cache import BoundedCache, TieredCache, create_redis_cache
+from utils.config import get_redis_config, get_socketio_config
+from utils.auth_cache import PrincipalCache
+from utils.persistence import MessageWriter
+from utils.socket_auth import socket_registry
+from utils.rate_limit import create_rate_limiter
+from utils.scheduler import SchedulerBusy, create_scheduler
+from utils.jobs import DONE, FAILED, RUNNING, create_job_store
+from utils import metrics
+from utils.tracing import tracer, instrument_engine as trace_engine
+import migrations
+
 # 导入AI服务（延迟导入，避免启动时阻塞）
 def get_unified_ai_service():
     try:
@@ -65,6 +79,17 @@ def ensure_ai_service():
     global unified_ai_service
     if unified_ai_service is None:
         unified_ai_service = get_unified_ai_service()
+        if unified_ai_service is not None:
+            # 会话上下文缓存未命中时从chat_messages懒加载
+            from ai_services.context_store import context_store
+            context_store.set_loader(load_session_context)
+            unified_ai_service.set_observers(stage=metrics.observe_ai_stage,
+                                             provider=metrics.observe_provider_call)
+            metrics.register_executor('ai_fanout', unified_ai_service.fanout_executor)
+            metrics.register_executor('ai_hedge', unified_ai_service.hedge_executor)
+            if tracer.enabled:
+                from ai_services.transport import set_request_hook
+                set_request_hook(tracer.http_client_span)
     return unified_ai_service
 
 # 配置日志
@@ -91,39 +116,113 @@ app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
 db = SQLAlchemy(app)
 # 必须最早monkey_patch
 eventlet.monkey_patch()
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', ping_timeout=60, ping_interval=25)
+# 配置消息队列（默认REDIS_URL）时，任意进程的emit都经由Redis发布给所有进程，连接在其他
+# worker或其他机器上的客户端也能收到；多进程部署时nginx需按客户端粘滞（见nginx/nginx.conf）
+socketio_config = get_socketio_config()
+socketio_message_queue = socketio_config['message_queue']
+if socketio_message_queue:
+    try:
+        import redis  # noqa: F401  python-socketio的Redis消息队列依赖该包
+    except ImportError:
+        logger.warning("已配置Socket.IO消息队列但未安装redis，仅支持单进程")
+        socketio_message_queue = None
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', ping_timeout=60, ping_interval=25,
+                    message_queue=socketio_message_queue, channel=socketio_config['channel'])
 CORS(app)
 
-# 线程池执行器
-executor = ThreadPoolExecutor(max_workers=10)
+# 聊天任务调度器：线程数自适应、准入队列有界、按用户轮转；已满时立即返回503/busy
+executor = create_scheduler('chat', on_wait=metrics.observe_queue_wait('chat'),
+                            on_reject=metrics.count_rejection('chat'))
 
-# 简单的内存缓存
-class SimpleCache:
-    def __init__(self):
-        self.cache = {}
-        self.lock = threading.Lock()
-    
-    def get(self, key):
-        with self.lock:
-            if key in self.cache:
-                value, expire_time = self.cache[key]
-                if expire_time > time.time():
-                    return value
-                else:
-                    del self.cache[key]
-            return None
-    
-    def set(self, key, value, ttl=300):  # 默认5分钟TTL
-        with self.lock:
-            self.cache[key] = (value, time.time() + ttl)
-    
-    def delete(self, key):
-        with self.lock:
-            if key in self.cache:
-                del self.cache[key]
+# 异步聊天任务（POST /api/chat 带async=true）的状态存储，配置REDIS_URL时多个worker共享
+job_store = create_job_store(
+    get_redis_config(),
+    result_ttl=float(os.getenv('CHAT_JOB_RESULT_TTL', 600)),
+    poll_interval=float(os.getenv('CHAT_JOB_POLL_INTERVAL', 0.25))
+)
+# GET /api/chat/jobs/<id>?wait=N 的最长等待秒数，应小于nginx的proxy_read_timeout
+CHAT_JOB_MAX_WAIT = float(os.getenv('CHAT_JOB_MAX_WAIT', 25))
+
+# 全局缓存实例：进程内有界LRU(L1)，配置REDIS_URL时叠加Redis(L2)供多个worker共享
+cache = TieredCache(
+    BoundedCache(
+        max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+        max_bytes=int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+        shards=int(os.getenv('CACHE_SHARDS', 16)),
+        sweep_interval=float(os.getenv('CACHE_SWEEP_INTERVAL', 30))
+    ),
+    create_redis_cache(get_redis_config()),
+    l1_ttl=int(os.getenv('CACHE_L1_TTL', 30))
+)
+cache.start_sweeper()
+
+# 认证缓存：已验证的JWT和用户信息，避免每个请求都查询users表
+principal_cache = PrincipalCache(
+    principal_ttl=int(os.getenv('AUTH_PRINCIPAL_TTL', 60)),
+    token_ttl=int(os.getenv('AUTH_TOKEN_CACHE_TTL', 300))
+)
+principal_cache.start_sweeper()
+
+# 指标：请求耗时在after_request中记录，线程池积压和缓存大小由后台定期采样
+metrics.register_executor('chat', executor)
+metrics.register_cache('l1', cache.l1)
+with app.app_context():
+    metrics.instrument_engine(db.engine)
+    trace_engine(tracer, db.engine)
+metrics.sampler.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.monotonic()
 
-# 全局缓存实例
-cache = SimpleCache()
+# 追踪：每个请求一条trace（按TRACE_SAMPLE_RATE采样，跟随上游traceparent），
+# 在teardown中结束，异常返回的请求也会记录
+@app.before_request
+def start_request_trace():
+    span, token = tracer.start_trace(f'{request.method} {request.path}',
+                                     request.headers.get('traceparent'),
+                                     **{'http.method': request.method, 'http.target': request.path})
+    if span is not None:
+        g.trace = (span, token)
+
+@app.teardown_request
+def finish_request_trace(error=None):
+    trace = g.pop('trace', None)
+    if trace is None:
+        return
+    span, token = trace
+    if request.url_rule is not None:
+        span.set_attribute('http.route', request.url_rule.rule)
+    if error is not None:
+        span.set_error(error)
+    tracer.finish_trace(span, token)
+
+@app.after_request
+def record_request_latency(response):
+    started = g.get('request_start')
+    if started is not None:
+        # 按路由模板而不是实际路径统计，避免会话ID等参数造成标签爆炸
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.HTTP_REQUEST_LATENCY.labels(request.method, route, response.status_code)\
+            .observe(time.monotonic() - started)
+    return response
+
+# 按用户的令牌桶限流：api_limiter作用于所有需要认证的REST接口，
+# chat_limiter额外限制会调用AI模型的/api/chat和Socket消息
+api_limiter = create_rate_limiter(
+    rate=float(os.getenv('RATE_LIMIT_API_RATE', 10)),
+    burst=int(os.getenv('RATE_LIMIT_API_BURST', 50)),
+    redis_config=get_redis_config(),
+    prefix='aichat:ratelimit:api:'
+)
+api_limiter.start_sweeper()
+chat_limiter = create_rate_limiter(
+    rate=float(os.getenv('RATE_LIMIT_CHAT_RATE', 0.5)),
+    burst=int(os.getenv('RATE_LIMIT_CHAT_BURST', 10)),
+    redis_config=get_redis_config(),
+    prefix='aichat:ratelimit:chat:'
+)
+chat_limiter.start_sweeper()
 
 # 数据模型
 class User(db.Model):
@@ -159,6 +258,10 @@ class ChatSession(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     title = db.Column(db.Text, default='')
     
+    __table_args__ = (
+        db.Index('ix_chat_sessions_user_id_updated_at', 'user_id', 'updated_at'),
+    )
+    
     # 关联消息
     messages = db.relationship('ChatMessage', backref='session', lazy='dynamic')
     
@@ -183,6 +286,11 @@ class ChatMessage(db.Model):
     ai_models_used = db.Column(db.Text)  # JSON string of AI models
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_chat_messages_session_id_timestamp', 'session_id', 'timestamp'),
+        db.Index('ix_chat_messages_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -194,6 +302,44 @@ class ChatMessage(db.Model):
             'timestamp': self.timestamp.isoformat()
         }
 
+def load_session_context(session_id, limit):
+    """从chat_messages加载会话最近的消息，作为AI服务的对话上下文"""
+    with app.app_context():
+        messages = ChatMessage.query.filter_by(session_id=session_id)\
+            .order_by(ChatMessage.timestamp.desc())\
+            .limit(limit)\
+            .all()
+        return [{
+            'role': 'user' if msg.message_type == 'user' else 'assistant',
+            'content': msg.content
+        } for msg in reversed(messages)]
+
+def flush_chat_messages(messages, touches):
+    """在一个事务中批量写入聊天消息（多行INSERT）并更新会话时间"""
+    with app.app_context():
+        with db.engine.begin() as conn:
+            if messages:
+                conn.execute(ChatMessage.__table__.insert().values(messages))
+            if touches:
+                sessions = ChatSession.__table__
+                conn.execute(
+                    sessions.update()
+                    .where(sessions.c.id == bindparam('b_id'))
+                    .values(updated_at=bindparam('b_updated_at')),
+                    [{'b_id': session_id, 'b_updated_at': updated_at}
+                     for session_id, updated_at in touches.items()]
+                )
+
+# 聊天消息写后持久化：请求线程只入队，由后台线程批量写入
+message_writer = MessageWriter(
+    flush_chat_messages,
+    max_queue=int(os.getenv('PERSIST_QUEUE_SIZE', 10000)),
+    batch_size=int(os.getenv('PERSIST_BATCH_SIZE', 200)),
+    flush_interval=float(os.getenv('PERSIST_FLUSH_INTERVAL', 0.05)),
+    durability=os.getenv('PERSIST_DURABILITY', 'async')
+)
+message_writer.start()
+
 # JWT工具函数
 def generate_token(user_id):
     payload = {
@@ -203,14 +349,35 @@ def generate_token(user_id):
     return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
 
 def verify_token(token):
+    # 签名验证结果缓存，过期时间不超过token本身
+    user_id = principal_cache.get_token(token)
+    if user_id is not None:
+        return user_id
     try:
         payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+        principal_cache.put_token(token, payload['user_id'], payload.get('exp'))
         return payload['user_id']
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
+def get_principal(user_id):
+    """获取已认证用户信息，优先读取缓存，未命中时按主键查询"""
+    principal = principal_cache.get_principal(user_id)
+    if principal is not None:
+        return principal
+    user = User.query.get(user_id)
+    if not user:
+        return None
+    return principal_cache.put_principal(user.to_dict())
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_principal(mapper, connection, target):
+    """用户信息变更时使认证缓存失效"""
+    principal_cache.invalidate_user(target.id)
+
 # 认证装饰器
 def require_auth(f):
     @wraps(f)
@@ -220,19 +387,48 @@ def require_auth(f):
             return jsonify({'error': '缺少认证令牌'}), 401
         
         token = token.split(' ')[1]
-        user_id = verify_token(token)
+        with tracer.span('auth'):
+            user_id = verify_token(token)
+            # 获取用户信息（短TTL缓存，避免每个请求都查询数据库）
+            user = get_principal(user_id) if user_id else None
         if not user_id:
             return jsonify({'error': '无效的认证令牌'}), 401
         
-        # 获取用户信息
-        user = User.query.get(user_id)
         if not user:
             return jsonify({'error': '用户不存在'}), 401
         
         g.current_user = user
+        
+        allowed, retry_after = api_limiter.allow(user.id)
+        if not allowed:
+            return rate_limit_response(retry_after)
         return f(*args, **kwargs)
     return decorated_function
 
+def rate_limit_response(retry_after):
+    """429响应，带Retry-After头"""
+    response = jsonify({'error': '请求过于频繁，请稍后重试', 'retry_after': round(retry_after, 2)})
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response, 429
+
+def busy_response(retry_after):
+    """调度器已满时的503响应，带Retry-After头"""
+    response = jsonify({'error': '服务繁忙，请稍后重试', 'retry_after': round(retry_after, 2)})
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response, 503
+
+def rate_limited(limiter):
+    """按当前用户限流的装饰器，需放在require_auth之后"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            allowed, retry_after = limiter.allow(g.current_user.id)
+            if not allowed:
+                return rate_limit_response(retry_after)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
 # 异步AI响应生成
 def generate_ai_response_async(data):
     """异步生成AI响应"""
@@ -257,7 +453,8 @@ def generate_ai_response_async(data):
         
         return {
             'response': ai_response_data['response'],
-            'ai_models_used': ai_response_data.get('ai_models_used', ['unified'])
+            'ai_models_used': ai_response_data.get('ai_models_used', ['unified']),
+            'hedges': ai_response_data.get('hedges')
         }
     except Exception as e:
         logger.error(f"AI响应生成失败: {e}")
@@ -266,11 +463,183 @@ def generate_ai_response_async(data):
             'ai_models_used': ['fallback']
         }
 
+# 流式AI响应生成
+def stream_ai_response_async(data, sid, persist=False):
+    """流式生成AI响应，并通过Socket.IO逐块推送给指定客户端；persist为True时保存这一轮对话"""
+    session_id = data.get('session_id')
+    user_time = datetime.utcnow()
+    done = None
+    try:
+        ai_service = ensure_ai_service()
+        if ai_service is None:
+            done = {
+                'response': '抱歉，AI服务暂时不可用，请稍后重试。',
+                'ai_models_used': ['fallback'],
+                'session_id': session_id
+            }
+        else:
+            for event in ai_service.get_ai_response_stream(data):
+                if event['type'] == 'chunk':
+                    socketio.emit('ai_response_chunk', {
+                        'content': event['content'],
+                        'model': event['model'],
+                        'session_id': session_id
+                    }, to=sid)
+                else:
+                    done = {
+                        'response': event['response'],
+                        'ai_models_used': event.get('ai_models_used', ['unified']),
+                        'hedges': event.get('hedges'),
+                        'session_id': session_id
+                    }
+    except Exception as e:
+        logger.error(f"AI流式响应失败: {e}")
+        done = {
+            'response': '抱歉，我暂时无法回复，请稍后重试。',
+            'ai_models_used': ['fallback'],
+            'session_id': session_id
+        }
+    
+    if done is None:
+        return
+    if persist:
+        try:
+            message_writer.add_turn(
+                user_id=data.get('user_id'),
+                session_id=session_id,
+                user_message=data.get('message', ''),
+                ai_response=done['response'],
+                ai_models_used=json.dumps(done['ai_models_used']),
+                user_time=user_time
+            )
+        except Exception as e:
+            logger.error(f"保存流式对话失败: {e}")
+        broadcast_turn(session_id, data.get('message', ''), done['response'], skip_sid=sid)
+    socketio.emit('ai_response_done', done, to=sid)
+
+def complete_chat_turn(user_id, session_id, message, user_time, cache_key, ai_response_data):
+    """保存一轮对话并缓存回复，返回/api/chat的响应内容"""
+    # 保存用户消息和AI回复，并更新会话时间（由后台写线程批量提交）
+    message_writer.add_turn(
+        user_id=user_id,
+        session_id=session_id,
+        user_message=message,
+        ai_response=ai_response_data['response'],
+        ai_models_used=json.dumps(ai_response_data.get('ai_models_used', ['unified'])),
+        user_time=user_time
+    )
+    
+    # 缓存响应（短期缓存）
+    response_data = {
+        'response': ai_response_data['response'], 
+        'ai_models_used': ai_response_data['ai_models_used'],
+        'session_id': session_id
+    }
+    cache.set(cache_key, response_data, ttl=60)  # 1分钟缓存
+    
+    broadcast_turn(session_id, message, ai_response_data['response'])
+    
+    # 对冲计数只属于本次调用，不写入缓存
+    return dict(response_data, hedges=ai_response_data.get('hedges'))
+
+def user_room(user_id):
+    """用户的Socket.IO房间，该用户的所有连接在connect时加入"""
+    return f"user:{user_id}"
+
+def session_room(session_id):
+    """会话的Socket.IO房间，连接通过join_session/leave_session加入和离开"""
+    return f"session:{session_id}"
+
+def broadcast_turn(session_id, user_message, ai_response, skip_sid=None):
+    """把一轮已保存的对话推送给会话房间中的其他连接（其他标签页或设备，可能在其他worker上）"""
+    room = session_room(session_id)
+    for sender, text in (('user', user_message), ('ai', ai_response)):
+        socketio.emit('new_message', {
+            'sender': sender,
+            'message': text,
+            'is_audio': False,
+            'session_id': session_id
+        }, to=room, skip_sid=skip_sid)
+
+def job_payload(job):
+    """任务的对外表示"""
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'session_id': job['session_id'],
+        'result': job['result'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at']
+    }
+
+def job_accepted_response(job):
+    """202响应，Location指向任务查询接口"""
+    response = jsonify(job_payload(job))
+    response.headers['Location'] = f"/api/chat/jobs/{job['id']}"
+    return response, 202
+
+def run_chat_job(job_id, data, user_time, cache_key):
+    """在调度器中执行异步聊天任务，结束后写入任务存储并推送到用户房间"""
+    user_id = data.get('user_id')
+    job_store.update(job_id, status=RUNNING)
+    try:
+        ai_response_data = generate_ai_response_async(data)
+        result = complete_chat_turn(user_id, data.get('session_id'), data.get('message', ''), user_time,
+                                    cache_key, ai_response_data)
+        job = job_store.update(job_id, status=DONE, result=result)
+    except Exception as e:
+        logger.error(f"异步聊天任务失败: {e}")
+        job = job_store.update(job_id, status=FAILED, error='聊天失败')
+    if job is not None:
+        socketio.emit('chat_job_done', job_payload(job), to=user_room(user_id))
+
 # 健康检查接口
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "ok"}), 200
 
+# 缓存统计接口
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(cache.stats()), 200
+
+# 消息持久化队列统计接口
+@app.route('/api/persistence/stats', methods=['GET'])
+def persistence_stats():
+    return jsonify(message_writer.stats()), 200
+
+# 异步聊天任务统计接口
+@app.route('/api/jobs/stats', methods=['GET'])
+def job_stats():
+    return jsonify(job_store.stats()), 200
+
+# 聊天调度器统计接口
+@app.route('/api/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    return jsonify(executor.stats()), 200
+
+# AI服务统计接口（请求合并等）
+@app.route('/api/ai/stats', methods=['GET'])
+def ai_stats():
+    ai_service = ensure_ai_service()
+    if ai_service is None:
+        return jsonify({'error': 'AI服务未初始化'}), 503
+    return jsonify(ai_service.get_stats()), 200
+
+# Prometheus指标接口
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if not metrics.ENABLED:
+        return jsonify({'error': '未启用指标'}), 404
+    body, content_type = metrics.render()
+    return Response(body, headers={'Content-Type': content_type})
+
+# 限流统计接口
+@app.route('/api/ratelimit/stats', methods=['GET'])
+def rate_limit_stats():
+    return jsonify({'api': api_limiter.stats(), 'chat': chat_limiter.stats()}), 200
+
 # 用户注册接口
 @app.route('/api/auth/register', methods=['POST'])
 def register():
@@ -380,12 +749,73 @@ def create_session():
         
         db.session.add(new_session)
         db.session.commit()
+        socket_registry.add_session(g.current_user.id, session_id)
         
         return jsonify({'session_id': new_session.id}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+# 游标分页工具
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 200
+
+def encode_cursor(timestamp, row_id):
+    """将 (时间, id) 编码为不透明的分页游标"""
+    raw = f"{timestamp.isoformat()}|{row_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """解码分页游标，格式错误时抛出ValueError"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+    timestamp, row_id = raw.split('|', 1)
+    return datetime.fromisoformat(timestamp), row_id
+
+def get_page_args():
+    """解析分页参数，未提供任何分页参数时返回None（保持一次返回全部的旧行为）"""
+    if not any(key in request.args for key in ('limit', 'before', 'after')):
+        return None
+    limit = request.args.get('limit', DEFAULT_PAGE_LIMIT, type=int) or DEFAULT_PAGE_LIMIT
+    before = request.args.get('before')
+    after = request.args.get('after')
+    if before and after:
+        raise ValueError('before和after不能同时使用')
+    return {
+        'limit': max(1, min(limit, MAX_PAGE_LIMIT)),
+        'before': decode_cursor(before) if before else None,
+        'after': decode_cursor(after) if after else None
+    }
+
+def keyset_page(query, time_column, id_column, page, id_type=str):
+    """按 (时间, id) 做键集分页，返回 (按时间倒序的记录, 是否还有更多)
+
+    before: 早于游标的记录；after: 晚于游标的记录；都不提供时返回最新的一页。
+    """
+    if page['after']:
+        after_time, after_id = page['after']
+        after_id = id_type(after_id)
+        query = query.filter(or_(
+            time_column > after_time,
+            and_(time_column == after_time, id_column > after_id)
+        )).order_by(time_column.asc(), id_column.asc())
+    else:
+        if page['before']:
+            before_time, before_id = page['before']
+            before_id = id_type(before_id)
+            query = query.filter(or_(
+                time_column < before_time,
+                and_(time_column == before_time, id_column < before_id)
+            ))
+        query = query.order_by(time_column.desc(), id_column.desc())
+    
+    rows = query.limit(page['limit'] + 1).all()
+    has_more = len(rows) > page['limit']
+    rows = rows[:page['limit']]
+    if page['after']:
+        rows.reverse()
+    return rows, has_more
+
 # 获取会话历史
 @app.route('/api/session/<session_id>/history', methods=['GET'])
 @require_auth
@@ -400,14 +830,37 @@ def get_session_history(session_id):
         if not session_obj:
             return jsonify({'error': '会话不存在'}), 404
         
-        # 获取消息历史
-        messages = ChatMessage.query.filter_by(session_id=session_id)\
-            .order_by(ChatMessage.timestamp.asc())\
-            .all()
+        # 保证能读到本会话刚提交、尚在写入队列中的消息
+        if message_writer.has_pending(session_id):
+            message_writer.flush(timeout=5)
+        
+        try:
+            page = get_page_args()
+        except ValueError:
+            return jsonify({'error': '无效的分页游标'}), 400
+        
+        query = ChatMessage.query.filter_by(session_id=session_id)
+        if page is None:
+            # 获取全部消息历史
+            messages = query.order_by(ChatMessage.timestamp.asc()).all()
+            return jsonify({
+                'session': session_obj.to_dict(),
+                'messages': [msg.to_dict() for msg in messages]
+            }), 200
+        
+        # 分页获取消息历史，页内按时间正序返回
+        messages, has_more = keyset_page(query, ChatMessage.timestamp, ChatMessage.id, page, id_type=int)
+        messages.reverse()
         
         return jsonify({
             'session': session_obj.to_dict(),
-            'messages': [msg.to_dict() for msg in messages]
+            'messages': [msg.to_dict() for msg in messages],
+            'paging': {
+                'limit': page['limit'],
+                'has_more': has_more,
+                'before': encode_cursor(messages[0].timestamp, messages[0].id) if messages else None,
+                'after': encode_cursor(messages[-1].timestamp, messages[-1].id) if messages else None
+            }
         }), 200
         
     except Exception as e:
@@ -419,12 +872,29 @@ def get_session_history(session_id):
 @require_auth
 def get_user_sessions():
     try:
-        sessions = ChatSession.query.filter_by(user_id=g.current_user.id)\
-            .order_by(ChatSession.updated_at.desc())\
-            .all()
+        try:
+            page = get_page_args()
+        except ValueError:
+            return jsonify({'error': '无效的分页游标'}), 400
+        
+        query = ChatSession.query.filter_by(user_id=g.current_user.id)
+        if page is None:
+            sessions = query.order_by(ChatSession.updated_at.desc()).all()
+            return jsonify({
+                'sessions': [session.to_dict() for session in sessions]
+            }), 200
+        
+        # 分页获取会话，按更新时间倒序
+        sessions, has_more = keyset_page(query, ChatSession.updated_at, ChatSession.id, page)
         
         return jsonify({
-            'sessions': [session.to_dict() for session in sessions]
+            'sessions': [session.to_dict() for session in sessions],
+            'paging': {
+                'limit': page['limit'],
+                'has_more': has_more,
+                'before': encode_cursor(sessions[-1].updated_at, sessions[-1].id) if sessions else None,
+                'after': encode_cursor(sessions[0].updated_at, sessions[0].id) if sessions else None
+            }
         }), 200
         
     except Exception as e:
@@ -445,10 +915,15 @@ def delete_session(session_id):
         if not session_obj:
             return jsonify({'error': '会话不存在'}), 404
         
+        # 先写完队列中该会话的消息，避免删除后又被写入
+        if message_writer.has_pending(session_id):
+            message_writer.flush(timeout=5)
+        
         # 删除会话及其消息
         ChatMessage.query.filter_by(session_id=session_id).delete()
         db.session.delete(session_obj)
         db.session.commit()
+        socket_registry.remove_session(g.current_user.id, session_id)
         
         return jsonify({'message': '会话删除成功'}), 200
         
@@ -460,6 +935,7 @@ def delete_session(session_id):
 # 聊天接口
 @app.route('/api/chat', methods=['POST'])
 @require_auth
+@rate_limited(chat_limiter)
 def chat():
     try:
         data = request.get_json()
@@ -473,76 +949,95 @@ def chat():
             return jsonify({'error': '缺少session_id'}), 400
         
         # 验证会话所有权
-        session_obj = ChatSession.query.filter_by(
-            id=session_id, 
-            user_id=g.current_user.id
-        ).first()
+        with tracer.span('session.ownership'):
+            session_obj = ChatSession.query.filter_by(
+                id=session_id, 
+                user_id=g.current_user.id
+            ).first()
         
         if not session_obj:
             return jsonify({'error': '会话不存在'}), 404
         
-        # 检查缓存
-        cache_key = f"chat:{session_id}:{hash(message)}"
+        # 检查缓存（使用稳定哈希，保证多个worker之间key一致）
+        cache_key = f"chat:{session_id}:{hashlib.sha1(message.encode('utf-8')).hexdigest()}"
         cached_response = cache.get(cache_key)
+        async_mode = bool(data.get('async'))
         if cached_response:
+            if async_mode:
+                job = job_store.create(g.current_user.id, session_id)
+                job = job_store.update(job['id'], status=DONE, result=cached_response)
+                return job_accepted_response(job)
             return jsonify(cached_response), 200
         
-        # 保存用户消息
-        user_message = ChatMessage(
-            user_id=g.current_user.id,
-            session_id=session_id,
-            message_type='user',
-            content=message
-        )
-        db.session.add(user_message)
+        # 归还数据库连接，避免在等待AI回复期间占用连接池
+        db.session.close()
+        user_time = datetime.utcnow()
+        
+        # 异步模式：立即返回任务ID，结果通过轮询或Socket.IO推送获取
+        if async_mode:
+            job = job_store.create(g.current_user.id, session_id)
+            try:
+                executor.submit(g.current_user.id, tracer.wrap(run_chat_job), job['id'], {
+                    'message': message,
+                    'user_id': g.current_user.id,
+                    'session_id': session_id
+                }, user_time, cache_key)
+            except SchedulerBusy as e:
+                job_store.update(job['id'], status=FAILED, error='服务繁忙')
+                logger.warning(f"聊天调度器已满({e.reason})，拒绝请求")
+                return busy_response(e.retry_after)
+            return job_accepted_response(job)
         
         # 异步获取AI回复
-        future = executor.submit(generate_ai_response_async, {
-            'message': message,
-            'user_id': g.current_user.id,
-            'session_id': session_id
-        })
+        try:
+            future = executor.submit(g.current_user.id, tracer.wrap(generate_ai_response_async), {
+                'message': message,
+                'user_id': g.current_user.id,
+                'session_id': session_id
+            })
+        except SchedulerBusy as e:
+            logger.warning(f"聊天调度器已满({e.reason})，拒绝请求")
+            return busy_response(e.retry_after)
         
         # 等待AI回复
         try:
-            ai_response_data = future.result(timeout=30)
+            with tracer.span('executor.wait'):
+                ai_response_data = future.result(timeout=30)
         except Exception as e:
+            # 仍在排队的任务不再执行
+            future.cancel()
             logger.error(f"AI响应超时: {e}")
             ai_response_data = {
                 'response': '抱歉，我暂时无法回复，请稍后重试。',
                 'ai_models_used': ['fallback']
             }
         
-        # 保存AI回复
-        ai_message = ChatMessage(
-            user_id=g.current_user.id,
-            session_id=session_id,
-            message_type='ai',
-            content=ai_response_data['response'],
-            ai_models_used=json.dumps(ai_response_data.get('ai_models_used', ['unified']))
-        )
-        db.session.add(ai_message)
-        
-        # 更新会话时间
-        session_obj.updated_at = datetime.utcnow()
-        
-        db.session.commit()
-        
-        # 缓存响应（短期缓存）
-        response_data = {
-            'response': ai_response_data['response'], 
-            'ai_models_used': ai_response_data['ai_models_used'],
-            'session_id': session_id
-        }
-        cache.set(cache_key, response_data, ttl=60)  # 1分钟缓存
-        
-        return jsonify(response_data)
+        return jsonify(complete_chat_turn(g.current_user.id, session_id, message, user_time,
+                                          cache_key, ai_response_data))
         
     except Exception as e:
         logger.error(f"Chat error: {e}\n{traceback.format_exc()}")
         db.session.rollback()
         return jsonify({'error': '聊天失败'}), 500
 
+@app.route('/api/chat/jobs/<job_id>', methods=['GET'])
+@require_auth
+def get_chat_job(job_id):
+    """查询异步聊天任务；wait参数（秒）指定长轮询时间，任务结束或超时后返回"""
+    job = job_store.get(job_id)
+    if job is None or job['user_id'] != g.current_user.id:
+        return jsonify({'error': '任务不存在'}), 404
+    
+    try:
+        wait = min(float(request.args.get('wait', 0)), CHAT_JOB_MAX_WAIT)
+    except ValueError:
+        return jsonify({'error': 'wait参数无效'}), 400
+    if wait > 0 and job['status'] not in (DONE, FAILED):
+        # 长轮询期间不占用数据库连接
+        db.session.close()
+        job = job_store.wait(job_id, wait) or job
+    return jsonify(job_payload(job)), 200
+
 @app.route('/api/chat/history/<int:user_id>', methods=['GET'])
 @require_auth
 def get_chat_history(user_id):
@@ -584,20 +1079,14 @@ def get_chat_history(user_id):
 @app.route('/api/ai/models', methods=['GET'])
 def get_ai_models():
     try:
-        # 检查缓存
-        cache_key = "ai_models_info"
-        cached_models = cache.get(cache_key)
-        if cached_models:
-            return jsonify(cached_models), 200
+        def load_models_info():
+            ai_service = ensure_ai_service()
+            if ai_service is None:
+                return {'error': 'AI服务未初始化'}
+            return ai_service.get_ai_models_info()
         
-        ai_service = ensure_ai_service()
-        if ai_service is None:
-            models_info = {'error': 'AI服务未初始化'}
-        else:
-            models_info = ai_service.get_ai_models_info()
-        
-        # 缓存模型信息（10分钟）
-        cache.set(cache_key, models_info, ttl=600)
+        # 缓存模型信息（10分钟），并发未命中时只加载一次
+        models_info = cache.get_or_set("ai_models_info", load_models_info, ttl=600)
         
         return jsonify(models_info), 200
     except Exception as e:
@@ -605,21 +1094,65 @@ def get_ai_models():
         return jsonify({'error': '获取AI模型信息失败'}), 500
 
 # WebSocket事件处理
+SOCKET_PRELOAD_SESSIONS = int(os.getenv('SOCKET_PRELOAD_SESSIONS', 200))
+
+def get_socket_token(auth):
+    """从connect的auth数据、查询参数或请求头中读取token"""
+    token = auth.get('token') if isinstance(auth, dict) else None
+    token = token or request.args.get('token') or request.headers.get('Authorization')
+    if token and token.startswith('Bearer '):
+        token = token[7:]
+    return token
+
+def user_owns_session(session_id, user_id):
+    """查询会话是否属于用户"""
+    try:
+        return db.session.query(ChatSession.id).filter_by(id=session_id, user_id=user_id).first() is not None
+    finally:
+        db.session.close()
+
 @socketio.on('connect')
-def handle_connect():
+@tracer.traced('socket connect')
+def handle_connect(auth=None):
+    # token只在连接时验证一次，之后的事件通过sid查找认证信息
+    token = get_socket_token(auth)
+    if token:
+        user_id = verify_token(token)
+        principal = get_principal(user_id) if user_id is not None else None
+        if principal is None:
+            logger.info('Client rejected: invalid token')
+            return False
+        # 预加载用户最近的会话ID，之后新建的会话在首次使用时补充
+        sessions = db.session.query(ChatSession.id)\
+            .filter_by(user_id=principal.id)\
+            .order_by(ChatSession.updated_at.desc())\
+            .limit(SOCKET_PRELOAD_SESSIONS)\
+            .all()
+        db.session.close()
+        socket_registry.register(request.sid, principal, (row[0] for row in sessions))
+        # 异步聊天任务的结果推送到用户房间，同一用户的所有连接都能收到
+        join_room(user_room(principal.id))
+    metrics.SOCKETIO_CLIENTS.inc()
     logger.info('Client connected')
-    emit('status', {'message': 'Connected to AI Chat'})
+    emit('status', {'message': 'Connected to AI Chat', 'authenticated': bool(token)})
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    socket_registry.unregister(request.sid)
+    chat_limiter.reset(f"sid:{request.sid}")
+    metrics.SOCKETIO_CLIENTS.dec()
     logger.info('Client disconnected')
 
 @socketio.on('send_message')
+@tracer.traced('socket send_message')
 def handle_message(data):
     try:
         message = data.get('message')
-        user_id = data.get('user_id')
         session_id = data.get('session_id')
+        # 用户身份只来自connect时的认证，不信任客户端传入的user_id；匿名连接的消息不保存
+        context = socket_registry.get(request.sid)
+        user_id = context.user_id if context is not None else None
+        persist = context is not None
         
         if not message:
             emit('error', {'message': '消息不能为空'})
@@ -629,27 +1162,70 @@ def handle_message(data):
             emit('error', {'message': '缺少session_id'})
             return
         
-        # 异步获取AI回复
-        future = executor.submit(generate_ai_response_async, {
-            'message': message,
-            'user_id': user_id,
-            'session_id': session_id
-        })
+        # 与/api/chat共用按用户的限额；匿名连接按sid限流
+        owner = user_id if persist else f"sid:{request.sid}"
+        allowed, retry_after = chat_limiter.allow(owner)
+        if not allowed:
+            emit('error', {'message': '请求过于频繁，请稍后重试', 'retry_after': round(retry_after, 2)})
+            return
+        
+        # 验证会话所有权（连接级缓存，只有未知会话才查询数据库）
+        if persist and not socket_registry.owns(request.sid, session_id, user_owns_session):
+            emit('error', {'message': '会话不存在'})
+            return
+        
+        # 流式模式：逐块推送ai_response_chunk，最后推送ai_response_done
+        try:
+            if data.get('stream'):
+                executor.submit(owner, tracer.wrap(stream_ai_response_async), {
+                    'message': message,
+                    'user_id': user_id,
+                    'session_id': session_id
+                }, request.sid, persist)
+                return
+            
+            user_time = datetime.utcnow()
+            
+            # 异步获取AI回复
+            future = executor.submit(owner, tracer.wrap(generate_ai_response_async), {
+                'message': message,
+                'user_id': user_id,
+                'session_id': session_id
+            })
+        except SchedulerBusy as e:
+            logger.warning(f"聊天调度器已满({e.reason})，拒绝消息")
+            emit('busy', {'message': '服务繁忙，请稍后重试', 'retry_after': round(e.retry_after, 2)})
+            return
         
         # 等待AI回复
         try:
-            ai_response_data = future.result(timeout=30)
+            with tracer.span('executor.wait'):
+                ai_response_data = future.result(timeout=30)
         except Exception as e:
+            future.cancel()
             logger.error(f"WebSocket AI响应失败: {e}")
             ai_response_data = {
                 'response': f"抱歉，我暂时无法回复，请稍后重试。",
                 'ai_models_used': ['fallback']
             }
         
+        ai_models_used = ai_response_data.get('ai_models_used', ['unified'])
+        if persist:
+            # 与/api/chat共用同一个写后持久化队列
+            message_writer.add_turn(
+                user_id=user_id,
+                session_id=session_id,
+                user_message=message,
+                ai_response=ai_response_data['response'],
+                ai_models_used=json.dumps(ai_models_used),
+                user_time=user_time
+            )
+            broadcast_turn(session_id, message, ai_response_data['response'], skip_sid=request.sid)
+        
         # 发送AI回复
         emit('ai_response', {
             'response': ai_response_data['response'],
-            'ai_models_used': ai_response_data.get('ai_models_used', ['unified']),
+            'ai_models_used': ai_models_used,
             'session_id': session_id
         })
         
@@ -657,6 +1233,35 @@ def handle_message(data):
         logger.error(f"WebSocket message error: {e}")
         emit('error', {'message': '处理消息失败'})
 
+@socketio.on('join_session')
+def handle_join_session(data):
+    """加入会话房间；只有已认证且拥有该会话的连接可以加入"""
+    context = socket_registry.get(request.sid)
+    session_id = (data or {}).get('session_id')
+    if context is None:
+        emit('error', {'message': '未认证的连接不能加入会话'})
+        return
+    if not session_id:
+        emit('error', {'message': '缺少session_id'})
+        return
+    if not socket_registry.owns(request.sid, session_id, user_owns_session):
+        emit('error', {'message': '会话不存在'})
+        return
+    join_room(session_room(session_id))
+    emit('user_joined', {'user_id': str(context.user_id), 'session_id': session_id},
+         to=session_room(session_id), include_self=False)
+
+@socketio.on('leave_session')
+def handle_leave_session(data):
+    """离开会话房间；断开连接时Socket.IO会自动离开所有房间"""
+    context = socket_registry.get(request.sid)
+    session_id = (data or {}).get('session_id')
+    if context is None or not session_id:
+        return
+    leave_room(session_room(session_id))
+    emit('user_left', {'user_id': str(context.user_id), 'session_id': session_id},
+         to=session_room(session_id))
+
 # 错误处理
 @app.errorhandler(404)
 def not_found(error):
@@ -673,6 +1278,9 @@ def init_database():
     with app.app_context():
         try:
             db.create_all()
+            executed = migrations.upgrade(db.engine)
+            if executed:
+                logger.info(f"已执行数据库迁移: {', '.join(executed)}")
             logger.info("数据库表自动检查/修复完成")
         except Exception as e:
             logger.error(f"数据库自动修复失败: {e}")
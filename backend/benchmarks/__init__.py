@@ -0,0 +1,6 @@
+"""
+Benchmarks package for AI Chat Backend
+
+This package contains offline benchmarks and load tests. They run against
+local stand-ins (such as the mock AI provider) instead of real services.
+"""
@@ -0,0 +1,163 @@
+"""
+Socket事件认证压测 - 对比逐事件验证token与连接级认证缓存的单worker吞吐量
+
+- per-event: 每个事件都从连接参数读取token、解码JWT、查询用户和会话所有权
+  （原 socket_auth_required + handle_message 的做法）
+- per-sid:   connect时验证一次并登记到 utils.socket_auth.SocketAuthRegistry，
+  每个事件只做一次字典查找
+
+用法:
+    python -m benchmarks.bench_socket_auth --clients 50 --events 200
+
+脚本会以子进程启动一个独立的eventlet Socket.IO服务（单worker，SQLite），
+再用aiohttp客户端并发发送带ack的事件，不会访问app.py配置的数据库。
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SECRET = 'bench-secret'
+
+def serve(port, database):
+    """子进程：启动单worker的Socket.IO服务"""
+    import eventlet
+    eventlet.monkey_patch()
+
+    import jwt
+    from flask import Flask, request
+    from flask_socketio import SocketIO
+    from sqlalchemy import create_engine, select
+
+    from benchmarks.bench_chat_queries import chat_sessions, users
+    from utils.auth_cache import Principal
+    from utils.socket_auth import SocketAuthRegistry
+
+    engine = create_engine(f'sqlite:///{database}', connect_args={'check_same_thread': False})
+    app = Flask(__name__)
+    socketio = SocketIO(app, async_mode='eventlet')
+    registry = SocketAuthRegistry()
+
+    def owns(session_id, user_id):
+        with engine.connect() as conn:
+            return conn.execute(select(chat_sessions.c.id).where(
+                chat_sessions.c.id == session_id, chat_sessions.c.user_id == user_id
+            )).first() is not None
+
+    def load_principal(token):
+        user_id = jwt.decode(token, SECRET, algorithms=['HS256'])['user_id']
+        with engine.connect() as conn:
+            row = conn.execute(select(users).where(users.c.id == user_id)).mappings().first()
+        return Principal(dict(row)) if row else None
+
+    @socketio.on('connect')
+    def connect(auth=None):
+        if request.args.get('mode') == 'per-sid':
+            principal = load_principal(request.args['token'])
+            with engine.connect() as conn:
+                sessions = [row[0] for row in conn.execute(
+                    select(chat_sessions.c.id).where(chat_sessions.c.user_id == principal.id))]
+            registry.register(request.sid, principal, sessions)
+
+    @socketio.on('disconnect')
+    def disconnect():
+        registry.unregister(request.sid)
+
+    @socketio.on('per_event')
+    def per_event(data):
+        principal = load_principal(request.args['token'])
+        return principal is not None and owns(data['session_id'], principal.id)
+
+    @socketio.on('per_sid')
+    def per_sid(data):
+        return registry.owns(request.sid, data['session_id'], owns)
+
+    socketio.run(app, host='127.0.0.1', port=port, log_output=False)
+
+def seed(database, clients):
+    """为每个客户端准备一个用户和一个会话"""
+    import jwt
+    from sqlalchemy import create_engine
+
+    from benchmarks.bench_chat_queries import chat_sessions, metadata, users
+
+    engine = create_engine(f'sqlite:///{database}')
+    metadata.create_all(engine)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(users.insert(), [{
+            'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': 'x'
+        } for i in range(1, clients + 1)])
+        conn.execute(chat_sessions.insert(), [{
+            'id': f'session-{i}', 'user_id': i, 'created_at': now, 'updated_at': now
+        } for i in range(1, clients + 1)])
+    return [
+        (jwt.encode({'user_id': i, 'exp': now + timedelta(hours=1)}, SECRET, algorithm='HS256'), f'session-{i}')
+        for i in range(1, clients + 1)
+    ]
+
+async def run_clients(port, credentials, mode, events):
+    import socketio
+
+    event = 'per_event' if mode == 'per-event' else 'per_sid'
+    clients = []
+    for token, _ in credentials:
+        client = socketio.AsyncClient()
+        await client.connect(f'http://127.0.0.1:{port}?mode={mode}&token={token}', transports=['websocket'])
+        clients.append(client)
+
+    async def drive(client, session_id):
+        failures = 0
+        for _ in range(events):
+            if not await client.call(event, {'session_id': session_id}, timeout=30):
+                failures += 1
+        return failures
+
+    start = time.perf_counter()
+    failures = await asyncio.gather(*(drive(client, session_id)
+                                      for client, (_, session_id) in zip(clients, credentials)))
+    elapsed = time.perf_counter() - start
+    total = len(clients) * events
+    print(f"{mode:<10} {total:>7} events  {elapsed:>7.2f}s  {total / elapsed:>9.1f} events/s  failures={sum(failures)}")
+
+    for client in clients:
+        await client.disconnect()
+
+def main():
+    parser = argparse.ArgumentParser(description='Socket事件认证吞吐量压测')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--port', type=int, default=8098)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.database)
+        return
+
+    database = os.path.join(tempfile.mkdtemp(), 'bench_socket_auth.db')
+    credentials = seed(database, args.clients)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.bench_socket_auth', '--serve',
+         '--port', str(args.port), '--database', database],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    try:
+        time.sleep(2)
+        print(f"clients={args.clients} events/client={args.events} (单worker)")
+        for mode in ('per-event', 'per-sid'):
+            asyncio.run(run_clients(args.port, credentials, mode, args.events))
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+上下文分类微基准 - 对比逐关键词子串扫描与编译后的单遍分类器
+
+- baseline: 原 UnifiedAIService._analyze_sentiment/_detect_topic/_assess_complexity，
+  每个关键词一次 `word in message`
+- classify: ai_services.text_classifier.TextClassifier.classify，短消息一次正则扫描，
+            长消息逐关键词子串查找
+- batch:    TextClassifier.classify_batch
+
+运行前会先用随机拼接的关键词消息校验两者结果完全一致。
+
+用法:
+    python -m benchmarks.bench_text_classifier --messages 2000 --rounds 20
+    python -m benchmarks.bench_text_classifier --density 0.3   # 关键词密集的消息
+    python -m benchmarks.bench_text_classifier --scale 20      # 长消息
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_services.text_classifier import (COMPLEX_MARKS, NEGATIVE_WORDS, POSITIVE_WORDS,
+                                         TOPIC_KEYWORDS, TextClassifier)
+
+FILLER = ['我', '想', '问', '一下', '这个', '怎么', '办', '呢', 'hello', ' ', '吗', '心', '不', '工', '学', '开', '情']
+
+def baseline(message):
+    """原实现"""
+    positive_count = sum(1 for word in POSITIVE_WORDS if word in message)
+    negative_count = sum(1 for word in NEGATIVE_WORDS if word in message)
+    if positive_count > negative_count:
+        sentiment = 'positive'
+    elif negative_count > positive_count:
+        sentiment = 'negative'
+    else:
+        sentiment = 'neutral'
+
+    topic = 'general'
+    for name, keywords in TOPIC_KEYWORDS.items():
+        if any(keyword in message for keyword in keywords):
+            topic = name
+            break
+
+    if len(message) > 100 or any(char in message for char in COMPLEX_MARKS):
+        complexity = 'complex'
+    elif len(message) > 50:
+        complexity = 'medium'
+    else:
+        complexity = 'simple'
+    return {'sentiment': sentiment, 'topic': topic, 'complexity': complexity}
+
+def generate_messages(count, seed, density, scale=1):
+    """随机拼接的消息，每个片段以density的概率取自关键词"""
+    rng = random.Random(seed)
+    vocabulary = POSITIVE_WORDS + NEGATIVE_WORDS + COMPLEX_MARKS + [
+        keyword for keywords in TOPIC_KEYWORDS.values() for keyword in keywords]
+    messages = []
+    for _ in range(count):
+        length = rng.choice([3, 8, 20, 40, 80]) * scale
+        parts = [rng.choice(vocabulary) if rng.random() < density else rng.choice(FILLER) for _ in range(length)]
+        messages.append(''.join(parts))
+    return messages
+
+def timed(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='上下文分类微基准')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--density', type=float, default=0.05, help='关键词片段所占比例')
+    parser.add_argument('--scale', type=int, default=1, help='消息长度倍数')
+    args = parser.parse_args()
+
+    classifier = TextClassifier()
+    messages = generate_messages(args.messages, args.seed, args.density, args.scale)
+
+    expected = [baseline(message) for message in messages]
+    assert [classifier.classify(message) for message in messages] == expected, 'classify结果与原实现不一致'
+    assert classifier.classify_batch(messages) == expected, 'classify_batch结果与原实现不一致'
+    average = sum(len(message) for message in messages) / len(messages)
+    print(f'{len(messages)} 条消息（平均 {average:.0f} 字符），结果与原实现一致')
+
+    total = args.messages * args.rounds
+    for name, fn in [
+        ('baseline', lambda: [baseline(message) for message in messages]),
+        ('classify', lambda: [classifier.classify(message) for message in messages]),
+        ('batch', lambda: classifier.classify_batch(messages)),
+    ]:
+        elapsed = timed(fn, args.rounds)
+        print(f'{name:<10}{elapsed / total * 1e6:>8.2f} us/条')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+追踪开销基准 - 对比关闭追踪、未采样和全采样时每个请求的耗时
+
+用一个最小的Flask应用模拟廉价接口（一次SQLite查询 + 一个子span + 一次线程池往返），
+按app.py相同的方式挂载 before_request/teardown_request、instrument_engine 和 tracer.wrap。
+span导出到丢弃型exporter，测的是请求线程上的开销，不含后台导出线程。
+
+端到端差值在几微秒量级时容易被抖动淹没，因此另外单独测量一个请求中追踪调用本身的耗时。
+按采样率 r 的期望开销 ≈ 未采样开销 + r × (全采样开销 - 未采样开销)，
+输出中给出在 --rate 下的估算值，用于确认该采样率下开销低于廉价接口耗时的1%。
+
+用法:
+    python -m benchmarks.bench_tracing --requests 2000 --rounds 5 --rate 0.01
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, g, jsonify, request
+from sqlalchemy import create_engine, text
+
+from utils.tracing import BatchSpanProcessor, Tracer, instrument_engine
+
+class NullExporter:
+    def export(self, spans):
+        pass
+
+def build_app(tracer: Tracer):
+    app = Flask(__name__)
+    engine = create_engine('sqlite://')
+    instrument_engine(tracer, engine)
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    @app.before_request
+    def start_request_trace():
+        span, token = tracer.start_trace(f'{request.method} {request.path}', request.headers.get('traceparent'))
+        if span is not None:
+            g.trace = (span, token)
+
+    @app.teardown_request
+    def finish_request_trace(error=None):
+        trace = g.pop('trace', None)
+        if trace is not None:
+            tracer.finish_trace(*trace)
+
+    @app.route('/cheap')
+    def cheap():
+        with tracer.span('auth'):
+            with engine.connect() as conn:
+                value = conn.execute(text('select 1')).scalar()
+        future = executor.submit(tracer.wrap(lambda: value + 1))
+        with tracer.span('executor.wait'):
+            return jsonify({'value': future.result()})
+
+    return app
+
+def measure(tracer: Tracer, requests: int) -> float:
+    """每个请求的平均耗时（微秒）"""
+    client = build_app(tracer).test_client()
+    for _ in range(200):
+        client.get('/cheap')
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get('/cheap')
+    elapsed = time.perf_counter() - start
+    if tracer.processor is not None:
+        while tracer.processor.stats()['queued']:
+            tracer.processor.flush()
+    return elapsed / requests * 1e6
+
+def hook_cost(tracer: Tracer, requests: int) -> float:
+    """只执行一个请求中的追踪调用（不含Flask和查询），每个请求的耗时（微秒）"""
+    task = lambda: None
+    start = time.perf_counter()
+    for _ in range(requests):
+        span, token = tracer.start_trace('GET /cheap', None)
+        with tracer.span('auth'):
+            pass
+        tracer.wrap(task)()
+        with tracer.span('executor.wait'):
+            pass
+        tracer.finish_trace(span, token)
+    return (time.perf_counter() - start) / requests * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='追踪开销基准')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--rate', type=float, default=0.01, help='计划使用的采样率')
+    args = parser.parse_args()
+
+    def processor():
+        # 队列足够大，测量期间不丢弃
+        return BatchSpanProcessor(NullExporter(), max_queue=args.requests * 20 + 10000)
+
+    # 交替运行多轮取最小值，减少机器抖动的影响
+    results = {'off': [], 'unsampled': [], 'sampled': []}
+    for _ in range(args.rounds):
+        results['off'].append(measure(Tracer(0.0), args.requests))
+        results['unsampled'].append(measure(Tracer(1e-12, processor()), args.requests))
+        results['sampled'].append(measure(Tracer(1.0, processor()), args.requests))
+    off, unsampled, sampled = (min(results[name]) for name in ('off', 'unsampled', 'sampled'))
+    # 端到端差值受抖动影响较大，另外单独测量追踪调用本身的耗时
+    cost_off = hook_cost(Tracer(0.0), args.requests * 10)
+    cost_unsampled = hook_cost(Tracer(1e-12, processor()), args.requests * 10)
+    cost_sampled = hook_cost(Tracer(1.0, processor()), args.requests * 10)
+    expected = cost_unsampled + args.rate * (cost_sampled - cost_unsampled)
+
+    print('端到端（廉价接口）')
+    print(f'  关闭追踪  {off:>8.1f} us/请求')
+    print(f'  未采样    {unsampled:>8.1f} us/请求  ({unsampled - off:+.1f} us)')
+    print(f'  全采样    {sampled:>8.1f} us/请求  ({sampled - off:+.1f} us)')
+    print('追踪调用本身（不含查询事件）')
+    print(f'  关闭追踪  {cost_off:>8.2f} us/请求')
+    print(f'  未采样    {cost_unsampled:>8.2f} us/请求')
+    print(f'  全采样    {cost_sampled:>8.2f} us/请求')
+    print(f'采样率 {args.rate:g}: 追踪调用约 {expected:.2f} us/请求，'
+          f'占廉价接口耗时的 {expected / off * 100:.2f}%')
+
+if __name__ == '__main__':
+    main()
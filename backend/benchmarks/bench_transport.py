@@ -0,0 +1,80 @@
+"""
+传输层吞吐量压测 - 对比裸requests与连接池化Session
+
+用法:
+    python -m benchmarks.bench_transport --requests 2000 --concurrency 200 --latency-ms 100
+
+脚本会在本地启动模拟服务(benchmarks.mock_provider)，不访问真实的AI服务。
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from ai_services.transport import HTTPTransport
+from benchmarks.mock_provider import MockProvider, start_in_thread
+
+PAYLOAD = {
+    'model': 'deepseek-chat',
+    'messages': [{'role': 'user', 'content': '你好'}]
+}
+HEADERS = {'Authorization': 'Bearer mock', 'Content-Type': 'application/json'}
+
+def _report(name, total, elapsed, errors):
+    print(f"{name:<22} {total:>6} req  {elapsed:>7.2f}s  {total / elapsed:>9.1f} req/s  errors={errors}")
+
+def bench_bare_requests(url, total, concurrency):
+    """每次调用都新建连接（原实现）"""
+    errors = 0
+
+    def call(_):
+        return requests.post(url, headers=HEADERS, json=PAYLOAD, timeout=30).status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for status in pool.map(call, range(total)):
+            errors += status != 200
+    _report('bare requests.post', total, time.perf_counter() - start, errors)
+
+def bench_pooled(url, total, concurrency):
+    """共享的连接池化Session"""
+    transport = HTTPTransport(pool_maxsize=concurrency)
+    errors = 0
+
+    def call(_):
+        return transport.post(url, headers=HEADERS, json=PAYLOAD).status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for status in pool.map(call, range(total)):
+            errors += status != 200
+    _report('pooled HTTPTransport', total, time.perf_counter() - start, errors)
+    transport.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='AI服务传输层吞吐量压测')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency-ms', type=int, default=100)
+    parser.add_argument('--port', type=int, default=8099)
+    args = parser.parse_args()
+
+    provider = MockProvider(latency_ms=args.latency_ms)
+    _, stop = start_in_thread(provider, port=args.port)
+    url = f"http://127.0.0.1:{args.port}/chat/completions"
+
+    print(f"mock latency={args.latency_ms}ms concurrency={args.concurrency}")
+    try:
+        bench_bare_requests(url, args.requests, args.concurrency)
+        bench_pooled(url, args.requests, args.concurrency)
+    finally:
+        stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+本地模拟AI服务提供方
+
+模拟 MiniMax / DeepSeek(OpenAI兼容) / Claude 三种接口，支持普通和流式(SSE)
+回复，并可配置首字节延迟和总延迟，用于离线压测传输层吞吐量。
+
+用法:
+    python -m benchmarks.mock_provider --port 8099 --latency-ms 200
+
+然后将服务指向本地:
+    MINIMAX_API_URL=http://127.0.0.1:8099/v1/text/chatcompletion_v2
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8099
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8099/v1
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+
+from aiohttp import web
+
+DEFAULT_REPLY = '这是来自本地模拟服务的回复。'
+
+def _split_chunks(text, chunks):
+    """将回复文本切分为若干块"""
+    size = max(1, len(text) // max(1, chunks))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+class MockProvider:
+    """模拟AI服务提供方"""
+
+    def __init__(self, latency_ms=200, ttfb_ms=50, chunks=8, reply=DEFAULT_REPLY, fail_rate=0.0):
+        self.latency = latency_ms / 1000.0
+        self.ttfb = min(ttfb_ms, latency_ms) / 1000.0
+        self.chunks = chunks
+        self.reply = reply
+        self.fail_rate = fail_rate
+        self.requests_served = 0
+        self._failures = 0
+
+    def _should_fail(self):
+        """按照失败率确定性地返回错误"""
+        if self.fail_rate <= 0:
+            return False
+        self._failures += self.fail_rate
+        if self._failures >= 1:
+            self._failures -= 1
+            return True
+        return False
+
+    async def _stream(self, request, make_event, done_event=None):
+        """以SSE格式逐块返回回复"""
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        await asyncio.sleep(self.ttfb)
+        parts = _split_chunks(self.reply, self.chunks)
+        gap = (self.latency - self.ttfb) / max(1, len(parts))
+        for index, part in enumerate(parts):
+            if index:
+                await asyncio.sleep(gap)
+            await response.write(f"data: {json.dumps(make_event(part), ensure_ascii=False)}\n\n".encode('utf-8'))
+        await response.write(f"data: {done_event or '[DONE]'}\n\n".encode('utf-8'))
+        await response.write_eof()
+        return response
+
+    async def openai_chat(self, request):
+        """MiniMax / DeepSeek 的OpenAI兼容接口"""
+        self.requests_served += 1
+        body = await request.json()
+        if self._should_fail():
+            await asyncio.sleep(self.ttfb)
+            return web.json_response({'error': 'mock failure'}, status=503)
+        if body.get('stream'):
+            return await self._stream(
+                request,
+                lambda part: {'choices': [{'index': 0, 'delta': {'content': part}}]}
+            )
+        await asyncio.sleep(self.latency)
+        return web.json_response({
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': self.reply}}]
+        })
+
+    async def claude_messages(self, request):
+        """Claude Messages接口"""
+        self.requests_served += 1
+        body = await request.json()
+        if self._should_fail():
+            await asyncio.sleep(self.ttfb)
+            return web.json_response({'error': 'mock failure'}, status=503)
+        if body.get('stream'):
+            return await self._stream(
+                request,
+                lambda part: {'type': 'content_block_delta', 'index': 0,
+                              'delta': {'type': 'text_delta', 'text': part}},
+                done_event=json.dumps({'type': 'message_stop'})
+            )
+        await asyncio.sleep(self.latency)
+        return web.json_response({
+            'content': [{'type': 'text', 'text': self.reply}]
+        })
+
+    async def models(self, request):
+        """DeepSeek连接测试接口"""
+        return web.json_response({'data': [{'id': 'deepseek-chat'}]})
+
+    def make_app(self):
+        """创建aiohttp应用"""
+        app = web.Application()
+        app.router.add_post('/v1/text/chatcompletion_v2', self.openai_chat)
+        app.router.add_post('/chat/completions', self.openai_chat)
+        app.router.add_post('/v1/chat/completions', self.openai_chat)
+        app.router.add_post('/v1/messages', self.claude_messages)
+        app.router.add_get('/v1/models', self.models)
+        return app
+
+def start_in_thread(provider, host='127.0.0.1', port=8099):
+    """在后台线程中启动模拟服务，返回 (线程, 停止函数)"""
+    ready = threading.Event()
+    loop = asyncio.new_event_loop()
+    state = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(provider.make_app(), access_log=None)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, host, port, backlog=4096)
+        loop.run_until_complete(site.start())
+        state['runner'] = runner
+        ready.set()
+        loop.run_forever()
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+
+    def stop():
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+
+    return thread, stop
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟AI服务提供方')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=int, default=200, help='完整回复的总延迟')
+    parser.add_argument('--ttfb-ms', type=int, default=50, help='流式回复的首字节延迟')
+    parser.add_argument('--chunks', type=int, default=8, help='流式回复的分块数')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='返回503的请求比例')
+    args = parser.parse_args()
+
+    provider = MockProvider(
+        latency_ms=args.latency_ms,
+        ttfb_ms=args.ttfb_ms,
+        chunks=args.chunks,
+        fail_rate=args.fail_rate
+    )
+    print(f"Mock AI provider listening on http://{args.host}:{args.port}")
+    web.run_app(provider.make_app(), host=args.host, port=args.port, access_log=None)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+路由策略回放打分 - 用录制的流量比较不同路由策略的延迟、错误率和成本
+
+录制: 设置 AI_ROUTING_RECORD=traffic.jsonl 运行服务，UnifiedAIService 会把每轮请求的
+路由上下文和各模型调用结果（latency_ms/ok/tokens）追加到该文件。
+
+回放: 对每个策略文件，按录制顺序把请求交给 RoutingEngine 重新选择模型；
+选中的模型若在录制中被调用过，直接使用录制结果，否则从该服务录制到的全部调用中
+有放回地抽样（bootstrap）。一轮请求的延迟取所选模型中最慢的一个（fan-out等待全部完成），
+成本按 providers.cost_per_1k_tokens 计算。
+
+用法:
+    python -m benchmarks.replay_routing --traffic traffic.jsonl ai_services/routing_policy.json other.json
+    python -m benchmarks.replay_routing --synthetic 5000 ai_services/routing_policy.json other.json
+
+不提供 --traffic 时使用 --synthetic 生成的模拟流量（每个服务一个对数正态延迟分布）。
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_services.routing import RoutingEngine, percentile
+
+# 模拟流量：(中位延迟ms, 对数标准差, 错误率, 平均token数)
+SYNTHETIC_PROVIDERS = {
+    'deepseek': (4000, 0.6, 0.05, 900),
+    'minimax': (2500, 0.4, 0.02, 600),
+    'stepchat': (3000, 0.8, 0.08, 700)
+}
+SENTIMENTS = ['positive', 'negative', 'neutral']
+TOPICS = ['technology', 'entertainment', 'general', 'education']
+COMPLEXITIES = ['simple', 'medium', 'complex']
+
+def synthetic_call(rng, name):
+    median, sigma, error_rate, tokens = SYNTHETIC_PROVIDERS[name]
+    return {
+        'latency_ms': round(rng.lognormvariate(0, sigma) * median, 1),
+        'ok': rng.random() >= error_rate,
+        'tokens': max(1, int(rng.gauss(tokens, tokens * 0.2)))
+    }
+
+def generate_traffic(count, seed):
+    """生成模拟流量，每条记录包含全部服务的调用结果"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield {
+            'context': {
+                'sentiment': rng.choice(SENTIMENTS),
+                'topic': rng.choice(TOPICS),
+                'complexity': rng.choice(COMPLEXITIES)
+            },
+            'calls': {name: synthetic_call(rng, name) for name in SYNTHETIC_PROVIDERS}
+        }
+
+def load_traffic(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def score(policy_path, records, seed):
+    """回放一个策略，返回统计结果"""
+    with open(policy_path, 'r', encoding='utf-8') as f:
+        policy = json.load(f)
+    rng = random.Random(seed)
+    engine = RoutingEngine(policy=policy, rng=random.Random(seed))
+
+    # 每个服务录制到的全部调用，用于补全未被录制选中的模型
+    pool = defaultdict(list)
+    for record in records:
+        for name, call in record['calls'].items():
+            pool[name].append(call)
+    available = sorted(pool)
+
+    slo_ms = (policy.get('slo') or {}).get('p95_ms')
+    prices = {name: (conf or {}).get('cost_per_1k_tokens', 0)
+              for name, conf in (policy.get('providers') or {}).items()}
+    latencies, errors, costs, within_slo = [], 0, [], 0
+    usage = defaultdict(int)
+
+    for record in records:
+        selected = engine.select(record['context'], available)
+        request_latency, request_cost, failed = 0.0, 0.0, 0
+        for name in selected:
+            usage[name] += 1
+            call = record['calls'].get(name) or rng.choice(pool[name])
+            engine.record(name, call['latency_ms'] / 1000.0, call['ok'], call.get('tokens', 0))
+            request_latency = max(request_latency, call['latency_ms'])
+            request_cost += prices.get(name, 0) * call.get('tokens', 0) / 1000.0
+            if not call['ok']:
+                failed += 1
+        # 所有模型都失败时用户只能拿到备用回复
+        if failed == len(selected):
+            errors += 1
+        latencies.append(request_latency)
+        costs.append(request_cost)
+        if slo_ms is None or request_latency <= slo_ms:
+            within_slo += 1
+
+    latencies.sort()
+    total = len(records)
+    return {
+        'policy': policy.get('name', os.path.basename(policy_path)),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'error_rate': errors / total,
+        'avg_cost': sum(costs) / total,
+        'slo_attainment': within_slo / total,
+        'models_per_request': sum(usage.values()) / total,
+        'usage': dict(usage)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='路由策略回放打分')
+    parser.add_argument('policies', nargs='+', help='策略JSON文件')
+    parser.add_argument('--traffic', help='AI_ROUTING_RECORD录制的JSONL文件')
+    parser.add_argument('--synthetic', type=int, default=5000, help='没有录制文件时生成的请求数')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.traffic:
+        records = load_traffic(args.traffic)
+        source = args.traffic
+    else:
+        records = list(generate_traffic(args.synthetic, args.seed))
+        source = f'synthetic x{args.synthetic}'
+    if not records:
+        print('没有可回放的流量')
+        return
+    print(f'流量: {source}, {len(records)} 个请求')
+
+    print(f"{'policy':<16}{'p50(ms)':>10}{'p95(ms)':>10}{'errors':>9}{'cost':>10}{'SLO':>8}{'models':>8}  usage")
+    for path in args.policies:
+        result = score(path, records, args.seed)
+        print(f"{result['policy']:<16}{result['p50_ms']:>10.0f}{result['p95_ms']:>10.0f}"
+              f"{result['error_rate']:>9.2%}{result['avg_cost']:>10.5f}{result['slo_attainment']:>8.1%}"
+              f"{result['models_per_request']:>8.2f}  {result['usage']}")
+
+if __name__ == '__main__':
+    main()
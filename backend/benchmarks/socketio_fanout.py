@@ -0,0 +1,226 @@
+"""
+Socket.IO多worker推送负载测试 - 验证emit能到达连接在其他worker上的客户端
+
+在本机启动 --workers 个单worker的gunicorn进程（与start_all.sh相同的部署方式），
+把 --clients 个监听连接轮流分配到各worker，全部以同一个用户登录并加入同一个会话房间，然后：
+- 房间推送：每轮在每个worker上各连接一个探测客户端，加入再离开会话，
+  每个监听连接应收到每个探测的 user_joined 和 user_left，其中大部分来自其他worker
+- 聊天推送（--chat N）：轮流向各worker发送N个异步聊天请求，每个监听连接应收到N个
+  chat_job_done（用户房间）和2N个 new_message（会话房间）
+
+未配置消息队列时，只有与事件同一worker上的连接能收到，结果中会显示缺失的跨worker推送。
+
+用法（需要本机Redis；数据库和AI服务使用config.env中的配置，--chat会调用AI服务，
+建议在模拟模式下运行）:
+    python -m benchmarks.socketio_fanout --workers 4 --clients 100 --rounds 5 \\
+        --message-queue redis://localhost:6379/0
+    python -m benchmarks.socketio_fanout --workers 4 --clients 100 --chat 20 \\
+        --message-queue redis://localhost:6379/0
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import requests
+import socketio
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EVENTS = ('user_joined', 'user_left', 'chat_job_done', 'new_message')
+
+class Listener:
+    """一个监听连接，记录收到的事件数和 chat_job_done 的端到端延迟"""
+
+    def __init__(self, worker: int, url: str, token: str, sent_at: dict):
+        self.worker = worker
+        self.url = url
+        self.token = token
+        self.counts = Counter()
+        self.latencies = []
+        # 任务ID -> 发出请求的时间，所有监听连接共享
+        self.sent_at = sent_at
+        self._lock = threading.Lock()
+        self.sio = socketio.Client(reconnection=False)
+        for name in EVENTS:
+            self.sio.on(name, self._handler(name))
+
+    def _handler(self, name):
+        def handle(data):
+            received = time.perf_counter()
+            with self._lock:
+                self.counts[name] += 1
+                if name == 'chat_job_done' and data.get('job_id') in self.sent_at:
+                    self.latencies.append(received - self.sent_at[data['job_id']])
+        return handle
+
+    def connect(self):
+        self.sio.connect(self.url, auth={'token': self.token}, transports=['polling'], wait_timeout=10)
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.latencies = []
+
+    def count(self, name: str) -> int:
+        with self._lock:
+            return self.counts[name]
+
+def start_workers(count: int, base_port: int, message_queue: str):
+    env = dict(os.environ)
+    if message_queue:
+        env['SOCKETIO_MESSAGE_QUEUE'] = message_queue
+    # 测试中所有请求来自同一个用户，放宽限流和每用户排队上限
+    env.update({
+        'RATE_LIMIT_API_RATE': '100000', 'RATE_LIMIT_API_BURST': '100000',
+        'RATE_LIMIT_CHAT_RATE': '100000', 'RATE_LIMIT_CHAT_BURST': '100000',
+        'CHAT_MAX_QUEUE_PER_USER': '100000', 'CHAT_MAX_RUNNING_PER_USER': '64'
+    })
+    subprocess.run([sys.executable, '-c', 'import app; app.init_database()'], cwd=BACKEND_DIR, env=env,
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    processes = []
+    for i in range(count):
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-w', '1', '-k', 'eventlet',
+             '-b', f'127.0.0.1:{base_port + i}', 'app:app'],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ))
+    urls = [f'http://127.0.0.1:{base_port + i}' for i in range(count)]
+    deadline = time.monotonic() + 60
+    for url in urls:
+        while True:
+            try:
+                if requests.get(f'{url}/api/health', timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'worker {url} 启动超时')
+            time.sleep(0.2)
+    return processes, urls
+
+def wait_for(listeners, expected, timeout):
+    """等待每个监听连接收到期望的事件数，返回是否全部到达"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(listener.count(name) >= n for listener in listeners for name, n in expected.items()):
+            return True
+        time.sleep(0.05)
+    return False
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+def report(title, listeners, expected, workers, elapsed):
+    print(f'\n{title}（{elapsed:.2f}s）')
+    missing_by_worker = Counter()
+    for listener in listeners:
+        for name, n in expected.items():
+            missing_by_worker[listener.worker] += max(0, n - listener.count(name))
+    total = sum(expected.values()) * len(listeners)
+    missing = sum(missing_by_worker.values())
+    print(f'  推送 {total - missing}/{total} 条到达，{(total - missing) / elapsed:.0f} 条/秒')
+    for worker in range(workers):
+        if missing_by_worker[worker]:
+            print(f'  worker {worker} 上的连接缺少 {missing_by_worker[worker]} 条')
+    latencies = [value for listener in listeners for value in listener.latencies]
+    if latencies:
+        print(f'  请求到收到chat_job_done p50 {percentile(latencies, 0.5) * 1000:.1f}ms  '
+              f'p95 {percentile(latencies, 0.95) * 1000:.1f}ms  p99 {percentile(latencies, 0.99) * 1000:.1f}ms')
+    return missing == 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Socket.IO多worker推送负载测试')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--base-port', type=int, default=5100)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--chat', type=int, default=0, help='异步聊天请求数')
+    parser.add_argument('--message-queue', default=os.getenv('SOCKETIO_MESSAGE_QUEUE', ''))
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    processes, urls = start_workers(args.workers, args.base_port, args.message_queue)
+    listeners = []
+    try:
+        name = f'fanout_{uuid.uuid4().hex[:8]}'
+        auth = requests.post(f'{urls[0]}/api/auth/register', json={
+            'username': name, 'email': f'{name}@example.com', 'password': 'fanout-test'
+        }).json()
+        token = auth['token']
+        headers = {'Authorization': f'Bearer {token}'}
+        session_id = requests.post(f'{urls[0]}/api/session/create', json={}, headers=headers).json()['session_id']
+
+        sent_at = {}
+        listeners = [Listener(i % args.workers, urls[i % args.workers], token, sent_at)
+                     for i in range(args.clients)]
+        for listener in listeners:
+            listener.connect()
+            listener.sio.emit('join_session', {'session_id': session_id})
+        print(f'{args.workers} 个worker，{len(listeners)} 个监听连接，消息队列: {args.message_queue or "无"}')
+
+        def probe(url):
+            client = socketio.Client(reconnection=False)
+            client.connect(url, auth={'token': token}, transports=['polling'], wait_timeout=10)
+            client.emit('join_session', {'session_id': session_id})
+            client.emit('leave_session', {'session_id': session_id})
+            time.sleep(0.5)
+            client.disconnect()
+
+        # 预热：同一worker上的探测到达所有本worker的连接，说明各连接都已加入房间
+        probe(urls[0])
+        wait_for([l for l in listeners if l.worker == 0], {'user_joined': 1}, args.timeout)
+        time.sleep(0.5)
+
+        ok = True
+        for listener in listeners:
+            listener.reset()
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            threads = [threading.Thread(target=probe, args=(url,)) for url in urls]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        expected = {'user_joined': args.rounds * args.workers, 'user_left': args.rounds * args.workers}
+        wait_for(listeners, expected, args.timeout)
+        ok &= report('房间推送', listeners, expected, args.workers, time.perf_counter() - started)
+
+        if args.chat:
+            for listener in listeners:
+                listener.reset()
+            started = time.perf_counter()
+            for i in range(args.chat):
+                posted = time.perf_counter()
+                response = requests.post(f'{urls[i % args.workers]}/api/chat', headers=headers, json={
+                    'message': f'负载测试消息 {i} {uuid.uuid4().hex[:6]}', 'session_id': session_id, 'async': True
+                })
+                if response.status_code == 202:
+                    sent_at[response.json()['job_id']] = posted
+                else:
+                    print(f'  请求 {i} 返回 {response.status_code}: {response.text[:200]}')
+            expected = {'chat_job_done': args.chat, 'new_message': args.chat * 2}
+            wait_for(listeners, expected, args.timeout)
+            ok &= report('聊天推送', listeners, expected, args.workers, time.perf_counter() - started)
+    finally:
+        for listener in listeners:
+            try:
+                listener.sio.disconnect()
+            except Exception:
+                pass
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ import uuid
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app import app, db, User, ChatSession, ChatMessage
+import migrations
 
 def fix_database():
     """修复数据库表结构和数据"""
@@ -38,20 +39,16 @@ def fix_database():
                 print("🔄 重新创建chat_sessions表...")
                 db.create_all()
             
-            # 2.1 检查并修复chat_sessions表的title字段
-            print("\n🔍 检查chat_sessions表的title字段...")
+            # 2.1 执行数据库迁移（title字段、查询索引等）
+            print("\n🔍 执行数据库迁移...")
             try:
-                # 检查title字段是否存在
-                result = db.session.execute("SELECT column_name FROM information_schema.columns WHERE table_name='chat_sessions' AND column_name='title'").fetchone()
-                if not result:
-                    print("⚠️  chat_sessions表缺少title字段，正在添加...")
-                    db.session.execute("ALTER TABLE chat_sessions ADD COLUMN title TEXT DEFAULT '';")
-                    db.session.commit()
-                    print("✅ 已添加title字段")
+                executed = migrations.upgrade(db.engine)
+                if executed:
+                    print(f"✅ 已执行迁移: {', '.join(executed)}")
                 else:
-                    print("✅ chat_sessions表已包含title字段")
+                    print("✅ 数据库结构已是最新")
             except Exception as e:
-                print(f"❌ 检查/添加title字段失败: {e}")
+                print(f"❌ 数据库迁移失败: {e}")
             
             # 3. 检查并修复chat_messages表
             print("\n🔍 检查chat_messages表...")
@@ -59,7 +56,7 @@ def fix_database():
                 # 检查表是否存在
                 result = db.session.execute("SELECT COUNT(*) FROM chat_messages").scalar()
                 print(f"✅ chat_messages表存在，当前记录数: {result}")
-    except Exception as e:
+            except Exception as e:
                 print(f"❌ chat_messages表不存在或有问题: {e}")
                 print("🔄 重新创建chat_messages表...")
                 db.create_all()
@@ -153,10 +150,10 @@ def fix_database():
             except Exception as e:
                 print(f"❌ 统计信息获取失败: {e}")
         
-    except Exception as e:
+        except Exception as e:
             print(f"❌ 数据库修复失败: {e}")
             traceback.print_exc()
-        return False
+            return False
     
     return True
 
@@ -218,7 +215,7 @@ def create_test_data():
             print("✅ 测试数据创建完成")
             return test_user.id
         
-    except Exception as e:
+        except Exception as e:
             print(f"❌ 测试数据创建失败: {e}")
             db.session.rollback()
             return None
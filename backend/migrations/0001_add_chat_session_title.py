@@ -0,0 +1,15 @@
+"""
+chat_sessions 表增加 title 字段（原fix_database.py中的ALTER语句）
+"""
+
+from sqlalchemy import text
+
+from migrations import has_column
+
+def upgrade(conn):
+    if not has_column(conn, 'chat_sessions', 'title'):
+        conn.execute(text("ALTER TABLE chat_sessions ADD COLUMN title TEXT DEFAULT ''"))
+
+def downgrade(conn):
+    if has_column(conn, 'chat_sessions', 'title'):
+        conn.execute(text("ALTER TABLE chat_sessions DROP COLUMN title"))
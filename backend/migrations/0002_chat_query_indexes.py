@@ -0,0 +1,43 @@
+"""
+为聊天热点查询增加复合索引
+
+- chat_messages(session_id, timestamp): 会话历史，按时间排序
+- chat_messages(user_id, timestamp): 用户聊天记录，按时间倒序
+- chat_sessions(user_id, updated_at): 用户会话列表，按更新时间倒序
+
+PostgreSQL上使用 CREATE INDEX CONCURRENTLY，建索引期间不阻塞写入，
+因此本迁移不在事务中执行。
+"""
+
+from sqlalchemy import text
+
+from migrations import has_index
+
+TRANSACTIONAL = False
+
+INDEXES = [
+    ('ix_chat_messages_session_id_timestamp', 'chat_messages', ('session_id', 'timestamp')),
+    ('ix_chat_messages_user_id_timestamp', 'chat_messages', ('user_id', 'timestamp')),
+    ('ix_chat_sessions_user_id_updated_at', 'chat_sessions', ('user_id', 'updated_at')),
+]
+
+def upgrade(conn):
+    postgres = conn.dialect.name == 'postgresql'
+    for name, table, columns in INDEXES:
+        if postgres:
+            conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+            ))
+        elif not has_index(conn, table, name):
+            conn.execute(text(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"))
+
+def downgrade(conn):
+    postgres = conn.dialect.name == 'postgresql'
+    for name, table, _ in INDEXES:
+        if postgres:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        elif has_index(conn, table, name):
+            if conn.dialect.name == 'mysql':
+                conn.execute(text(f"DROP INDEX {name} ON {table}"))
+            else:
+                conn.execute(text(f"DROP INDEX {name}"))
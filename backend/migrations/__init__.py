@@ -0,0 +1,133 @@
+"""
+数据库迁移
+
+替代fix_database.py中临时的ALTER语句。每个迁移是本目录下一个形如
+``0001_描述.py`` 的模块，提供 ``upgrade(conn)``（可选 ``downgrade(conn)``）。
+已执行的版本记录在 schema_migrations 表中，每个迁移只执行一次。
+
+迁移模块可以声明 ``TRANSACTIONAL = False``，此时在AUTOCOMMIT模式下执行，
+用于PostgreSQL的 CREATE INDEX CONCURRENTLY 等不能放在事务中的语句。
+
+用法:
+    python -m migrations status
+    python -m migrations upgrade [目标版本]
+    python -m migrations downgrade <目标版本>
+"""
+
+import os
+import re
+import logging
+import importlib
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_TABLE = 'schema_migrations'
+_MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+_metadata = MetaData()
+schema_migrations = Table(
+    MIGRATIONS_TABLE, _metadata,
+    Column('version', String(16), primary_key=True),
+    Column('name', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+class Migration(NamedTuple):
+    version: str
+    name: str
+    module: object
+
+    @property
+    def transactional(self) -> bool:
+        return getattr(self.module, 'TRANSACTIONAL', True)
+
+def discover() -> List[Migration]:
+    """按版本号顺序返回所有迁移"""
+    migrations = []
+    for filename in sorted(os.listdir(os.path.dirname(os.path.abspath(__file__)))):
+        match = _MIGRATION_FILE.match(filename)
+        if not match:
+            continue
+        module = importlib.import_module(f"{__name__}.{filename[:-3]}")
+        migrations.append(Migration(match.group(1), match.group(2), module))
+    return migrations
+
+def applied_versions(engine) -> List[str]:
+    """返回已执行的迁移版本"""
+    with engine.begin() as conn:
+        schema_migrations.create(conn, checkfirst=True)
+        rows = conn.execute(select(schema_migrations.c.version).order_by(schema_migrations.c.version))
+        return [row[0] for row in rows]
+
+def _run(engine, migration: Migration, direction: str):
+    """在事务（或AUTOCOMMIT）中执行单个迁移并更新版本记录"""
+    step = getattr(migration.module, direction, None)
+    if step is None:
+        raise RuntimeError(f"迁移 {migration.version}_{migration.name} 不支持 {direction}")
+
+    if migration.transactional:
+        with engine.begin() as conn:
+            step(conn)
+            _record(conn, migration, direction)
+    else:
+        with engine.connect() as conn:
+            step(conn.execution_options(isolation_level='AUTOCOMMIT'))
+        with engine.begin() as conn:
+            _record(conn, migration, direction)
+
+def _record(conn, migration: Migration, direction: str):
+    if direction == 'upgrade':
+        conn.execute(schema_migrations.insert().values(
+            version=migration.version,
+            name=migration.name,
+            applied_at=datetime.utcnow()
+        ))
+    else:
+        conn.execute(schema_migrations.delete().where(schema_migrations.c.version == migration.version))
+
+def upgrade(engine, target: Optional[str] = None) -> List[str]:
+    """执行所有未执行的迁移（直到target版本），返回本次执行的版本"""
+    done = set(applied_versions(engine))
+    executed = []
+    for migration in discover():
+        if target is not None and migration.version > target:
+            break
+        if migration.version in done:
+            continue
+        logger.info(f"执行迁移 {migration.version}_{migration.name}")
+        _run(engine, migration, 'upgrade')
+        executed.append(migration.version)
+    return executed
+
+def downgrade(engine, target: str) -> List[str]:
+    """回滚版本号大于target的迁移，返回本次回滚的版本"""
+    done = set(applied_versions(engine))
+    reverted = []
+    for migration in reversed(discover()):
+        if migration.version <= target or migration.version not in done:
+            continue
+        logger.info(f"回滚迁移 {migration.version}_{migration.name}")
+        _run(engine, migration, 'downgrade')
+        reverted.append(migration.version)
+    return reverted
+
+def status(engine) -> List[dict]:
+    """返回所有迁移及其执行状态"""
+    done = set(applied_versions(engine))
+    return [{
+        'version': migration.version,
+        'name': migration.name,
+        'applied': migration.version in done
+    } for migration in discover()]
+
+def has_column(conn, table: str, column: str) -> bool:
+    """检查表中是否存在某列"""
+    return any(col['name'] == column for col in inspect(conn).get_columns(table))
+
+def has_index(conn, table: str, index: str) -> bool:
+    """检查表上是否存在某索引"""
+    return any(idx['name'] == index for idx in inspect(conn).get_indexes(table))
@@ -0,0 +1,37 @@
+"""
+迁移命令行入口: python -m migrations [status|upgrade|downgrade] [版本]
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from migrations import downgrade, status, upgrade
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    target = sys.argv[2] if len(sys.argv) > 2 else None
+
+    with app.app_context():
+        engine = db.engine
+        if command == 'status':
+            for item in status(engine):
+                mark = 'x' if item['applied'] else ' '
+                print(f"[{mark}] {item['version']} {item['name']}")
+        elif command == 'upgrade':
+            executed = upgrade(engine, target)
+            print(f"已执行迁移: {', '.join(executed) if executed else '无'}")
+        elif command == 'downgrade':
+            if target is None:
+                print("downgrade 需要指定目标版本，例如: python -m migrations downgrade 0001")
+                sys.exit(1)
+            reverted = downgrade(engine, target)
+            print(f"已回滚迁移: {', '.join(reverted) if reverted else '无'}")
+        else:
+            print(f"未知命令: {command}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+"""
+后端单元测试，在backend目录下运行:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+# 与运行app.py时一样，以backend为导入根目录（from utils.x import ...）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,121 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text,
+                        bindparam, create_engine, event, select)
+from sqlalchemy.exc import OperationalError
+
+from utils.persistence import MessageWriter, _Record
+
+metadata = MetaData()
+sessions = Table(
+    'chat_sessions', metadata,
+    Column('id', String(36), primary_key=True),
+    Column('updated_at', DateTime)
+)
+messages_table = Table(
+    'chat_messages', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, nullable=False),
+    Column('session_id', String(36), ForeignKey('chat_sessions.id'), nullable=False),
+    Column('message_type', String(20), nullable=False),
+    Column('content', Text, nullable=False),
+    Column('ai_models_used', Text),
+    Column('timestamp', DateTime)
+)
+
+@pytest.fixture
+def engine(tmp_path):
+    # 写线程和测试线程使用不同连接，用文件数据库
+    engine = create_engine(f"sqlite:///{tmp_path / 'chat.db'}")
+
+    @event.listens_for(engine, 'connect')
+    def enable_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(sessions.insert(), [{'id': 's1', 'updated_at': None}, {'id': 's2', 'updated_at': None}])
+    return engine
+
+def make_flush(engine, calls=None):
+    """与app.py中flush_chat_messages相同：一个事务内多行INSERT + 批量更新会话时间"""
+    def flush(messages, touches):
+        if calls is not None:
+            calls.append(len(messages))
+        with engine.begin() as conn:
+            if messages:
+                conn.execute(messages_table.insert().values(messages))
+            if touches:
+                conn.execute(
+                    sessions.update().where(sessions.c.id == bindparam('b_id'))
+                    .values(updated_at=bindparam('b_updated_at')),
+                    [{'b_id': s, 'b_updated_at': t} for s, t in touches.items()]
+                )
+    return flush
+
+def stored(engine):
+    with engine.connect() as conn:
+        return sorted((row.session_id, row.content) for row in conn.execute(select(messages_table)))
+
+def message(session_id, content):
+    return {'user_id': 1, 'session_id': session_id, 'message_type': 'user', 'content': content,
+            'ai_models_used': None, 'timestamp': datetime.utcnow()}
+
+def test_orphan_row_is_dropped_and_rest_of_batch_persists(engine):
+    calls = []
+    writer = MessageWriter(make_flush(engine, calls))
+    now = datetime.utcnow()
+    # 同一批次中有一条消息属于已删除的会话，多行INSERT因外键失败
+    writer._write_batch([
+        _record([message('s1', 'a'), message('s1', 'b')], {'s1': now}),
+        _record([message('deleted', 'orphan')], {'deleted': now}),
+        _record([message('s2', 'c'), message('s2', 'd'), message('s1', 'e')], {'s2': now, 's1': now})
+    ])
+
+    assert stored(engine) == [('s1', 'a'), ('s1', 'b'), ('s1', 'e'), ('s2', 'c'), ('s2', 'd')]
+    assert writer.written == 5
+    assert writer.failed == 1
+    # 完整性错误不重试整批，而是二分定位：6 -> 3+3 -> (1+2) ...
+    assert calls[0] == 6 and calls.count(6) == 1
+    with engine.connect() as conn:
+        assert all(row.updated_at == now for row in conn.execute(select(sessions)))
+
+def test_sync_waiter_only_sees_its_own_dropped_row(engine):
+    writer = MessageWriter(make_flush(engine), durability='sync', sync_timeout=5)
+    writer.start()
+    writer.submit([message('s1', 'ok')])
+    with pytest.raises(Exception):
+        writer.submit([message('deleted', 'orphan')])
+    writer.close()
+    assert stored(engine) == [('s1', 'ok')]
+
+def test_transient_errors_are_retried(engine):
+    flush = make_flush(engine)
+    attempts = []
+
+    def flaky(messages, touches):
+        attempts.append(len(messages))
+        if len(attempts) == 1:
+            raise OperationalError('INSERT', {}, Exception('connection reset'))
+        flush(messages, touches)
+
+    writer = MessageWriter(flaky)
+    writer._write_batch([_record([message('s1', 'a'), message('s2', 'b')])])
+    assert attempts == [2, 2]
+    assert stored(engine) == [('s1', 'a'), ('s2', 'b')]
+
+def test_other_errors_are_not_retried(engine):
+    attempts = []
+
+    def broken(messages, touches):
+        attempts.append(len(messages))
+        raise ValueError('bad flush function')
+
+    writer = MessageWriter(broken)
+    writer._write_batch([_record([message('s1', 'a')])])
+    assert attempts == [1]
+    assert writer.failed == 1
+
+def _record(messages, touches=None):
+    return _Record(messages, touches or {}, None)
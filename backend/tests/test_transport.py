@@ -0,0 +1,47 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from urllib3.exceptions import EmptyPoolError
+
+from ai_services.transport import HTTPTransport
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/chat"
+    server.shutdown()
+    server.server_close()
+
+def test_exhausted_pool_fails_after_pool_timeout(server_url):
+    transport = HTTPTransport(pool_maxsize=1, pool_timeout=0.2)
+    # 流式响应未读完前一直占用唯一的连接
+    held = transport.post(server_url, json={}, stream=True)
+    try:
+        started = time.monotonic()
+        with pytest.raises(EmptyPoolError):
+            transport.post(server_url, json={})
+        assert time.monotonic() - started < 2
+    finally:
+        held.close()
+    # 连接归还后可以继续使用
+    assert transport.post(server_url, json={}).json() == {'ok': True}
+    transport.close()
@@ -1,23 +1,25 @@
-"""
-Utils package for AI Chat Backend
-
-This package contains utility modules for authentication, configuration,
-middleware, and event handling.
-"""
-
-from . import auth
-from . import config
-from . import middleware
-from . import event_handlers
-from . import decorators
-
-__all__ = [
-    'auth',
-    'config', 
-    'middleware',
-    'event_handlers',
-    'decorators'
-]
-
-__version__ = '1.0.0'
+"""
+Utils package for AI Chat Backend
+
+This package contains utility modules for authentication, configuration,
+middleware, event handling and caching.
+"""
+
+from . import auth
+from . import config
+from . import middleware
+from . import event_handlers
+from . import decorators
+from . import cache
+
+__all__ = [
+    'auth',
+    'config', 
+    'middleware',
+    'event_handlers',
+    'decorators',
+    'cache'
+]
+
+__version__ = '1.0.0'
 __author__ = 'AI Chat Team' 
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""
+认证缓存
+
+require_auth 每次请求都要验证JWT签名并按主键查询用户。这里缓存两样东西：
+- 已验证的token：sha256(token) -> user_id，有效期不超过token本身的过期时间
+- 用户信息快照(Principal)：user_id -> 用户字段，短TTL，用户变更时显式失效
+"""
+
+import time
+import hashlib
+import logging
+from typing import Any, Dict, Optional
+
+from .cache import BoundedCache
+
+logger = logging.getLogger(__name__)
+
+class Principal:
+    """已认证用户的只读快照，提供与User模型相同的id和to_dict()"""
+
+    __slots__ = ('id', '_data')
+
+    def __init__(self, data: Dict[str, Any]):
+        self.id = data['id']
+        self._data = data
+
+    def __getattr__(self, name):
+        try:
+            return self._data[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._data)
+
+class PrincipalCache:
+    """已验证token和用户信息的短期缓存"""
+
+    def __init__(self, principal_ttl: int = 60, token_ttl: int = 300, max_entries: int = 50000):
+        self.principal_ttl = principal_ttl
+        self.token_ttl = token_ttl
+        self._cache = BoundedCache(max_entries=max_entries, default_ttl=principal_ttl, sweep_interval=60)
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        # 不直接用原始token作为key，避免在内存中保留明文token
+        return 'token:' + hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get_token(self, token: str) -> Optional[Any]:
+        """返回已验证token对应的user_id，未缓存时返回None"""
+        return self._cache.get(self._token_key(token))
+
+    def put_token(self, token: str, user_id: Any, exp: Optional[float] = None):
+        """缓存验证通过的token，缓存时间不超过token过期时间"""
+        ttl = self.token_ttl
+        if exp is not None:
+            ttl = min(ttl, exp - time.time())
+        if ttl > 0:
+            self._cache.set(self._token_key(token), user_id, ttl=ttl)
+
+    def get_principal(self, user_id: Any) -> Optional[Principal]:
+        data = self._cache.get(f'user:{user_id}')
+        return Principal(data) if data is not None else None
+
+    def put_principal(self, user_data: Dict[str, Any]) -> Principal:
+        self._cache.set(f"user:{user_data['id']}", user_data, ttl=self.principal_ttl)
+        return Principal(user_data)
+
+    def invalidate_user(self, user_id: Any):
+        """用户信息变更时使缓存失效"""
+        self._cache.delete(f'user:{user_id}')
+
+    def start_sweeper(self):
+        self._cache.start_sweeper()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
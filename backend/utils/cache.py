@@ -0,0 +1,388 @@
+"""
+缓存模块
+
+BoundedCache 为进程内有界缓存，替代app.py中的SimpleCache：
+- 按条目数和估算字节数双重限制，超出时按LRU淘汰
+- 按key分片，每个分片独立加锁，降低greenlet与线程之间的锁竞争
+- 后台定期清理过期条目，而不是只在再次读取同一key时才过期
+- 统计命中、未命中、淘汰、过期次数，用于监控
+
+TieredCache 在其之上叠加可选的Redis二级缓存（RedisCache），使多个
+后端worker共享缓存结果，并通过get_or_set提供缓存击穿保护。
+"""
+
+import json
+import sys
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+def estimate_size(value: Any) -> int:
+    """估算缓存值占用的字节数"""
+    try:
+        return len(json.dumps(value, default=str, ensure_ascii=False).encode('utf-8'))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+class _Shard:
+    """缓存分片：一个LRU有序字典和一把锁"""
+
+    __slots__ = ('entries', 'lock', 'bytes', 'hits', 'misses', 'evictions', 'expirations')
+
+    def __init__(self):
+        # key -> (value, expire_time, size)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def remove(self, key):
+        """删除条目，调用方需持有锁"""
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+class BoundedCache:
+    """分片的有界LRU缓存，支持TTL和后台过期清理"""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                 shards: int = 16, default_ttl: int = 300, sweep_interval: float = 30):
+        self.shard_count = max(1, shards)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.sweep_interval = sweep_interval
+        # 每个分片平分容量上限
+        self._shard_max_entries = max(1, max_entries // self.shard_count)
+        self._shard_max_bytes = max(1, max_bytes // self.shard_count)
+        self._shards = [_Shard() for _ in range(self.shard_count)]
+        self._sweeper = None
+        self._stop_event = threading.Event()
+
+    def _shard(self, key) -> _Shard:
+        return self._shards[hash(key) % self.shard_count]
+
+    def get(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is None:
+                shard.misses += 1
+                return None
+            value, expire_time, _ = entry
+            if expire_time <= time.time():
+                shard.remove(key)
+                shard.expirations += 1
+                shard.misses += 1
+                return None
+            shard.entries.move_to_end(key)
+            shard.hits += 1
+            return value
+
+    def set(self, key, value, ttl: Optional[int] = None):
+        size = estimate_size(value)
+        if size > self._shard_max_bytes:
+            # 单个值超过分片容量，不缓存
+            logger.debug(f"缓存值过大，跳过: {key} ({size} bytes)")
+            return
+        expire_time = time.time() + (self.default_ttl if ttl is None else ttl)
+        shard = self._shard(key)
+        with shard.lock:
+            if key in shard.entries:
+                shard.remove(key)
+            shard.entries[key] = (value, expire_time, size)
+            shard.bytes += size
+            while (len(shard.entries) > self._shard_max_entries
+                   or shard.bytes > self._shard_max_bytes):
+                oldest = next(iter(shard.entries))
+                shard.remove(oldest)
+                shard.evictions += 1
+
+    def delete(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            if key in shard.entries:
+                shard.remove(key)
+
+    def clear(self):
+        """清空缓存"""
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+                shard.bytes = 0
+
+    def sweep(self) -> int:
+        """清理所有已过期的条目，返回清理数量"""
+        removed = 0
+        now = time.time()
+        for shard in self._shards:
+            with shard.lock:
+                expired = [key for key, (_, expire_time, _) in shard.entries.items() if expire_time <= now]
+                for key in expired:
+                    shard.remove(key)
+                shard.expirations += len(expired)
+                removed += len(expired)
+        return removed
+
+    def start_sweeper(self):
+        """启动后台过期清理线程"""
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop_event.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name='cache-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        """停止后台过期清理线程"""
+        self._stop_event.set()
+
+    def _sweep_loop(self):
+        while not self._stop_event.wait(self.sweep_interval):
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.debug(f"缓存清理过期条目: {removed}")
+            except Exception as e:
+                logger.error(f"缓存清理失败: {e}")
+
+    def __len__(self):
+        return sum(len(shard.entries) for shard in self._shards)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        hits = sum(shard.hits for shard in self._shards)
+        misses = sum(shard.misses for shard in self._shards)
+        lookups = hits + misses
+        return {
+            'entries': len(self),
+            'bytes': sum(shard.bytes for shard in self._shards),
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'evictions': sum(shard.evictions for shard in self._shards),
+            'expirations': sum(shard.expirations for shard in self._shards)
+        }
+
+class RedisCache:
+    """Redis缓存层，值以JSON序列化，Redis异常时降级为未命中"""
+
+    # 只有持有者才能释放锁
+    _RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+    def __init__(self, client, prefix: str = 'aichat:cache:', default_ttl: int = 300):
+        self.client = client
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key) -> str:
+        return f"{self.prefix}{key}"
+
+    def get(self, key):
+        try:
+            raw = self.client.get(self._key(key))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis读取失败: {e}")
+            return None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl: Optional[int] = None):
+        try:
+            self.client.set(
+                self._key(key),
+                json.dumps(value, default=str, ensure_ascii=False),
+                ex=max(1, int(self.default_ttl if ttl is None else ttl))
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis写入失败: {e}")
+
+    def delete(self, key):
+        try:
+            self.client.delete(self._key(key))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis删除失败: {e}")
+
+    def acquire_lock(self, key, timeout: float) -> Optional[str]:
+        """获取跨worker的加载锁，成功时返回锁令牌"""
+        token = uuid.uuid4().hex
+        try:
+            if self.client.set(self._key(f"lock:{key}"), token, nx=True, px=int(timeout * 1000)):
+                return token
+            return None
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis加锁失败: {e}")
+            # Redis不可用时由本进程直接加载
+            return ''
+
+    def release_lock(self, key, token: str):
+        if not token:
+            return
+        try:
+            self.client.eval(self._RELEASE_SCRIPT, 1, self._key(f"lock:{key}"), token)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis解锁失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {'hits': self.hits, 'misses': self.misses, 'errors': self.errors}
+
+class TieredCache:
+    """两级缓存：进程内BoundedCache(L1) + 可选的Redis(L2)
+
+    L1的TTL被限制在l1_ttl以内，使其他worker写入或删除的结果最多在
+    l1_ttl秒后可见。未配置L2时行为等同于单独的BoundedCache。
+    """
+
+    def __init__(self, l1: BoundedCache, l2: Optional[RedisCache] = None, l1_ttl: int = 30):
+        self.l1 = l1
+        self.l2 = l2
+        self.l1_ttl = l1_ttl
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _l1_ttl(self, ttl: Optional[int]) -> int:
+        if self.l2 is None:
+            return self.l1.default_ttl if ttl is None else ttl
+        return min(self.l1_ttl, self.l1.default_ttl if ttl is None else ttl)
+
+    def get(self, key):
+        value = self.l1.get(key)
+        if value is not None or self.l2 is None:
+            return value
+        value = self.l2.get(key)
+        if value is not None:
+            self.l1.set(key, value, ttl=self._l1_ttl(None))
+        return value
+
+    def set(self, key, value, ttl: Optional[int] = None):
+        self.l1.set(key, value, ttl=self._l1_ttl(ttl))
+        if self.l2 is not None:
+            self.l2.set(key, value, ttl=ttl)
+
+    def delete(self, key):
+        self.l1.delete(key)
+        if self.l2 is not None:
+            self.l2.delete(key)
+
+    def get_or_set(self, key, loader: Callable[[], Any], ttl: Optional[int] = None,
+                   lock_timeout: float = 10):
+        """读取缓存，未命中时只由一个调用方执行loader，其余调用方等待其结果"""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        # 进程内：同一key只允许一个线程/greenlet加载
+        with self._local_lock(key):
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            token = ''
+            if self.l2 is not None:
+                # 跨worker：抢不到锁的一方等待持锁者写入L2
+                token = self.l2.acquire_lock(key, lock_timeout)
+                if token is None:
+                    value = self._wait_for_l2(key, lock_timeout)
+                    if value is not None:
+                        return value
+            try:
+                value = loader()
+                if value is not None:
+                    self.set(key, value, ttl=ttl)
+                return value
+            finally:
+                if self.l2 is not None and token:
+                    self.l2.release_lock(key, token)
+
+    def _wait_for_l2(self, key, timeout: float):
+        """轮询等待其他worker加载完成"""
+        deadline = time.time() + timeout
+        delay = 0.01
+        while time.time() < deadline:
+            time.sleep(delay)
+            value = self.get(key)
+            if value is not None:
+                return value
+            delay = min(delay * 2, 0.2)
+        return None
+
+    @contextmanager
+    def _local_lock(self, key):
+        """按key引用计数的进程内锁，用完即释放"""
+        with self._locks_guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def clear(self):
+        """清空本进程的L1缓存"""
+        self.l1.clear()
+
+    def sweep(self) -> int:
+        return self.l1.sweep()
+
+    def start_sweeper(self):
+        self.l1.start_sweeper()
+
+    def stop_sweeper(self):
+        self.l1.stop_sweeper()
+
+    def __len__(self):
+        return len(self.l1)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.l1.stats()
+        stats['l2'] = self.l2.stats() if self.l2 is not None else None
+        return stats
+
+def create_redis_cache(redis_config: Dict[str, Any], default_ttl: int = 300,
+                       client=None) -> Optional[RedisCache]:
+    """根据Redis配置创建L2缓存；未配置REDIS_URL或未安装redis时返回None
+
+    测试时可以通过client参数传入本地Redis替身或fake客户端。
+    """
+    if client is None:
+        url = redis_config.get('url')
+        if not url:
+            return None
+        try:
+            import redis
+        except ImportError:
+            logger.warning("已配置REDIS_URL但未安装redis，仅使用进程内缓存")
+            return None
+        client = redis.Redis.from_url(url, decode_responses=redis_config.get('decode_responses', True))
+    return RedisCache(client, default_ttl=default_ttl)
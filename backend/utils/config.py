@@ -22,6 +22,13 @@ def get_redis_config() -> Dict[str, Any]:
         'decode_responses': True
     }
 
+def get_socketio_config() -> Dict[str, Any]:
+    """获取Socket.IO配置；消息队列默认使用REDIS_URL"""
+    return {
+        'message_queue': os.getenv('SOCKETIO_MESSAGE_QUEUE') or os.getenv('REDIS_URL'),
+        'channel': os.getenv('SOCKETIO_CHANNEL', 'aichat-socketio')
+    }
+
 def get_flask_config() -> Dict[str, Any]:
     """获取Flask配置"""
     return {
@@ -0,0 +1,208 @@
+"""
+聊天任务（异步模式）状态存储
+
+POST /api/chat 带 async=true 时只创建任务并立即返回任务ID，模型调用在调度器中完成后
+把结果写入这里；客户端通过 GET /api/chat/jobs/<id>（可长轮询）取结果，或在Socket.IO
+的用户房间收到 chat_job_done 推送。
+
+任务记录是普通字典：
+    {'id', 'user_id', 'session_id', 'status', 'result', 'error', 'created_at', 'updated_at'}
+status: pending -> running -> done / failed。结束的任务保留 result_ttl 秒。
+
+- InMemoryJobStore: 单进程，结束时通过Condition唤醒长轮询
+- RedisJobStore:    配置REDIS_URL时使用，任务以JSON保存并自动过期，多个worker之间共享，
+                    长轮询按 poll_interval 轮询；Redis异常时降级为进程内存储
+"""
+
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+
+def new_job(user_id, session_id) -> Dict[str, Any]:
+    now = time.time()
+    return {
+        'id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'session_id': session_id,
+        'status': PENDING,
+        'result': None,
+        'error': None,
+        'created_at': now,
+        'updated_at': now
+    }
+
+class InMemoryJobStore:
+    """进程内任务存储，最多保留 max_jobs 个任务"""
+
+    def __init__(self, result_ttl: float = 600, max_jobs: int = 10000):
+        self.result_ttl = result_ttl
+        self.max_jobs = max_jobs
+        # 按创建顺序排列，便于淘汰最早的任务
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._cond = threading.Condition()
+        self.created = 0
+        self.evicted = 0
+
+    def create(self, user_id, session_id) -> Dict[str, Any]:
+        job = new_job(user_id, session_id)
+        with self._cond:
+            self._expire(job['created_at'])
+            self._jobs[job['id']] = job
+            self.created += 1
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+                self.evicted += 1
+        return dict(job)
+
+    def update(self, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+        """更新任务字段；进入结束状态时唤醒等待者"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields, updated_at=time.time())
+            if job['status'] in FINISHED:
+                self._cond.notify_all()
+            return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """等待任务结束，超时返回当前状态"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job['status'] in FINISHED:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return dict(job) if job is not None else None
+
+    def _expire(self, now: float):
+        """删除结束超过result_ttl的任务，调用方需持有锁"""
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['status'] in FINISHED and now - job['updated_at'] >= self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            by_status = {}
+            for job in self._jobs.values():
+                by_status[job['status']] = by_status.get(job['status'], 0) + 1
+            return {
+                'backend': 'memory',
+                'jobs': len(self._jobs),
+                'by_status': by_status,
+                'created': self.created,
+                'evicted': self.evicted
+            }
+
+class RedisJobStore:
+    """Redis任务存储，多个worker共享；Redis异常时使用进程内存储"""
+
+    def __init__(self, client, result_ttl: float = 600, job_ttl: float = 3600,
+                 poll_interval: float = 0.25, prefix: str = 'aichat:job:',
+                 fallback: Optional[InMemoryJobStore] = None):
+        self.client = client
+        self.result_ttl = int(result_ttl)
+        # 未结束的任务也设置过期时间，避免进程崩溃后遗留
+        self.job_ttl = int(job_ttl)
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self.fallback = fallback or InMemoryJobStore(result_ttl)
+        self.created = 0
+        self.errors = 0
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}{job_id}"
+
+    def _save(self, job: Dict[str, Any]):
+        ttl = self.result_ttl if job['status'] in FINISHED else self.job_ttl
+        self.client.set(self._key(job['id']), json.dumps(job, ensure_ascii=False, default=str), ex=ttl)
+
+    def create(self, user_id, session_id) -> Dict[str, Any]:
+        job = new_job(user_id, session_id)
+        try:
+            self._save(job)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis保存任务失败，使用进程内存储: {e}")
+            return self.fallback.create(user_id, session_id)
+        self.created += 1
+        return job
+
+    def update(self, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+        # 同一个任务只由执行它的worker更新，读-改-写即可
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if self.fallback.get(job_id) is not None:
+            return self.fallback.update(job_id, **fields)
+        job.update(fields, updated_at=time.time())
+        try:
+            self._save(job)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis更新任务失败: {e}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = self.client.get(self._key(job_id))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis读取任务失败: {e}")
+            value = None
+        if value is None:
+            return self.fallback.get(job_id)
+        return json.loads(value)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """轮询直到任务结束或超时"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in FINISHED or remaining <= 0:
+                return job
+            time.sleep(min(self.poll_interval, remaining))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': 'redis',
+            'created': self.created,
+            'errors': self.errors,
+            'fallback': self.fallback.stats()
+        }
+
+def create_job_store(redis_config: Optional[Dict[str, Any]] = None, result_ttl: float = 600,
+                     poll_interval: float = 0.25, client=None):
+    """创建任务存储；配置了REDIS_URL且安装了redis时使用Redis，多个worker共享任务状态"""
+    if client is None and redis_config and redis_config.get('url'):
+        try:
+            import redis
+            client = redis.Redis.from_url(redis_config['url'], decode_responses=True)
+        except ImportError:
+            logger.warning("已配置REDIS_URL但未安装redis，使用进程内任务存储")
+    if client is not None:
+        return RedisJobStore(client, result_ttl=result_ttl, poll_interval=poll_interval)
+    return InMemoryJobStore(result_ttl)
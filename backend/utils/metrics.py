@@ -0,0 +1,174 @@
+"""
+Prometheus指标
+
+- http_request_duration_seconds:   按路由模板、方法和状态码统计的请求耗时
+- ai_response_stage_seconds:       get_ai_response 各阶段耗时
+                                   （context/selection/provider/integration/total）
+- ai_provider_latency_seconds / ai_provider_errors_total: 每个AI服务的调用耗时和失败次数
+- executor_backlog:                线程池中排队等待执行的任务数
+- executor_queue_wait_seconds / executor_rejected_total: 聊天调度器中任务的排队时间和拒绝次数
+- db_pool_checked_out:             SQLAlchemy连接池中已借出的连接数
+- cache_entries:                   进程内缓存条目数
+- socketio_connected_clients:      已连接的Socket.IO客户端数
+
+多worker部署时设置 PROMETHEUS_MULTIPROC_DIR（启动前清空的共享目录），各进程把指标写入
+该目录，任意worker的 /metrics 都会汇总所有进程的数据；gauge按存活进程求和（livesum）。
+worker退出时调用 mark_process_dead(pid) 清理其gauge。
+
+未安装 prometheus_client 或 METRICS_ENABLED=false 时所有指标都是空操作，/metrics 返回404。
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client
+    from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge,
+                                   Histogram, generate_latest, multiprocess)
+except ImportError:
+    prometheus_client = None
+
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR') or os.getenv('prometheus_multiproc_dir')
+ENABLED = prometheus_client is not None and os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+
+# 模型调用耗时从百毫秒到数十秒
+AI_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+
+class _NoopMetric:
+    """未启用指标时使用的空实现"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+_NOOP = _NoopMetric()
+
+def _metric(factory, *args, **kwargs):
+    if not ENABLED:
+        return _NOOP
+    return factory(*args, **kwargs)
+
+def _gauge(name, documentation, labelnames=()):
+    # 多进程模式下按存活进程求和
+    return _metric(Gauge, name, documentation, labelnames, multiprocess_mode='livesum')
+
+HTTP_REQUEST_LATENCY = _metric(
+    Histogram, 'http_request_duration_seconds', 'HTTP请求耗时', ('method', 'route', 'status'))
+AI_STAGE_LATENCY = _metric(
+    Histogram, 'ai_response_stage_seconds', 'AI回复各阶段耗时', ('stage',), buckets=AI_BUCKETS)
+AI_PROVIDER_LATENCY = _metric(
+    Histogram, 'ai_provider_latency_seconds', 'AI服务调用耗时', ('provider', 'outcome'), buckets=AI_BUCKETS)
+AI_PROVIDER_ERRORS = _metric(
+    Counter, 'ai_provider_errors_total', 'AI服务调用失败次数', ('provider',))
+EXECUTOR_BACKLOG = _gauge('executor_backlog', '线程池排队任务数', ('executor',))
+EXECUTOR_QUEUE_WAIT = _metric(
+    Histogram, 'executor_queue_wait_seconds', '任务排队等待时间', ('executor',),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+EXECUTOR_REJECTED = _metric(
+    Counter, 'executor_rejected_total', '调度器已满被拒绝的任务数', ('executor', 'reason'))
+DB_POOL_CHECKED_OUT = _gauge('db_pool_checked_out', '已借出的数据库连接数')
+CACHE_ENTRIES = _gauge('cache_entries', '进程内缓存条目数', ('cache',))
+SOCKETIO_CLIENTS = _gauge('socketio_connected_clients', '已连接的Socket.IO客户端数')
+
+def observe_ai_stage(stage: str, seconds: float):
+    AI_STAGE_LATENCY.labels(stage).observe(seconds)
+
+def observe_provider_call(provider: str, seconds: float, ok: bool):
+    AI_PROVIDER_LATENCY.labels(provider, 'ok' if ok else 'error').observe(seconds)
+    if not ok:
+        AI_PROVIDER_ERRORS.labels(provider).inc()
+
+class GaugeSampler:
+    """定期读取线程池积压、缓存大小等只能轮询得到的值并写入gauge
+
+    多进程模式下每个worker各自采样，/metrics 汇总时读取的是各进程最近一次采样的值。
+    """
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self._samplers: Dict[Tuple[int, Tuple[str, ...]], Tuple[object, Tuple[str, ...], Callable[[], float]]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, gauge, fn: Callable[[], float], *labels: str):
+        with self._lock:
+            self._samplers[(id(gauge), labels)] = (gauge, labels, fn)
+
+    def sample(self):
+        with self._lock:
+            samplers = list(self._samplers.values())
+        for gauge, labels, fn in samplers:
+            try:
+                target = gauge.labels(*labels) if labels else gauge
+                target.set(fn())
+            except Exception as e:
+                logger.warning(f"指标采样失败: {e}")
+
+    def start(self):
+        if not ENABLED or self._thread is not None:
+            return
+
+        def run():
+            while True:
+                self.sample()
+                time.sleep(self.interval)
+
+        self._thread = threading.Thread(target=run, name='metrics-sampler', daemon=True)
+        self._thread.start()
+
+sampler = GaugeSampler(float(os.getenv('METRICS_SAMPLE_INTERVAL', 5)))
+
+def register_executor(name: str, executor):
+    """采样线程池（ThreadPoolExecutor或提供qsize()的调度器）中等待执行的任务数"""
+    qsize = getattr(executor, 'qsize', None) or (lambda: executor._work_queue.qsize())
+    sampler.register(EXECUTOR_BACKLOG, qsize, name)
+
+def observe_queue_wait(name: str) -> Callable[[float], None]:
+    """调度器排队时间的回调"""
+    histogram = EXECUTOR_QUEUE_WAIT.labels(name)
+    return histogram.observe
+
+def count_rejection(name: str) -> Callable[[str], None]:
+    """调度器拒绝任务的回调"""
+    return lambda reason: EXECUTOR_REJECTED.labels(name, reason).inc()
+
+def register_cache(name: str, cache):
+    sampler.register(CACHE_ENTRIES, lambda: len(cache), name)
+
+def instrument_engine(engine):
+    """通过连接池事件统计已借出的连接数"""
+    if not ENABLED:
+        return
+    from sqlalchemy import event
+    event.listen(engine, 'checkout', lambda *args: DB_POOL_CHECKED_OUT.inc())
+    event.listen(engine, 'checkin', lambda *args: DB_POOL_CHECKED_OUT.dec())
+
+def render() -> Tuple[bytes, str]:
+    """生成 /metrics 响应内容"""
+    sampler.sample()
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid: int):
+    """worker退出后清理其gauge文件（例如在gunicorn的child_exit钩子中调用）"""
+    if ENABLED and MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,336 @@
+"""
+聊天消息写后持久化（write-behind）
+
+/api/chat 不再在等待AI回复期间持有数据库事务和连接池连接。用户消息、
+AI回复以及会话 updated_at 的更新都放入有界队列，由后台写线程按批次
+合并为多行INSERT和一次批量UPDATE写入数据库。
+
+持久性模式（PERSIST_DURABILITY）:
+- async: 入队即返回，写入在后台完成（默认）
+- sync:  入队后等待所在批次提交成功再返回；多个请求仍共享同一批次提交
+
+队列满时等待enqueue_timeout秒，仍无法入队则在调用线程中直接写入，
+保证消息不会因为背压而丢失。进程退出时会写完队列中剩余的记录。
+
+写入失败时：
+- 连接中断、锁超时等暂时性错误：整批退避重试
+- 完整性/数据错误（如会话已被删除导致外键失败）：重试无用，二分拆分批次重新写入，
+  只丢弃本身无法写入的行并记录日志，同批的其他消息照常保存
+"""
+
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy.exc import DataError, IntegrityError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = ('async', 'sync')
+
+# 个别行本身无法写入，需要拆分批次找出问题行
+ROW_ERRORS = (IntegrityError, DataError)
+# 暂时性错误，整批重试
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+
+# flush_fn(messages, touches): messages为chat_messages行字典列表，
+# touches为 session_id -> updated_at，需要在一个事务中写入
+FlushFunction = Callable[[List[Dict[str, Any]], Dict[str, datetime]], None]
+
+class _Ticket:
+    """等待某一批写入完成的凭据"""
+
+    __slots__ = ('event', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+
+    def done(self, error: Optional[Exception] = None):
+        self.error = error
+        self.event.set()
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        if not self.event.wait(timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+class _Record:
+    __slots__ = ('messages', 'touches', 'ticket')
+
+    def __init__(self, messages, touches, ticket):
+        self.messages = messages
+        self.touches = touches
+        self.ticket = ticket
+
+class MessageWriter:
+    """有界队列 + 后台批量写入线程"""
+
+    def __init__(self, flush_fn: FlushFunction, max_queue: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 0.05, durability: str = 'async',
+                 enqueue_timeout: float = 1.0, sync_timeout: float = 10.0, max_retries: int = 3):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"未知的持久性模式: {durability}")
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.enqueue_timeout = enqueue_timeout
+        self.sync_timeout = sync_timeout
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = Counter()
+        self._pending_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.inline_writes = 0
+
+    def start(self):
+        """启动后台写线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add_turn(self, user_id: Any, session_id: str, user_message: str, ai_response: str,
+                 ai_models_used: str, user_time: Optional[datetime] = None,
+                 wait: Optional[bool] = None):
+        """保存一轮对话（用户消息+AI回复）并更新会话时间"""
+        now = datetime.utcnow()
+        messages = [
+            {
+                'user_id': user_id,
+                'session_id': session_id,
+                'message_type': 'user',
+                'content': user_message,
+                'ai_models_used': None,
+                'timestamp': user_time or now
+            },
+            {
+                'user_id': user_id,
+                'session_id': session_id,
+                'message_type': 'ai',
+                'content': ai_response,
+                'ai_models_used': ai_models_used,
+                'timestamp': now
+            }
+        ]
+        self.submit(messages, {session_id: now}, wait=wait)
+
+    def submit(self, messages: List[Dict[str, Any]], touches: Optional[Dict[str, datetime]] = None,
+               wait: Optional[bool] = None):
+        """提交待写入的消息；wait为None时按durability决定是否等待提交"""
+        touches = touches or {}
+        if wait is None:
+            wait = self.durability == 'sync'
+        ticket = _Ticket() if wait else None
+        record = _Record(messages, touches, ticket)
+
+        if self._closed or self._thread is None:
+            self._write_inline(record)
+            return
+
+        self._track(record, 1)
+        try:
+            self._queue.put(record, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._track(record, -1)
+            logger.warning("消息写入队列已满，改为同步写入")
+            self._write_inline(record)
+            return
+
+        if ticket is not None and not ticket.wait(self.sync_timeout):
+            logger.warning("等待消息写入超时，记录仍在队列中")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待在此之前入队的记录全部写入"""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        ticket = _Ticket()
+        try:
+            self._queue.put(_Record([], {}, ticket), timeout=timeout)
+        except queue.Full:
+            return False
+        try:
+            return ticket.wait(timeout)
+        except Exception:
+            # 写入失败已在写线程中记录，这里只关心是否已处理完
+            return True
+
+    def has_pending(self, session_id: str) -> bool:
+        """该会话是否有尚未写入的记录"""
+        with self._pending_lock:
+            return self._pending.get(session_id, 0) > 0
+
+    def close(self, timeout: float = 10.0):
+        """停止写线程，写完队列中剩余的记录"""
+        if self._closed:
+            return
+        self._closed = True
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error(f"消息写线程未能在{timeout}秒内退出，剩余 {self._queue.qsize()} 条记录")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'durability': self.durability,
+            'queue_size': self._queue.qsize(),
+            'queue_max': self._queue.maxsize,
+            'written': self.written,
+            'batches': self.batches,
+            'failed': self.failed,
+            'inline_writes': self.inline_writes
+        }
+
+    def _track(self, record: _Record, delta: int):
+        sessions = {m['session_id'] for m in record.messages} | set(record.touches)
+        if not sessions:
+            return
+        with self._pending_lock:
+            for session_id in sessions:
+                self._pending[session_id] += delta
+                if self._pending[session_id] <= 0:
+                    del self._pending[session_id]
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if first is None:
+                break
+
+            batch = [first]
+            message_count = len(first.messages)
+            # 攒批：在batch_size以内尽量多取已经在队列中的记录
+            while message_count < self.batch_size:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+                message_count += len(record.messages)
+            self._write_batch(batch)
+
+        # 退出前写完剩余记录
+        remaining = []
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not None:
+                remaining.append(record)
+        for start in range(0, len(remaining), self.batch_size):
+            self._write_batch(remaining[start:start + self.batch_size])
+
+    def _write_batch(self, batch: List[_Record]):
+        messages = []
+        touches = {}
+        for record in batch:
+            messages.extend(record.messages)
+            for session_id, updated_at in record.touches.items():
+                if session_id not in touches or touches[session_id] < updated_at:
+                    touches[session_id] = updated_at
+
+        error = None
+        # id(消息行) -> 导致该行被丢弃的错误
+        dropped = {}
+        if messages or touches:
+            try:
+                self._flush_with_retry(messages, touches)
+            except ROW_ERRORS as e:
+                logger.warning(f"批量写入 {len(messages)} 条消息出现数据错误，拆分批次定位问题行: {e}")
+                self._split_and_write(messages, touches, e, dropped)
+            except Exception as e:
+                error = e
+                for message in messages:
+                    dropped[id(message)] = e
+                logger.error(f"批量写入消息失败，丢弃 {len(messages)} 条: {e}")
+            written = len(messages) - len(dropped)
+            self.written += written
+            self.failed += len(dropped)
+            if error is None and (written or not messages):
+                self.batches += 1
+
+        for record in batch:
+            self._track(record, -1)
+            if record.ticket is not None:
+                record_error = error
+                for message in record.messages:
+                    if id(message) in dropped:
+                        record_error = dropped[id(message)]
+                        break
+                record.ticket.done(record_error)
+
+    def _split_and_write(self, messages, touches, error: Exception, dropped: Dict[int, Exception]):
+        """把出现数据错误的批次二分后分别写入，只丢弃单独写入仍失败的行"""
+        if len(messages) <= 1:
+            for message in messages:
+                logger.error(f"丢弃无法写入的消息 (session={message.get('session_id')}, "
+                             f"user={message.get('user_id')}, type={message.get('message_type')}): {error}")
+                dropped[id(message)] = error
+            return
+        middle = len(messages) // 2
+        first, second = messages[:middle], messages[middle:]
+        first_sessions = {m['session_id'] for m in first}
+        second_sessions = {m['session_id'] for m in second}
+        # 会话时间随对应的消息一起更新；没有消息的会话更新放在前一半
+        parts = (
+            (first, {s: t for s, t in touches.items() if s in first_sessions or s not in second_sessions}),
+            (second, {s: t for s, t in touches.items() if s in second_sessions})
+        )
+        for part, part_touches in parts:
+            try:
+                self._flush_with_retry(part, part_touches)
+            except ROW_ERRORS as e:
+                self._split_and_write(part, part_touches, e, dropped)
+            except Exception as e:
+                logger.error(f"写入拆分后的 {len(part)} 条消息失败，丢弃: {e}")
+                for message in part:
+                    dropped[id(message)] = e
+
+    def _flush_with_retry(self, messages, touches):
+        """写入一批记录，只对暂时性错误退避重试，其他错误直接抛出"""
+        delay = 0.1
+        for attempt in range(self.max_retries):
+            try:
+                self.flush_fn(messages, touches)
+                return
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                logger.warning(f"批量写入消息失败，{delay}秒后重试: {e}")
+                time.sleep(delay)
+                delay *= 2
+
+    def _write_inline(self, record: _Record):
+        """在调用线程中直接写入"""
+        self.inline_writes += 1
+        self.flush_fn(record.messages, record.touches)
+        self.written += len(record.messages)
@@ -0,0 +1,203 @@
+"""
+令牌桶限流
+
+替代 rate_limit_socket 中按sid保存时间戳列表的做法：
+- 每个key只保存 (令牌数, 上次更新时间)，每次检查O(1)
+- 令牌桶回满后状态与新key相同，空闲超过回满时间的key会被后台清理，
+  断开的客户端不会一直占用内存
+- 配置REDIS_URL时使用Redis保存桶状态（Lua脚本原子更新，key自动过期），
+  多个worker共享同一个限额；Redis不可用时降级为进程内限流
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class TokenBucketLimiter:
+    """进程内令牌桶限流器，按key分片加锁"""
+
+    def __init__(self, rate: float, burst: int, shards: int = 16, sweep_interval: float = 60):
+        # rate: 每秒补充的令牌数；burst: 桶容量（允许的突发请求数）
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.sweep_interval = sweep_interval
+        # 空闲超过该时间的桶已经回满，可以直接删除
+        self.idle_ttl = self.burst / self.rate if self.rate > 0 else float('inf')
+        self._shards = [({}, threading.Lock()) for _ in range(max(1, shards))]
+        self._sweeper = None
+        self._stop_event = threading.Event()
+        self.allowed = 0
+        self.rejected = 0
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def allow(self, key, cost: float = 1) -> Tuple[bool, float]:
+        """消耗cost个令牌，返回 (是否允许, 需要等待的秒数)"""
+        buckets, lock = self._shard(key)
+        now = time.monotonic()
+        with lock:
+            tokens, last = buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= cost:
+                buckets[key] = (tokens - cost, now)
+                self.allowed += 1
+                return True, 0.0
+            buckets[key] = (tokens, now)
+            self.rejected += 1
+            retry_after = (cost - tokens) / self.rate if self.rate > 0 else float('inf')
+            return False, retry_after
+
+    def reset(self, key):
+        """删除某个key的状态，例如客户端断开时"""
+        buckets, lock = self._shard(key)
+        with lock:
+            buckets.pop(key, None)
+
+    def sweep(self) -> int:
+        """清理已回满的空闲桶，返回清理数量"""
+        removed = 0
+        cutoff = time.monotonic() - self.idle_ttl
+        for buckets, lock in self._shards:
+            with lock:
+                idle = [key for key, (_, last) in buckets.items() if last <= cutoff]
+                for key in idle:
+                    del buckets[key]
+                removed += len(idle)
+        return removed
+
+    def start_sweeper(self):
+        """启动后台清理线程"""
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop_event.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name='rate-limit-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop_event.set()
+
+    def _sweep_loop(self):
+        while not self._stop_event.wait(self.sweep_interval):
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.debug(f"限流器清理空闲key: {removed}")
+            except Exception as e:
+                logger.error(f"限流器清理失败: {e}")
+
+    def __len__(self):
+        return sum(len(buckets) for buckets, _ in self._shards)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': 'memory',
+            'rate': self.rate,
+            'burst': self.burst,
+            'keys': len(self),
+            'allowed': self.allowed,
+            'rejected': self.rejected
+        }
+
+class RedisTokenBucketLimiter:
+    """Redis令牌桶限流器，多个worker共享限额，Redis异常时使用本地限流器"""
+
+    # KEYS[1]: 桶key；ARGV: rate, burst, cost, ttl(ms)
+    # 使用Redis服务器时间，避免各worker时钟不一致
+    _SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('time')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('pexpire', KEYS[1], ARGV[4])
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, client, rate: float, burst: int, prefix: str = 'aichat:ratelimit:',
+                 fallback: Optional[TokenBucketLimiter] = None):
+        self.client = client
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.prefix = prefix
+        self.fallback = fallback or TokenBucketLimiter(rate, burst)
+        # 桶回满后key自动过期
+        self._ttl_ms = int(max(1.0, self.burst / self.rate if self.rate > 0 else 3600) * 1000) + 1000
+        self._script = client.register_script(self._SCRIPT)
+        self.allowed = 0
+        self.rejected = 0
+        self.errors = 0
+
+    def allow(self, key, cost: float = 1) -> Tuple[bool, float]:
+        try:
+            allowed, tokens = self._script(
+                keys=[f"{self.prefix}{key}"],
+                args=[self.rate, self.burst, cost, self._ttl_ms]
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis限流失败，使用本地限流: {e}")
+            return self.fallback.allow(key, cost)
+        if int(allowed):
+            self.allowed += 1
+            return True, 0.0
+        self.rejected += 1
+        retry_after = (cost - float(tokens)) / self.rate if self.rate > 0 else float('inf')
+        return False, retry_after
+
+    def reset(self, key):
+        self.fallback.reset(key)
+        try:
+            self.client.delete(f"{self.prefix}{key}")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Redis限流key删除失败: {e}")
+
+    def sweep(self) -> int:
+        return self.fallback.sweep()
+
+    def start_sweeper(self):
+        self.fallback.start_sweeper()
+
+    def stop_sweeper(self):
+        self.fallback.stop_sweeper()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': 'redis',
+            'rate': self.rate,
+            'burst': self.burst,
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'fallback': self.fallback.stats()
+        }
+
+def create_rate_limiter(rate: float, burst: int, redis_config: Optional[Dict[str, Any]] = None,
+                        prefix: str = 'aichat:ratelimit:', client=None):
+    """创建限流器；配置了REDIS_URL且安装了redis时使用Redis共享状态"""
+    if client is None and redis_config and redis_config.get('url'):
+        try:
+            import redis
+            client = redis.Redis.from_url(redis_config['url'], decode_responses=True)
+        except ImportError:
+            logger.warning("已配置REDIS_URL但未安装redis，使用进程内限流")
+    if client is not None:
+        try:
+            return RedisTokenBucketLimiter(client, rate, burst, prefix=prefix)
+        except Exception as e:
+            logger.warning(f"Redis限流器初始化失败，使用进程内限流: {e}")
+    return TokenBucketLimiter(rate, burst)
@@ -0,0 +1,203 @@
+"""
+聊天请求调度器
+
+替代 app.py 中固定10个线程、队列无上限的 ThreadPoolExecutor：
+- 工作线程数在 min_workers 和 max_workers 之间自适应：提交时没有空闲线程就新建，
+  空闲超过 idle_timeout 的线程退出（eventlet下是绿色线程，创建成本很低）
+- 准入队列有界：总排队数达到 max_queue，或某个用户的排队数达到 max_queue_per_user 时，
+  submit 立即抛出 SchedulerBusy，附带按平均执行时间估算的 retry_after，
+  调用方返回503/busy，而不是让请求在队列里等到超时
+- 按用户公平：每个用户一个FIFO队列，空闲线程按轮转顺序从各用户队列取任务，
+  同一用户同时执行的任务不超过 max_running_per_user，单个用户无法占满所有线程
+- 每个任务的排队等待时间通过 on_wait 回调上报（app.py中记入Prometheus）
+
+对各AI服务的并发上限见 ai_services/concurrency.py。
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class SchedulerBusy(Exception):
+    """调度器已满，retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"调度器已满: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _Task:
+    __slots__ = ('key', 'future', 'fn', 'args', 'kwargs', 'enqueued')
+
+    def __init__(self, key, fn, args, kwargs):
+        self.key = key
+        self.future = Future()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued = time.monotonic()
+
+class FairScheduler:
+    """自适应线程数、有界、按用户公平的任务调度器"""
+
+    def __init__(self, name: str = 'scheduler', min_workers: int = 4, max_workers: int = 64,
+                 max_queue: int = 256, max_queue_per_user: int = 4, max_running_per_user: int = 4,
+                 idle_timeout: float = 60, on_wait: Optional[Callable[[float], None]] = None,
+                 on_reject: Optional[Callable[[str], None]] = None):
+        self.name = name
+        self.min_workers = min_workers
+        self.max_workers = max(max_workers, min_workers, 1)
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.max_running_per_user = max_running_per_user
+        self.idle_timeout = idle_timeout
+        self.on_wait = on_wait
+        self.on_reject = on_reject
+        # 用户 -> 排队中的任务；有任务的用户按轮转顺序排列
+        self._queues: "OrderedDict[Any, deque]" = OrderedDict()
+        self._running: Dict[Any, int] = {}
+        self._queued = 0
+        self._workers = 0
+        self._idle = 0
+        self._cond = threading.Condition()
+        # 平均执行时间和排队时间（指数滑动平均），用于估算retry_after；没有样本前按1秒估算
+        self._avg_runtime = 1.0
+        self._avg_wait = 0.0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, key, fn: Callable, *args, **kwargs) -> Future:
+        """以key（通常是用户ID）的名义提交任务，已满时抛出 SchedulerBusy"""
+        with self._cond:
+            user_queue = self._queues.get(key)
+            if self._queued >= self.max_queue:
+                self._reject('queue_full', self._queued / self.max_workers)
+            if user_queue is not None and len(user_queue) >= self.max_queue_per_user:
+                self._reject('user_queue_full', len(user_queue) / max(1, self.max_running_per_user))
+            task = _Task(key, fn, args, kwargs)
+            if user_queue is None:
+                user_queue = self._queues[key] = deque()
+            user_queue.append(task)
+            self._queued += 1
+            self.submitted += 1
+            # 被唤醒的空闲线程要拿到锁后才离开idle，按排队数和空闲数比较，避免漏掉唤醒
+            if self._queued > self._idle and self._workers < self.max_workers:
+                self._spawn()
+            else:
+                self._cond.notify()
+        return task.future
+
+    def _reject(self, reason: str, batches: float):
+        """按排在前面的任务批数 × 平均执行时间估算重试时间，调用方需持有锁"""
+        self.rejected += 1
+        if self.on_reject is not None:
+            self.on_reject(reason)
+        raise SchedulerBusy(reason, max(1.0, (batches + 1) * self._avg_runtime))
+
+    def _spawn(self):
+        """新建工作线程，调用方需持有锁"""
+        self._workers += 1
+        thread = threading.Thread(target=self._work, name=f'{self.name}-{self._workers}', daemon=True)
+        thread.start()
+
+    def _next_task(self) -> Optional[_Task]:
+        """按轮转顺序取下一个可执行的任务，调用方需持有锁"""
+        for key, user_queue in self._queues.items():
+            if self._running.get(key, 0) >= self.max_running_per_user:
+                continue
+            task = user_queue.popleft()
+            if user_queue:
+                # 该用户排到轮转末尾
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            self._queued -= 1
+            return task
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                task = self._next_task()
+                while task is None:
+                    self._idle += 1
+                    signalled = self._cond.wait(self.idle_timeout)
+                    self._idle -= 1
+                    task = self._next_task()
+                    if task is None and not signalled and self._workers > self.min_workers:
+                        self._workers -= 1
+                        return
+                if not task.future.set_running_or_notify_cancel():
+                    # 排队期间已被调用方取消（例如等待超时）
+                    continue
+                self._running[task.key] = self._running.get(task.key, 0) + 1
+            self._run(task)
+
+    def _run(self, task: _Task):
+        started = time.monotonic()
+        wait = started - task.enqueued
+        if self.on_wait is not None:
+            try:
+                self.on_wait(wait)
+            except Exception as e:
+                logger.warning(f"上报排队时间失败: {e}")
+        try:
+            task.future.set_result(task.fn(*task.args, **task.kwargs))
+        except BaseException as e:
+            task.future.set_exception(e)
+        runtime = time.monotonic() - started
+        with self._cond:
+            running = self._running[task.key] - 1
+            if running:
+                self._running[task.key] = running
+            else:
+                del self._running[task.key]
+            if self.completed:
+                self._avg_runtime += 0.1 * (runtime - self._avg_runtime)
+                self._avg_wait += 0.1 * (wait - self._avg_wait)
+            else:
+                self._avg_runtime, self._avg_wait = runtime, wait
+            self.completed += 1
+            # 该用户可能有因达到并发上限而等待的任务
+            if task.key in self._queues:
+                self._cond.notify()
+
+    def qsize(self) -> int:
+        return self._queued
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'workers': self._workers,
+                'idle': self._idle,
+                'queued': self._queued,
+                'running': sum(self._running.values()),
+                'users_queued': len(self._queues),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_runtime': round(self._avg_runtime, 3),
+                'avg_wait': round(self._avg_wait, 3)
+            }
+
+def create_scheduler(name: str, on_wait: Optional[Callable[[float], None]] = None,
+                     on_reject: Optional[Callable[[str], None]] = None) -> FairScheduler:
+    """按环境变量配置创建调度器"""
+    return FairScheduler(
+        name,
+        min_workers=int(os.getenv('CHAT_MIN_WORKERS', 4)),
+        max_workers=int(os.getenv('CHAT_MAX_WORKERS', 64)),
+        max_queue=int(os.getenv('CHAT_MAX_QUEUE', 256)),
+        max_queue_per_user=int(os.getenv('CHAT_MAX_QUEUE_PER_USER', 4)),
+        max_running_per_user=int(os.getenv('CHAT_MAX_RUNNING_PER_USER', 4)),
+        idle_timeout=float(os.getenv('CHAT_WORKER_IDLE_SECONDS', 60)),
+        on_wait=on_wait,
+        on_reject=on_reject
+    )
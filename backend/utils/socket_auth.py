@@ -0,0 +1,100 @@
+"""
+Socket连接级认证上下文
+
+token只在connect时验证一次，验证得到的用户信息和该用户拥有的会话ID
+保存在以sid为key的注册表中，disconnect时清理。之后每个事件只需要一次
+字典查找，而不是重新解析token、查询用户和会话。
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# loader(session_id, user_id) -> bool：该会话是否属于该用户
+OwnershipLoader = Callable[[str, Any], bool]
+
+class SocketContext:
+    """单个Socket连接的认证信息"""
+
+    __slots__ = ('sid', 'principal', 'user_id', 'sessions', 'connected_at')
+
+    def __init__(self, sid: str, principal: Any, sessions: Iterable[str] = ()):
+        self.sid = sid
+        self.principal = principal
+        self.user_id = principal.id
+        self.sessions: Set[str] = set(sessions)
+        self.connected_at = time.time()
+
+class SocketAuthRegistry:
+    """sid -> SocketContext 注册表，同时按用户索引连接"""
+
+    def __init__(self, max_sessions_per_connection: int = 1000):
+        self.max_sessions_per_connection = max_sessions_per_connection
+        self._contexts: Dict[str, SocketContext] = {}
+        self._by_user: Dict[Any, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, sid: str, principal: Any, sessions: Iterable[str] = ()) -> SocketContext:
+        """connect时登记已认证的连接"""
+        context = SocketContext(sid, principal, sessions)
+        with self._lock:
+            self._contexts[sid] = context
+            self._by_user.setdefault(context.user_id, set()).add(sid)
+        return context
+
+    def unregister(self, sid: str) -> Optional[SocketContext]:
+        """disconnect时清理连接"""
+        with self._lock:
+            context = self._contexts.pop(sid, None)
+            if context is not None:
+                sids = self._by_user.get(context.user_id)
+                if sids is not None:
+                    sids.discard(sid)
+                    if not sids:
+                        del self._by_user[context.user_id]
+        return context
+
+    def get(self, sid: str) -> Optional[SocketContext]:
+        return self._contexts.get(sid)
+
+    def owns(self, sid: str, session_id: str, loader: Optional[OwnershipLoader] = None) -> bool:
+        """该连接的用户是否拥有会话；未知会话通过loader查询一次并记住结果"""
+        context = self._contexts.get(sid)
+        if context is None:
+            return False
+        if session_id in context.sessions:
+            return True
+        if loader is None or not loader(session_id, context.user_id):
+            return False
+        # connect之后新建的会话
+        self.add_session(context.user_id, session_id)
+        return True
+
+    def add_session(self, user_id: Any, session_id: str):
+        """用户新建会话后，同步到该用户的所有连接"""
+        with self._lock:
+            for sid in self._by_user.get(user_id, ()):
+                sessions = self._contexts[sid].sessions
+                if len(sessions) < self.max_sessions_per_connection:
+                    sessions.add(session_id)
+
+    def remove_session(self, user_id: Any, session_id: str):
+        """用户删除会话后，从该用户的所有连接中移除"""
+        with self._lock:
+            for sid in self._by_user.get(user_id, ()):
+                self._contexts[sid].sessions.discard(session_id)
+
+    def __len__(self):
+        return len(self._contexts)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'connections': len(self._contexts),
+            'users': len(self._by_user)
+        }
+
+# 全局实例
+socket_registry = SocketAuthRegistry()
@@ -0,0 +1,415 @@
+"""
+分布式追踪
+
+每个HTTP请求和Socket事件开启一条trace（根span），之后在同一上下文中的操作记录为子span：
+- 认证、会话所有权校验、等待线程池等阶段由调用方用 tracer.span(...) 标记
+- 线程池任务通过 tracer.wrap(fn) 提交，携带调用方的上下文，并记录排队等待时间
+- AI服务的HTTP调用通过 ai_services.transport 的请求钩子记录，同时注入W3C traceparent头
+- SQLAlchemy查询通过 instrument_engine 注册的cursor事件记录
+
+上下文保存在contextvars中（eventlet下每个greenlet独立），线程池线程不会自动继承，
+必须通过wrap提交。
+
+采样：根span按 TRACE_SAMPLE_RATE 的概率采样（请求带有sampled标志的traceparent时跟随上游）。
+未采样的请求不设置上下文，之后的 span() 只做一次ContextVar读取，开销可以忽略；
+benchmarks/bench_tracing.py 给出了采样和未采样时每个请求的额外耗时。
+
+导出：span结束后放入有界队列，由后台线程批量写入JSONL文件（TRACE_EXPORTER=file）
+或以OTLP/HTTP JSON格式发送给collector（TRACE_EXPORTER=otlp）；队列满时丢弃并计数。
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('trace_span', default=None)
+
+class Span:
+    """一个已采样的span"""
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'start_time',
+                 'end_time', 'attributes', 'error')
+
+    def __init__(self, tracer: 'Tracer', name: str, trace_id: str, parent_id: Optional[str],
+                 attributes: Optional[Dict[str, Any]] = None, start_time: Optional[float] = None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_time = time.time() if start_time is None else start_time
+        self.end_time = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_error(self, error: Any):
+        self.error = str(error)
+
+    def end(self, end_time: Optional[float] = None):
+        if self.end_time is None:
+            self.end_time = time.time() if end_time is None else end_time
+            self.tracer.processor.on_end(self)
+
+    @property
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start_time,
+            'duration_ms': round((self.end_time - self.start_time) * 1000, 3),
+            'attributes': self.attributes,
+            'error': self.error
+        }
+
+class _NoopSpan:
+    """未采样时使用的空span"""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, error):
+        pass
+
+    def end(self, end_time=None):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class _NoopContext:
+    __slots__ = ()
+
+    def __enter__(self):
+        return NOOP_SPAN
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_CONTEXT = _NoopContext()
+
+class _ActiveSpan:
+    """把span设为当前上下文，退出时恢复并结束span"""
+    __slots__ = ('span', 'token')
+
+    def __init__(self, span: Span):
+        self.span = span
+        self.token = None
+
+    def __enter__(self) -> Span:
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self.token)
+        if exc is not None:
+            self.span.set_error(exc)
+        self.span.end()
+        return False
+
+def parse_traceparent(header: Optional[str]):
+    """解析W3C traceparent头，返回 (trace_id, parent_span_id, sampled)，无效时返回None"""
+    if not header:
+        return None
+    parts = header.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+class FileExporter:
+    """把span以JSON行追加到本地文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + '\n')
+
+class OTLPJsonExporter:
+    """以OTLP/HTTP JSON格式发送给collector（/v1/traces）"""
+
+    def __init__(self, endpoint: str, service_name: str, timeout: float = 5):
+        import requests
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    @staticmethod
+    def _value(value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {'boolValue': value}
+        if isinstance(value, int):
+            return {'intValue': str(value)}
+        if isinstance(value, float):
+            return {'doubleValue': value}
+        return {'stringValue': str(value)}
+
+    def _span(self, span: Span) -> Dict[str, Any]:
+        data = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 1,
+            'startTimeUnixNano': str(int(span.start_time * 1e9)),
+            'endTimeUnixNano': str(int(span.end_time * 1e9)),
+            'attributes': [{'key': key, 'value': self._value(value)} for key, value in span.attributes.items()],
+            'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+        }
+        if span.parent_id:
+            data['parentSpanId'] = span.parent_id
+        return data
+
+    def export(self, spans: List[Span]):
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+            'scopeSpans': [{'scope': {'name': 'ai-chat-backend'}, 'spans': [self._span(span) for span in spans]}]
+        }]}
+        response = self.session.post(self.endpoint, json=payload, timeout=self.timeout)
+        if response.status_code >= 400:
+            raise Exception(f"collector返回 {response.status_code}: {response.text[:200]}")
+
+class BatchSpanProcessor:
+    """有界队列 + 后台线程批量导出"""
+
+    def __init__(self, exporter, max_queue: int = 10000, batch_size: int = 256, interval: float = 2.0):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def on_end(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self.flush(wait=self.interval)
+
+    def flush(self, wait: float = 0):
+        """导出队列中的span；wait>0时最多等待这么久以凑满一批"""
+        batch = []
+        deadline = time.monotonic() + wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
+        try:
+            self.exporter.export(batch)
+            self.exported += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.warning(f"导出trace失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {'queued': self._queue.qsize(), 'exported': self.exported,
+                'dropped': self.dropped, 'failed': self.failed}
+
+class Tracer:
+    """创建span并维护当前上下文"""
+
+    def __init__(self, sample_rate: float = 0.0, processor: Optional[BatchSpanProcessor] = None):
+        self.sample_rate = sample_rate
+        self.processor = processor
+        self.enabled = processor is not None and sample_rate > 0
+
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, **attributes):
+        """开启一条trace，返回 (span, token)；未采样时返回 (None, None)
+
+        上游traceparent带sampled标志时跟随上游，否则按采样率决定。调用方需在结束时
+        调用 finish_trace(span, token)。
+        """
+        if not self.enabled:
+            return None, None
+        parent = parse_traceparent(traceparent)
+        if parent is not None and parent[2]:
+            trace_id, parent_id = parent[0], parent[1]
+        elif random.random() < self.sample_rate:
+            trace_id, parent_id = '%032x' % random.getrandbits(128), None
+        else:
+            return None, None
+        span = Span(self, name, trace_id, parent_id, attributes)
+        return span, _current_span.set(span)
+
+    def finish_trace(self, span: Optional[Span], token):
+        if span is None:
+            return
+        _current_span.reset(token)
+        span.end()
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes):
+        """在当前（或指定的）span下创建子span，不改变当前上下文；未采样时返回NOOP_SPAN"""
+        parent = parent or _current_span.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    def span(self, name: str, **attributes):
+        """子span上下文管理器；块内的操作以该span为父，未采样时返回共享的空上下文"""
+        parent = _current_span.get()
+        if parent is None:
+            return _NOOP_CONTEXT
+        return _ActiveSpan(Span(self, name, parent.trace_id, parent.span_id, attributes))
+
+    def traced(self, name: str):
+        """装饰器：已有trace时记录子span，否则开启一条新trace（用于Socket事件）"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if _current_span.get() is not None:
+                    with self.span(name):
+                        return fn(*args, **kwargs)
+                span, token = self.start_trace(name)
+                try:
+                    return fn(*args, **kwargs)
+                except BaseException as e:
+                    if span is not None:
+                        span.set_error(e)
+                    raise
+                finally:
+                    self.finish_trace(span, token)
+            return wrapper
+        return decorator
+
+    def wrap(self, fn: Callable, name: Optional[str] = None) -> Callable:
+        """把fn连同当前上下文一起交给线程池，并记录排队等待和执行的span"""
+        parent = _current_span.get()
+        if parent is None:
+            return fn
+        context = contextvars.copy_context()
+        submitted = time.time()
+        name = name or getattr(fn, '__name__', 'task')
+
+        def run(*args, **kwargs):
+            # 提交到开始执行之间的排队时间
+            Span(self, 'executor.queue', parent.trace_id, parent.span_id, {'task': name},
+                 start_time=submitted).end()
+
+            def call():
+                with self.span(f'executor.run {name}'):
+                    return fn(*args, **kwargs)
+            return context.run(call)
+        return run
+
+    def inject(self, headers: Dict[str, str]):
+        """把当前trace上下文写入HTTP请求头"""
+        span = _current_span.get()
+        if span is not None:
+            headers['traceparent'] = span.traceparent
+
+    @contextmanager
+    def http_client_span(self, method: str, url: str, headers: Dict[str, str]):
+        """ai_services.transport 的请求钩子：记录外部HTTP调用并注入traceparent"""
+        if _current_span.get() is None:
+            yield
+            return
+        with self.span(f'HTTP {method}', **{'http.method': method, 'http.url': url}) as span:
+            headers['traceparent'] = span.traceparent
+            yield
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {'enabled': self.enabled, 'sample_rate': self.sample_rate}
+        if self.processor is not None:
+            stats.update(self.processor.stats())
+        return stats
+
+def instrument_engine(tracer: Tracer, engine, max_statement: int = 300):
+    """为SQLAlchemy引擎的每次查询记录span"""
+    if not tracer.enabled:
+        return
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        parent = _current_span.get()
+        if parent is None:
+            return
+        span = tracer.start_span('db.query', parent, **{'db.statement': statement[:max_statement],
+                                                        'db.executemany': executemany})
+        conn.info.setdefault('trace_spans', []).append(span)
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get('trace_spans')
+        if spans:
+            spans.pop().end()
+
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        spans = conn.info.get('trace_spans') if conn is not None else None
+        if spans:
+            span = spans.pop()
+            span.set_error(exception_context.original_exception)
+            span.end()
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+
+def create_tracer() -> Tracer:
+    """按环境变量创建tracer；TRACE_SAMPLE_RATE为0（默认）时不追踪"""
+    sample_rate = float(os.getenv('TRACE_SAMPLE_RATE', 0))
+    if sample_rate <= 0:
+        return Tracer(0.0)
+    exporter_name = os.getenv('TRACE_EXPORTER', 'file').lower()
+    if exporter_name == 'otlp':
+        exporter = OTLPJsonExporter(
+            os.getenv('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces'),
+            os.getenv('TRACE_SERVICE_NAME', 'ai-chat-backend')
+        )
+    else:
+        exporter = FileExporter(os.getenv('TRACE_FILE', 'traces.jsonl'))
+    processor = BatchSpanProcessor(
+        exporter,
+        max_queue=int(os.getenv('TRACE_MAX_QUEUE', 10000)),
+        batch_size=int(os.getenv('TRACE_BATCH_SIZE', 256)),
+        interval=float(os.getenv('TRACE_EXPORT_INTERVAL', 2))
+    )
+    return Tracer(min(sample_rate, 1.0), processor)
+
+# 全局实例
+tracer = create_tracer()
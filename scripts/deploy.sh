@@ -27,7 +27,12 @@ echo "[4/7] 启动/重启后端服务..."
 if pgrep -f "gunicorn.*app:app" > /dev/null; then
     pkill -f "gunicorn.*app:app"
 fi
-gunicorn -w 2 -k eventlet -b 0.0.0.0:5000 app:app --daemon
+# 每个端口一个单worker进程，与nginx/nginx.conf的upstream一致（说明见start_all.sh）
+BACKEND_WORKERS=${BACKEND_WORKERS:-4}
+BACKEND_BASE_PORT=${BACKEND_BASE_PORT:-5000}
+for i in $(seq 0 $((BACKEND_WORKERS - 1))); do
+    gunicorn -w 1 -k eventlet -b 127.0.0.1:$((BACKEND_BASE_PORT + i)) app:app --daemon
+done
 cd ..
 
 # 5. 安装前端依赖并构建
@@ -17,7 +17,9 @@ const socket = io(window.location.origin, {
   reconnectionDelay: 1000,
   reconnectionAttempts: 5,
   timeout: 20000,
-  forceNew: true
+  forceNew: true,
+  // 连接时携带登录token，后端在connect时验证一次
+  auth: (cb) => cb({ token: localStorage.getItem('token') })
 })
 
 // Provide socket to all components
@@ -11,6 +11,8 @@ export default function useSocket() {
     reconnection: true,
     reconnectionDelay: 1000,
     reconnectionAttempts: 5,
-    timeout: 20000
+    timeout: 20000,
+    // 连接时携带登录token，后端在connect时验证一次
+    auth: (cb) => cb({ token: localStorage.getItem('token') })
   });
 }
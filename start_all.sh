@@ -28,7 +28,19 @@ flask db upgrade
 if pgrep -f "gunicorn.*app:app" > /dev/null; then
   pkill -f "gunicorn.*app:app"
 fi
-gunicorn -w 2 -k eventlet -b 0.0.0.0:5000 app:app --daemon --log-file "$LOGDIR/gunicorn.log"
+# Socket.IO不支持gunicorn的多worker（同一端口上无法粘滞），改为每个端口一个单worker进程，
+# 由nginx按客户端IP分发（nginx/nginx.conf的upstream需与这里的端口一致），
+# 进程之间的emit经由Redis消息队列转发，多进程时必须配置REDIS_URL
+BACKEND_WORKERS=${BACKEND_WORKERS:-4}
+BACKEND_BASE_PORT=${BACKEND_BASE_PORT:-5000}
+if [ "$BACKEND_WORKERS" -gt 1 ] && [ -z "$REDIS_URL" ] && [ -z "$SOCKETIO_MESSAGE_QUEUE" ] \
+    && ! grep -q "^REDIS_URL=." config.env; then
+  echo "警告：未配置REDIS_URL，多个后端进程之间无法互相推送Socket.IO消息。"
+fi
+for i in $(seq 0 $((BACKEND_WORKERS - 1))); do
+  PORT=$((BACKEND_BASE_PORT + i))
+  gunicorn -w 1 -k eventlet -b 127.0.0.1:$PORT app:app --daemon --log-file "$LOGDIR/gunicorn-$PORT.log"
+done
 cd "$WORKDIR"
 
 # 构建前端
@@ -42,5 +54,5 @@ cd "$WORKDIR"
 echo "[nginx] 重载..."
 sudo nginx -s reload || sudo systemctl restart nginx
 
-echo "所有服务已启动。后端日志: $LOGDIR/gunicorn.log"
+echo "所有服务已启动。后端日志: $LOGDIR/gunicorn-<端口>.log"
 echo "注意：如调用 stepchat、deepseek、step_star 相关 AI 服务，未补充实现时会抛出 NotImplementedError。" 
\ No newline at end of file